@@ -3,24 +3,43 @@
 Cython setup file
 
 Compile Cyton1 & Cyton1.5 model files to C
+
+Model kernels run in parallel with OpenMP. Set environment variable CYTON_NO_OPENMP=1 to build without it
+(e.g. macOS without libomp). Number of threads at runtime is controlled by OMP_NUM_THREADS.
 """
 
 
+import os
+import sys
 import numpy
 from distutils.core import setup, Extension
 from Cython.Build import cythonize
 
 
+if os.environ.get('CYTON_NO_OPENMP'):
+    openmp_compile_args, openmp_link_args = [], []
+elif sys.platform == 'win32':
+    openmp_compile_args, openmp_link_args = ['/openmp'], []
+elif sys.platform == 'darwin':
+    # Apple clang : requires libomp (brew install libomp)
+    openmp_compile_args, openmp_link_args = ['-Xpreprocessor', '-fopenmp'], ['-lomp']
+else:
+    openmp_compile_args, openmp_link_args = ['-fopenmp'], ['-fopenmp']
+
 extensions = [
     Extension(
         name="src.workbench.cyton1.c1_model",
         sources=["src/workbench/cyton1/c1_model.pyx"],
-        include_dirs=[numpy.get_include()]
+        include_dirs=[numpy.get_include()],
+        extra_compile_args=openmp_compile_args,
+        extra_link_args=openmp_link_args
     ),
     Extension(
         name="src.workbench.cyton15.c15_model",
         sources=["src/workbench/cyton15/c15_model.pyx"],
-        include_dirs=[numpy.get_include()]
+        include_dirs=[numpy.get_include()],
+        extra_compile_args=openmp_compile_args,
+        extra_link_args=openmp_link_args
     )
 ]
 
@@ -102,6 +102,34 @@ class ExportParams:
 			# automatically accept all incoming save requests for multiple fit options
 			accept()
 
+	def export_batch(self, results, comment='batch fit'):
+		"""
+		Write fitted parameters of many conditions into the parameter workbook at once (one load & one save).
+
+		:param results: (dict) condition index -> (fitted values, RSS)
+		:param comment: (str) comment of every row
+		"""
+		if config.FILE_LOADED:
+			input_file_name, input_file_ext = os.path.splitext(config.FULL_FILE_PATH)
+			output_file_name = input_file_name + '_params' + input_file_ext
+		else:
+			output_file_name = os.path.join(os.path.expanduser('~/Desktop'), 'cyton_solver_params.xlsx')
+		if os.path.isfile(output_file_name):
+			wb = openpyxl.load_workbook(output_file_name)
+			ws = wb['Cyton1 Fit'] if self.model_id == 'cyton1' else wb['Cyton1.5 Fit']
+		else:
+			wb, c1_ws, c15_ws = self._create_new_workbook()
+			ws = c1_ws if self.model_id == 'cyton1' else c15_ws
+
+		now = datetime.now().replace(microsecond=0)
+		print("[{0}] Saving {1} parameters of {2} conditions...".format(now, self.model_id, len(results)), end='')
+		for icnd in sorted(results):
+			fitted, rss = results[icnd]
+			ws.append([now, gvars.CONDITIONS[icnd]] + list(fitted) + [rss, comment])
+		adjust_column_length(ws)
+		wb.save(output_file_name)
+		print("done")
+
 	@staticmethod
 	def _create_new_workbook():
 		workbook = openpyxl.Workbook()
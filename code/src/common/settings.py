@@ -25,6 +25,17 @@ CYTON15_CONFIG = {
 # 	'stim_dd': 'Gaussian'
 # }
 
+# Cyton 1.5 generation truncation : generations whose live cells are bounded by CYTON15_GEN_TOL x initial cells (in
+# total) are not evaluated. Set to 0 to only skip generations that cannot be reached within the time grid
+CYTON15_GEN_TOL = 1E-12
+
+# fit engine : 'lmfit' (lmfit.Minimizer) or 'scipy' (SciPy optimisers on parameter vectors, see fit.fit_direct)
+FIT_ENGINE = 'lmfit'
+
+# fit history (see history.py) : 'off', 'suggest' (print the best previous fit of the same or the most similar dataset)
+# or 'auto' (start varying parameters from it). every finished fit is recorded unless 'off'
+WARM_START = 'suggest'
+
 # program specific settings
 CONSOLE = None
 TOGGLE_CONSOLE = False  # console state check
@@ -15,7 +15,6 @@ from src.IO.import_params import ImportParams
 from src.IO.export_plots import ExportPlot
 from src.qmods.thread import BackThread
 from src.qmods.spinbox import SpinBox
-# from src.workbench.bootstrap import bootstrap
 
 
 class ButtonManager:
@@ -121,16 +120,21 @@ class ButtonManager:
 			obj_name = btn.objectName()
 			if obj_name == 'LM':
 				for idx, option in reversed(list(enumerate(options))):
-					if idx > 7:
+					if idx > 11:
 						option.hide()
 					else:
 						option.show()
 			elif obj_name == 'DE':
 				for idx, option in enumerate(options):
-					if idx > 7:
+					if idx > 11:
 						option.show()
 					else:
 						option.hide()
+			# joint fits run least squares only : shared parameters are not available with DE
+			for opt in shared_params:
+				opt.setEnabled(obj_name == 'LM')
+				if obj_name == 'DE':
+					opt.setChecked(False)
 
 		def batch_fit():
 			if _batch_fit.isChecked():
@@ -180,14 +184,6 @@ class ButtonManager:
 
 				self.parent.c15_plot.update_plot()
 
-			# TODO: complete the bootstrap function. The core method is implemented and it works on standalone script, however, it fails when the program fork/spawn another processor for some reason.
-			try:
-				if self.boot_settings['on']:
-					raise NotImplementedError("Bootstrapping is not supported yet")
-					# bootstrap(gvars.C15_ICND, result, self.boot_settings['iter'], self.boot_settings['range'])
-			except NotImplementedError as ne:
-				print("[NOT IMPLEMENTED ERROR] {0}".format(ne))
-
 		def abort_fit(thread):
 			# send abort signal down to spawned thread -> this is custom method
 			thread.stop()
@@ -211,6 +207,8 @@ class ButtonManager:
 				algo_settings.append(ftol_box.value())
 				algo_settings.append(xtol_box.value())
 				algo_settings.append(gtol_box.value())
+				algo_settings.append(jac_box.isChecked())
+				algo_settings.append(multistart_box.value())
 			elif _DE.isChecked():
 				algo_settings.append('DE')
 				algo_settings.append(de_iter_box.value())
@@ -218,15 +216,21 @@ class ButtonManager:
 				algo_settings.append(reltol_box.value())
 				algo_settings.append(abstol_box.value())
 
-			batch_settings = [_batch_fit.isChecked(), selectable_conditions, self.data_select]
+			shared = [opt.text() for opt in shared_params if opt.isChecked()] if _LM.isChecked() else []
+			batch_settings = [_batch_fit.isChecked(), selectable_conditions, self.data_select, shared]
 			self.boot_settings['on'] = _ci.isChecked()
 			self.boot_settings['iter'] = ci_iter.value()
 			self.boot_settings['range'] = ci_range.value()
 
 			fit_total_cells = _fit_to_total_cells.isChecked()
+			config.FIT_ENGINE = 'scipy' if _direct_engine.isChecked() else 'lmfit'
+			if config.WARM_START != 'off':
+				config.WARM_START = 'auto' if _warm_start.isChecked() else 'suggest'
 
 			# spawn a thread to put fitting in background process
-			thread = BackThread(self.model_id, algo_settings, batch_settings, fit_total_cells, self.boot_settings)
+			thread = BackThread(
+				self.model_id, algo_settings, batch_settings, fit_total_cells, self.boot_settings, _force_refit.isChecked()
+			)
 			thread.finished[str, list].connect(when_fit_finished)
 			thread.start()
 
@@ -280,6 +284,13 @@ class ButtonManager:
 				gtol_box.setButtonSymbols(2)
 				gtol_box.setDecimals(10)
 				gtol_box.setValue(0.0)
+				jac_box_label = QLabel("Analytic Jacobian: ")
+				jac_box = QCheckBox()
+				jac_box.setChecked(False)  # finite differences by default
+				multistart_box_label = QLabel("Multi-start runs (0: off): ")
+				multistart_box = QSpinBox()
+				multistart_box.setRange(0, 9999)
+				multistart_box.setValue(0)
 
 				_opt_layout.addWidget(lm_iter_box_label, 0, 0)
 				_opt_layout.addWidget(lm_iter_box, 0, 1)
@@ -289,6 +300,10 @@ class ButtonManager:
 				_opt_layout.addWidget(xtol_box, 2, 1)
 				_opt_layout.addWidget(gtol_box_label, 3, 0)
 				_opt_layout.addWidget(gtol_box, 3, 1)
+				_opt_layout.addWidget(jac_box_label, 4, 0)
+				_opt_layout.addWidget(jac_box, 4, 1)
+				_opt_layout.addWidget(multistart_box_label, 5, 0)
+				_opt_layout.addWidget(multistart_box, 5, 1)
 
 				# Differential Evolution algorithm
 				_DE = QRadioButton("Differential Evolution")
@@ -315,14 +330,14 @@ class ButtonManager:
 				abstol_box.setValue(0)
 				abstol_box.setRange(1E-10, 99999)
 
-				_opt_layout.addWidget(de_iter_box_label, 4, 0)
-				_opt_layout.addWidget(de_iter_box, 4, 1)
-				_opt_layout.addWidget(popsize_box_label, 5, 0)
-				_opt_layout.addWidget(popsize_box, 5, 1)
-				_opt_layout.addWidget(reltol_box_label, 6, 0)
-				_opt_layout.addWidget(reltol_box, 6, 1)
-				_opt_layout.addWidget(abstol_box_label, 7, 0)
-				_opt_layout.addWidget(abstol_box, 7, 1)
+				_opt_layout.addWidget(de_iter_box_label, 6, 0)
+				_opt_layout.addWidget(de_iter_box, 6, 1)
+				_opt_layout.addWidget(popsize_box_label, 7, 0)
+				_opt_layout.addWidget(popsize_box, 7, 1)
+				_opt_layout.addWidget(reltol_box_label, 8, 0)
+				_opt_layout.addWidget(reltol_box, 8, 1)
+				_opt_layout.addWidget(abstol_box_label, 9, 0)
+				_opt_layout.addWidget(abstol_box, 9, 1)
 				opt_group_box.setLayout(_opt_layout)
 
 				# collect all options in an array for easy iteration
@@ -331,6 +346,8 @@ class ButtonManager:
 					ftol_box_label, ftol_box,
 					xtol_box_label, xtol_box,
 					gtol_box_label, gtol_box,
+					jac_box_label, jac_box,
+					multistart_box_label, multistart_box,
 					de_iter_box_label, de_iter_box,
 					popsize_box_label, popsize_box,
 					reltol_box_label, reltol_box,
@@ -339,7 +356,7 @@ class ButtonManager:
 
 				opt_group_box.setSizePolicy(QSizePolicy.MinimumExpanding, QSizePolicy.MinimumExpanding)
 				for i, option in enumerate(options):
-					if i > 7:
+					if i > 11:
 						option.hide()
 
 				_LM.toggled.connect(lambda: algo_option_btn(_LM, options))
@@ -365,6 +382,20 @@ class ButtonManager:
 				_fit_to_total_cells = QCheckBox("Fit to total cells")
 				_ext_option_layout.addWidget(_fit_to_total_cells, 0, 2)
 
+				# SciPy optimisers on parameter vectors (bypass lmfit wrappers)
+				_direct_engine = QCheckBox("Direct SciPy engine")
+				_direct_engine.setChecked(config.FIT_ENGINE == 'scipy')
+				_ext_option_layout.addWidget(_direct_engine, 0, 3)
+
+				# start from the best previous fit of this (or the most similar) dataset : see history.py
+				_warm_start = QCheckBox("Warm start (fit history)")
+				_warm_start.setChecked(config.WARM_START == 'auto')
+				_ext_option_layout.addWidget(_warm_start, 0, 4)
+
+				# run the fit even if an identical one finished in this session : see fit_cache.py
+				_force_refit = QCheckBox("Force refit")
+				_ext_option_layout.addWidget(_force_refit, 0, 5)
+
 				_ext_option.setLayout(_ext_option_layout)
 
 				_top_layout.addWidget(group_box)
@@ -390,6 +421,20 @@ class ButtonManager:
 					if col == 4:
 						row += 1
 						col = 0
+				# parameters shared by all selected conditions (joint fit; Cyton 1.5 only)
+				shared_params = []
+				if self.model_id == 'cyton1.5':
+					row += 1
+					ext_options_layout.addWidget(QLabel("Shared parameters (joint fit) : "), row, 0, 1, 4)
+					row, col = row + 1, 0
+					for key in gvars.C15_PARAMS:
+						opt = QCheckBox(key)
+						ext_options_layout.addWidget(opt, row, col)
+						shared_params.append(opt)
+						col += 1
+						if col == 4:
+							row += 1
+							col = 0
 				ext_options.setLayout(ext_options_layout)
 				ext_options.hide()
 
@@ -9,27 +9,36 @@ from PyQt5.Qt import QThread, pyqtSignal
 
 import src.common.global_vars as gvars
 from src.IO.error_handler import CustomError
+from src.IO.export_params import ExportParams
+from src.workbench.batch import batch_fit
+from src.workbench.bootstrap import bootstrap
+from src.workbench.control import FitControl, FitAborted
 from src.workbench.fit import fit_to_cyton1, fit_to_cyton15
+from src.workbench.joint import joint_batch_fit
 
 
 class BackThread(QThread):
 
 	finished = pyqtSignal(str, list)
 
-	def __init__(self, model_id, algo_settings, batch_settings, fit_to_total_cells, boot_settings):
+	def __init__(self, model_id, algo_settings, batch_settings, fit_to_total_cells, boot_settings, force_refit=False):
 		QThread.__init__(self)
 		self.setTerminationEnabled(True)
 		self.is_running = True
+		self.control = FitControl()  # abort token & progress of the fit (shared with worker processes)
 
 		self.model_to_fit = model_id
 		self.algo_settings = algo_settings
 
 		# special options
 		self.batch_fit = batch_settings[0]
-		self.conditions = batch_settings[1]
+		self.conditions = [icnd for icnd, opt in enumerate(batch_settings[1]) if opt.isChecked()]  # selected conditions
 		self.sd = batch_settings[2]
+		self.shared = batch_settings[3] if len(batch_settings) > 3 else []  # parameters shared in a joint fit
 
 		self.fit_to_total_cells = fit_to_total_cells
+		self.boot_settings = boot_settings
+		self.force_refit = force_refit  # ignore stored results of identical fits (see fit_cache.py)
 
 		if self.model_to_fit == 'cyton1':
 			self.fitted_params = [
@@ -54,20 +63,20 @@ class BackThread(QThread):
 	def run(self):
 		try:
 			if self.model_to_fit == 'cyton1':
-				if self.batch_fit:
-					raise NotImplementedError("Fitting multiple conditions is not implemented for Cyton 1 yet")
-				elif self.fit_to_total_cells:
+				if self.fit_to_total_cells:
 					raise NotImplementedError("Fitting to total cell number is not implemented for Cyton 1 yet")
+				elif self.batch_fit:
+					self.run_batch(gvars.C1_ICND)
 				else:
 					self.fitted_params = fit_to_cyton1(self, self.algo_settings)
+					self.compute_ci(gvars.C1_ICND)
 					self.done()
 			elif self.model_to_fit == 'cyton1.5':
 				if self.batch_fit:
-					# TODO: finish implementing batch fitting feature.
-					raise NotImplementedError("This feature is not implemented for Cyton 1.5 yet")
-				# TODO: implement 3Factor model for fitting all conditions at once while sharing target parameters
+					self.run_batch(gvars.C15_ICND)
 				else:
 					self.fitted_params = fit_to_cyton15(self, self.algo_settings, self.fit_to_total_cells)
+					self.compute_ci(gvars.C15_ICND)
 					self.done()
 		except NotImplementedError as ne:
 			print("[NOT IMPLEMENTED ERROR] {0}".format(ne))
@@ -77,8 +86,59 @@ class BackThread(QThread):
 		except Exception as e:
 			print("[DEBUG MESSAGE] {0}".format(e))
 
+	def run_batch(self, icnd):
+		# selected conditions are fitted (independently on a process pool, or jointly) & saved together
+		# GUI shows the fit of current condition
+		try:
+			if self.shared and self.model_to_fit == 'cyton1.5' and not self.fit_to_total_cells:
+				# all conditions at once while sharing target parameters
+				comment = 'joint fit (shared: {0})'.format(', '.join(self.shared))
+				results = joint_batch_fit(self.conditions, self.shared, self.algo_settings, self.control)
+			else:
+				# conditions finished before an abort are returned
+				comment = 'batch fit'
+				results = batch_fit(self.model_to_fit, self.conditions, self.algo_settings, self.fit_to_total_cells, self.control)
+		except FitAborted:
+			results = {}  # a joint fit has no partial result
+		if not self.control.is_running:
+			now = datetime.now().replace(microsecond=0)
+			print("[{0}] {1} aborted : {2} of {3} conditions kept".format(
+				now, comment.capitalize(), len(results), len(self.conditions)))
+			comment += ' (aborted)'
+		if results:
+			ExportParams(self.model_to_fit).export_batch(results, comment)
+		if icnd in results:
+			self.fitted_params, rss = results[icnd]
+			if self.model_to_fit == 'cyton1':
+				gvars.C1_PREV_SS, gvars.C1_SS = gvars.C1_SS, rss
+			else:
+				gvars.C15_PREV_SS, gvars.C15_SS = gvars.C15_SS, rss
+		self.done()
+
+	def compute_ci(self, icnd):
+		# bootstrap replicates are fitted on a process pool, warm started from the fitted parameters
+		if self.boot_settings['on']:
+			if self.fit_to_total_cells:
+				# fitted parameters are still reported
+				print("[NOT IMPLEMENTED ERROR] Bootstrapping total cell fits is not implemented yet")
+				return
+			if not self.control.is_running:
+				return  # fit was aborted : no intervals for its last parameters
+			try:
+				bootstrap(
+					self.model_to_fit, icnd, self.fitted_params, self.boot_settings['iter'], self.boot_settings['range'],
+					self.algo_settings, self.control
+				)
+			except NotImplementedError as ne:
+				# fitted parameters are still reported
+				print("[NOT IMPLEMENTED ERROR] {0}".format(ne))
+			except FitAborted:
+				now = datetime.now().replace(microsecond=0)
+				print("[{0}] Bootstrap aborted : fitted parameters are kept".format(now))
+
 	def stop(self):
 		self.is_running = False
+		self.control.abort()
 
 	def done(self):
 		self.is_running = False
@@ -0,0 +1,130 @@
+"""
+This module fits many conditions of a dataset at once. Every selected condition is an independent job on a process pool.
+
+Jobs carry a picklable Cyton model, the (x, y) data & parameters of one condition and run the direct SciPy engine
+(see fit.fit_direct) in a worker. Results stream back as they finish; progress is reported per condition and all
+results are returned together, so that the parameter workbook is written once at the end.
+"""
+
+import io
+import time
+import numpy as np
+import psutil
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from lmfit import Parameters
+
+import src.common.global_vars as gvars
+from src.workbench.control import FitControl, FitAborted
+from src.workbench.cyton1 import Cyton1Model
+from src.workbench.cyton15 import Cyton15Model
+from src.workbench.bootstrap import parameter_settings
+from src.workbench.data_layout import pack_condition, flatten
+from src.workbench.fit import fit_direct, C15_JAC, FIT_SEED
+
+# per process state of a worker
+_worker = {}
+
+
+def condition_data(model_id, icnd, fit_to_total_cells=False):
+	"""
+	:param model_id: (str) 'cyton1' or 'cyton1.5'
+	:param icnd: (int) index of condition in a dataset
+	:param fit_to_total_cells: (bool) fit Cyton 1.5 to total cell numbers instead of cell-generation profiles
+	:return: (tuple) Cyton model, x & y of the condition (same layout as fit_to_cyton1/fit_to_cyton15)
+	"""
+	num_reps = [len(l) for l in gvars.CELL_GENS_REPS[icnd]]
+	check = gvars.C1_CHECK[icnd] if model_id == 'cyton1' else gvars.C15_CHECK[icnd]
+	if fit_to_total_cells:
+		x = np.array(gvars.EXP_HT_REPS[icnd])
+		y = np.array(gvars.TOTAL_CELLS_REPS[icnd])
+	else:
+		x, y = flatten(*pack_condition(gvars.CELL_GENS_REPS[icnd], check, num_reps, gvars.MAX_DIV_PER_CONDITIONS[icnd]))
+
+	if model_id == 'cyton1':
+		model = Cyton1Model(gvars.EXP_HT[icnd], gvars.INIT_CELL, gvars.MAX_DIV, gvars.TIME_INC, num_reps, check)
+	else:
+		model = Cyton15Model(
+			gvars.EXP_HT[icnd], gvars.INIT_CELL, gvars.MAX_DIV, gvars.TIME_INC, num_reps, check, fit_to_total_cells
+		)
+	return model, x, y
+
+
+def _init_worker(abort_event):
+	_worker['abort_event'] = abort_event
+
+
+def _fit_condition(icnd, model_id, model, x, y, pars, algo_settings):
+	"""
+	Fit one condition in a worker process (iteration messages of the engine are not printed).
+
+	:return: (tuple) condition index, fitted values (in the order of 'pars'), RSS, number of evaluations, success flag
+		& elapsed time
+	"""
+	start = time.time()
+	model.control = FitControl(_worker['abort_event'])
+	with redirect_stdout(io.StringIO()):
+		if model_id == 'cyton1':
+			result = fit_direct(model, model.cyton1_model, model.cyton1_jacobian, pars, x, y, algo_settings)
+		else:
+			result = fit_direct(
+				model, model.cyton15, model.cyton15_jacobian, pars, x, y, algo_settings, jac=C15_JAC, seed=FIT_SEED
+			)
+	fitted = list(result.params.valuesdict().values())
+	return icnd, fitted, result.chisqr, result.nfev, result.success, time.time() - start
+
+
+def batch_fit(model_id, conditions, algo_settings, fit_to_total_cells=False, control=None, workers=None):
+	"""
+	Fit selected conditions concurrently, every condition from the current parameters (gvars) & bounds.
+
+	:param model_id: (str) 'cyton1' or 'cyton1.5'
+	:param conditions: (list) indices of conditions to fit
+	:param algo_settings: (list) settings from fit dialog
+	:param fit_to_total_cells: (bool) fit Cyton 1.5 to total cell numbers
+	:param control: (FitControl) run-time control : its abort token stops all workers
+	:param workers: (int) number of processes (default : number of physical cores)
+	:return: (dict) condition index -> (fitted values, RSS) of finished conditions (also if the fit is aborted)
+	"""
+	if control is None:
+		control = FitControl()
+	if workers is None:
+		workers = int(psutil.cpu_count(logical=False) or 1)
+	current = list(gvars.C1_PARAMS.values()) if model_id == 'cyton1' else list(gvars.C15_PARAMS.values())
+	names, values, vary, lower, upper = parameter_settings(model_id, current)
+	pars = Parameters()
+	for name, value, var, lo, hi in zip(names, values, vary, lower, upper):
+		pars.add(name, value=value, min=lo, max=hi, vary=bool(var))
+
+	print(" > Batch fit : {0} conditions on {1} processes".format(len(conditions), workers))
+	results, nfinished = {}, 0
+	try:
+		with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(control.abort_event,)) as pool:
+			pending = set()
+			for icnd in conditions:
+				model, x, y = condition_data(model_id, icnd, fit_to_total_cells)
+				pending.add(pool.submit(_fit_condition, icnd, model_id, model, x, y, pars, algo_settings))
+			while pending:
+				done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+				for future in done:
+					nfinished += 1
+					try:
+						icnd, fitted, rss, nfev, success, elapsed = future.result()
+					except FitAborted:
+						continue  # stopped by the abort token
+					except Exception as ex:
+						print(" > > [{0}/{1}] failed : {2}".format(nfinished, len(conditions), ex))
+						continue
+					results[icnd] = (fitted, rss)
+					control.record(fitted, n=nfev)
+					print(" > > [{0}/{1}] {2} : RSS {3:.5e} ({4} evaluations, {5:.1f} s){6}".format(
+						nfinished, len(conditions), gvars.CONDITIONS[icnd], rss, nfev, elapsed,
+						'' if success else ' - not converged'))
+				# conditions finished before an abort are kept
+				if not control.is_running:
+					for future in pending:
+						future.cancel()
+					control.check()
+	except FitAborted:
+		print(" > Batch fit aborted : {0} of {1} conditions finished".format(len(results), len(conditions)))
+	return results
@@ -0,0 +1,149 @@
+"""
+This module benchmarks objective function evaluations of Cyton models on a synthetic experiment and checks their
+Jacobians against finite differences.
+
+Run from the project root (after compiling the Cython files) :
+	python -m src.workbench.benchmark
+"""
+
+import time
+import tracemalloc
+import numpy as np
+
+from src.workbench.cyton1 import Cyton1Model
+from src.workbench.cyton15 import Cyton15Model
+from src.workbench.workspace import Workspace
+
+# synthetic experiment : 6 harvest times, 3 replicates, 8 divisions
+HARVEST_TIMES = [0., 16., 54., 80., 106., 120.]
+NUM_REPS = [3] * len(HARVEST_TIMES)
+MAX_DIV = 8
+INIT_CELL = 10000.
+
+# typical parameter values (in the order of model arguments)
+C1_PARAMS = [40.0, 0.2, 60.0, 0.2, 15.0, 0.5, 13.0, 0.4, 0.9, 5.0, 2.0, 0.1, 0.5]
+C15_PARAMS = [15.0, 0.5, 25.0, 0.2, 75.0, 0.2, 50.0, 0.15, 10.0, 0.7]
+
+
+def synthetic_check(max_div=MAX_DIV):
+	# include all data points
+	return [[[True] * (max_div+1) for _ in range(reps)] for reps in NUM_REPS]
+
+
+def time_per_call(func, args, repeats):
+	"""
+	:return: (float) best wall time per call [s] out of 3 rounds of 'repeats' calls
+	"""
+	best = np.inf
+	for _ in range(3):
+		start = time.perf_counter()
+		for _ in range(repeats):
+			func(None, *args)
+		best = min(best, (time.perf_counter() - start) / repeats)
+	return best
+
+
+def profile_workspace(model, func, args, repeats):
+	"""
+	Measure one model evaluation with and without buffer reuse.
+
+	:return: (list) [workspace enabled, buffer allocations per call, traced peak memory per call [kB], time per call [ms]]
+	"""
+	rows = []
+	for enabled in (False, True):
+		model.workspace = Workspace(enabled=enabled)
+		func(None, *args)  # warm up : allocates workspace buffers once
+
+		model.workspace.allocations = 0
+		tracemalloc.start()
+		func(None, *args)
+		peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+		allocations = model.workspace.allocations
+
+		rows.append([enabled, allocations, peak / 1024., 1E3 * time_per_call(func, args, repeats)])
+	return rows
+
+
+def benchmark_workspace(dts=(1., 0.5, 0.1), repeats=20):
+	"""
+	Print allocation count & wall time per evaluation of both models before (no reuse) and after (workspace) buffer reuse.
+	"""
+	check = synthetic_check()
+	print("{0:22s} {1:>6s} {2:>10s} {3:>13s} {4:>12s} {5:>10s}".format('model', 'dt', 'workspace', 'allocs/call', 'peak [kB]', 'ms/call'))
+	for dt in dts:
+		configs = [('Cyton 1 (direct)', Cyton1Model(HARVEST_TIMES, INIT_CELL, MAX_DIV, dt, NUM_REPS, check, kernel='direct'), 'cyton1_model', C1_PARAMS)]
+		if dt >= 0.5:  # O(n^2) memory
+			configs.append(('Cyton 1 (matrix)', Cyton1Model(HARVEST_TIMES, INIT_CELL, MAX_DIV, dt, NUM_REPS, check, kernel='matrix'), 'cyton1_model', C1_PARAMS))
+		configs.append(('Cyton 1.5', Cyton15Model(HARVEST_TIMES, INIT_CELL, MAX_DIV, dt, NUM_REPS, check, False), 'cyton15', C15_PARAMS))
+
+		for name, model, method, params in configs:
+			for enabled, allocations, peak, ms in profile_workspace(model, getattr(model, method), params, repeats):
+				print("{0:22s} {1:6.2f} {2:>10s} {3:13d} {4:12.1f} {5:10.3f}".format(
+					name, dt, 'on' if enabled else 'off', allocations, peak, ms))
+
+
+def benchmark_harvest_only(dts=(1., 0.5, 0.1, 0.05), repeats=50):
+	"""
+	Print wall time per evaluation of Cyton 1.5 on the full time grid vs. at harvest time points only.
+	"""
+	check = synthetic_check()
+	print("{0:6s} {1:>12s} {2:>12s} {3:>16s}".format('dt', 'full [ms]', 'harvest [ms]', 'max abs diff'))
+	for dt in dts:
+		model = Cyton15Model(HARVEST_TIMES, INIT_CELL, MAX_DIV, dt, NUM_REPS, check, False)
+		for cache in model.dist_cache.values():
+			cache.size = 0  # time distribution evaluations as well
+		results = []
+		for harvest_only in (False, True):
+			model.harvest_only = harvest_only
+			prediction = model.cyton15(None, *C15_PARAMS).copy()
+			results.append((prediction, 1E3 * time_per_call(model.cyton15, C15_PARAMS, repeats)))
+		(full, full_ms), (harvest, harvest_ms) = results
+		print("{0:6.2f} {1:12.3f} {2:12.3f} {3:16.3e}".format(dt, full_ms, harvest_ms, np.max(np.abs(full - harvest))))
+
+
+def benchmark_model_results(dts=(1., 0.5, 0.25, 0.1), repeats=10):
+	"""
+	Print wall time of Cyton 1.5 trajectory computation (live & dead cells on the full time grid, as used by the GUI).
+	"""
+	params = dict(zip(
+		['unstimMuDeath', 'unstimSigDeath', 'stimMuDiv', 'stimSigDiv', 'stimMuDeath', 'stimSigDeath', 'stimMuDD', 'stimSigDD', 'SubDivTime', 'pfrac'],
+		C15_PARAMS
+	))
+	print("{0:6s} {1:>8s} {2:>10s}".format('dt', 'points', 'ms/call'))
+	for dt in dts:
+		model_times = np.arange(0.0, max(HARVEST_TIMES)+dt, dt)
+		model = Cyton15Model(HARVEST_TIMES, INIT_CELL, MAX_DIV, dt, [], [], False)
+		best = np.inf
+		for _ in range(repeats):
+			start = time.perf_counter()
+			model.compute_model_results(model_times, params)
+			best = min(best, time.perf_counter() - start)
+		print("{0:6.2f} {1:8d} {2:10.3f}".format(dt, model_times.size, 1E3 * best))
+
+
+def check_jacobians(dts=(1., 0.5, 0.25, 0.1), tol=1E-7):
+	"""
+	Check analytic Jacobians of both models against finite differences (raise AssertionError beyond 'tol'). The 'b'
+	column of Cyton 1.5 is a secant & is not checked (see Cyton15Model.check_jacobian).
+	"""
+	check = synthetic_check()
+	print("{0:10s} {1:>6s} {2:>12s} {3:>14s}".format('model', 'dt', 'max error', 'parameter'))
+	for dt in dts:
+		for name, model, params in [
+			('Cyton 1', Cyton1Model(HARVEST_TIMES, INIT_CELL, MAX_DIV, dt, NUM_REPS, check), C1_PARAMS),
+			('Cyton 1.5', Cyton15Model(HARVEST_TIMES, INIT_CELL, MAX_DIV, dt, NUM_REPS, check, False), C15_PARAMS)
+		]:
+			errors = model.check_jacobian(params, tol=tol)
+			worst = max(errors, key=errors.get)
+			print("{0:10s} {1:6.2f} {2:12.3e} {3:>14s}".format(name, dt, errors[worst], worst))
+
+
+if __name__ == '__main__':
+	check_jacobians()
+	print()
+	benchmark_workspace()
+	print()
+	benchmark_harvest_only()
+	print()
+	benchmark_model_results()
@@ -0,0 +1,177 @@
+"""
+This module keeps bootstrap results on disk so that a long bootstrap survives a crash of the GUI or of a worker.
+
+Every finished replicate is appended to a binary log (fixed size records : replicate index, seed, RSS, number of model
+evaluations & fitted parameters) and flushed to disk straight away. A small JSON file next to it describes the run
+(model, condition, parameter names, original fit & data fingerprint) & keeps the root seed; a bootstrap with the same
+description resumes from the replicates already in the log with the same replicate seeds. A partially written record at
+the end of the log is dropped.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+from scipy.stats import norm
+
+import src.common.settings as config
+
+
+def default_store_path(model_id, condition):
+	"""
+	:param model_id: (str) 'cyton1' or 'cyton1.5'
+	:param condition: (str) name of the condition
+	:return: (str) path of the store (without extension) next to the data file, or on the desktop in data free mode
+	"""
+	tag = '_boot_{0}_{1}'.format(model_id, condition).replace(' ', '_')
+	if config.FILE_LOADED:
+		input_file_name, _ = os.path.splitext(config.FULL_FILE_PATH)
+		return input_file_name + tag
+	default_path = os.path.expanduser('~/Desktop')
+	if not os.path.isdir(default_path):
+		default_path = os.path.expanduser('~')
+	return os.path.join(default_path, 'cyton_solver' + tag)
+
+
+def fingerprint(*arrays):
+	# hash of the data a bootstrap was run on : a store is only resumed for identical data
+	digest = hashlib.sha1()
+	for arr in arrays:
+		digest.update(np.ascontiguousarray(arr).tobytes())
+	return digest.hexdigest()
+
+
+class BootstrapStore:
+	def __init__(self, path, meta, entropy):
+		"""
+		Open (resume) or create a bootstrap store.
+
+		:param path: (str) path of the store without extension ('.boot' log, '.json' description, '.jack.npy' jackknife)
+		:param meta: (dict) description of the run (JSON serialisable). 'names' lists the parameter names
+		:param entropy: (int) root entropy of the replicate seeds of a new run (a resumed run keeps its own)
+		"""
+		self.log_path = path + '.boot'
+		self.meta_path = path + '.json'
+		self.jack_path = path + '.jack.npy'
+		self.meta = json.loads(json.dumps(meta))
+		self.entropy = entropy
+		self.dtype = np.dtype([
+			('index', '<i8'), ('seed', '<u8'), ('rss', '<f8'), ('nfev', '<i8'), ('params', '<f8', (len(meta['names']),))
+		])
+
+		self.resumed = False
+		if os.path.isfile(self.meta_path) and os.path.isfile(self.log_path):
+			with open(self.meta_path, 'r') as f:
+				saved = json.load(f)
+			if saved.get('run') == self.meta:
+				self.resumed = True
+				self.entropy = saved['entropy']
+		if not self.resumed:
+			# different run (or none yet) : start a new log
+			with open(self.meta_path, 'w') as f:
+				json.dump({'run': self.meta, 'entropy': self.entropy}, f, indent=1)
+			open(self.log_path, 'wb').close()
+			if os.path.isfile(self.jack_path):
+				os.remove(self.jack_path)
+		else:
+			self._truncate()
+
+	def seeds(self, n):
+		# seed of every replicate : independent streams of one root SeedSequence
+		return np.array([
+			np.random.SeedSequence(self.entropy, spawn_key=(irep,)).generate_state(1, np.uint64)[0] for irep in range(n)
+		], dtype=np.uint64)
+
+	def _truncate(self):
+		# drop a partially written record (e.g. process killed while writing)
+		size = os.path.getsize(self.log_path)
+		if size % self.dtype.itemsize:
+			with open(self.log_path, 'r+b') as f:
+				f.truncate(size - size % self.dtype.itemsize)
+
+	def append(self, index, seed, rss, nfev, params):
+		"""
+		Append finished replicates to the log.
+
+		:param index: (ndarray) replicate indices
+		:param seed: (ndarray) seeds of the replicate random streams
+		:param rss: (ndarray) residual sum of squares of the replicate fits
+		:param nfev: (ndarray) number of model evaluations
+		:param params: (ndarray) fitted parameters of shape (len(index), number of parameters); NaN for failed fits
+		"""
+		records = np.empty(len(index), dtype=self.dtype)
+		records['index'], records['seed'], records['rss'], records['nfev'] = index, seed, rss, nfev
+		records['params'] = params
+		with open(self.log_path, 'ab') as f:
+			f.write(records.tobytes())
+			f.flush()
+			os.fsync(f.fileno())
+
+	def records(self):
+		# finished replicates so far (memory mapped, read only)
+		n = os.path.getsize(self.log_path) // self.dtype.itemsize
+		if n == 0:
+			return np.empty(0, dtype=self.dtype)
+		return np.memmap(self.log_path, dtype=self.dtype, mode='r', shape=(n,))
+
+	def completed(self):
+		return set(self.records()['index'].tolist())
+
+	def samples(self):
+		# (number of finished replicates x number of parameters) in replicate order
+		records = self.records()
+		return np.array(records['params'][np.argsort(records['index'], kind='stable')])
+
+	def save_jackknife(self, values):
+		np.save(self.jack_path, values)
+
+	def load_jackknife(self):
+		return np.load(self.jack_path) if os.path.isfile(self.jack_path) else None
+
+
+def percentile_interval(samples, alpha):
+	"""
+	:param samples: (ndarray) bootstrap replicates of shape (B, number of parameters)
+	:param alpha: (float) 1 - confidence level (e.g. 0.05)
+	:return: (tuple) low & high values of the interval per parameter
+	"""
+	low = np.nanpercentile(samples, 100 * alpha / 2, axis=0)
+	high = np.nanpercentile(samples, 100 * (1 - alpha / 2), axis=0)
+	return low, high
+
+
+def bca_interval(samples, theta, jackknife, alpha):
+	"""
+	Bias corrected & accelerated interval (Efron 1987). The acceleration comes from jackknife estimates; without them it
+	falls back to the bias corrected percentile interval.
+
+	:param samples: (ndarray) bootstrap replicates of shape (B, number of parameters)
+	:param theta: (ndarray) estimates from the original data
+	:param jackknife: (ndarray) leave-one-out estimates of shape (n, number of parameters) or None
+	:param alpha: (float) 1 - confidence level (e.g. 0.05)
+	:return: (tuple) low & high values of the interval per parameter
+	"""
+	low, high = np.full(len(theta), np.nan), np.full(len(theta), np.nan)
+	for j in range(len(theta)):
+		boot = samples[:, j][~np.isnan(samples[:, j])]
+		if len(boot) == 0:
+			continue
+		if np.ptp(boot) == 0:
+			low[j] = high[j] = boot[0]  # fixed parameter
+			continue
+		b = len(boot)
+		prop = np.clip((np.sum(boot < theta[j]) + 0.5 * np.sum(boot == theta[j])) / b, 1 / (b + 1), b / (b + 1))
+		z0 = norm.ppf(prop)
+
+		acc = 0.
+		jack = [] if jackknife is None else jackknife[:, j][~np.isnan(jackknife[:, j])]
+		if len(jack) > 1:
+			d = np.mean(jack) - jack
+			den = 6 * np.sum(d ** 2) ** 1.5
+			if den > 0:
+				acc = np.sum(d ** 3) / den
+
+		z = norm.ppf([alpha / 2, 1 - alpha / 2])
+		adjusted = norm.cdf(z0 + (z0 + z) / (1 - acc * (z0 + z)))
+		low[j], high[j] = np.percentile(boot, 100 * adjusted)
+	return low, high
@@ -1,15 +1,41 @@
+"""
+This module computes bootstrap confidence intervals of fitted Cyton parameters on a process pool.
+
+Replicates are resampled per (time point, generation) : each cell number is drawn with replacement from the replicates
+of its time point. The model & data are sent once to every worker at pool start up; every replicate has its own
+numpy.random.Generator seeded from one SeedSequence, so results do not depend on how replicates are scheduled. Every
+replicate fit starts from the original fit. Finished replicates stream to an on-disk store (see boot_store.py) from which
+an interrupted bootstrap resumes. Percentile & bias corrected accelerated (BCa) intervals are printed; the BCa bounds
+are returned.
+"""
+
 import time
 from datetime import datetime
+import numpy as np
 import psutil
-import random
-import multiprocessing as mp
 from contextlib import redirect_stdout
-from lmfit import Model
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from scipy.optimize import least_squares
 
 import src.common.global_vars as gvars
+from src.workbench.boot_store import BootstrapStore, default_store_path, fingerprint, percentile_interval, bca_interval
+from src.workbench.control import FitControl, FitAborted
+from src.workbench.objective import Residual
+from src.workbench.shared_data import SharedDataset
+from src.workbench.data_layout import generations, resample
+from src.workbench.fit import C15_JAC
 from src.workbench.cyton1 import Cyton1Model
 from src.workbench.cyton15 import Cyton15Model
 
+# per process state of a worker : model & data are sent once at pool start up, not with every chunk
+_worker = {}
+
+# model function & Jacobian per model id
+MODEL_METHODS = {
+	'cyton1': ('cyton1_model', 'cyton1_jacobian'),
+	'cyton1.5': ('cyton15', 'cyton15_jacobian'),
+}
+
 
 # redirect 'print' messages to text file & automatically releases stdout to default
 def redirect_msg(text, path):
@@ -28,173 +54,227 @@ def print_elapsed_time(start, end):
 	return msg
 
 
-def resampling(data, num_reps):
+def parameter_settings(model_id, original):
 	"""
-	This function resameples input data with replacement
-	input data format (3D list) : Ignoring icnd index because we can directly access current index from global vars
-		[ <- itpt
-			[ <- irep
-				[] <- igen
-			]
-		]
-	:param1 data: (list of lists) multidimensional data
-	:param2 num_reps: (list) contains an information about number of replicates per time point
-	:returns: (tuple) 1D arrays of resampled data & generation number
+	:param model_id: (str) 'cyton1' or 'cyton1.5'
+	:param original: (list) fitted parameters from original dataset (starting point of every replicate fit)
+	:return: (tuple) parameter names, starting values, vary flags, lower & upper bounds
 	"""
-	x, res = [], []
-	for itpt in range(len(data)):
-		for irep in range(num_reps[itpt]):
-			for igen in range(gvars.MAX_DIV+1):
-				x.append(igen)
-				ridx = random.randint(0, num_reps[itpt]-1)
-				res.append(data[itpt][ridx][igen])
-	return x, res
-
-
-def _boots(procnum, sobj, icnd, iters, gmodel, pars, num_reps):
-	# temporary local variable storage per parameters
-	presults = [
-		[], [], [], [], [], [], [], [], [], []
-	]
-	for i in range(int(iters)):
-		print(" > > [proc:{0}] Bootstrap ITER {1}".format(procnum, i+1))
-
-		x, res = resampling(gvars.CELL_GENS_REPS[icnd], num_reps)
-
-		result = gmodel.fit(
-			res,
-			params=pars,
-			flatten_generation_list=x,
-			# method='differential_evolution',
-			method='leastsq',
-			# iter_cb=callback_print_function,
-			# fit_kws={
-			# 	'max_nfev': 99999,
-			# 	'popsize': 30,
-			# 	'disp': True
-			# }
+	if model_id == 'cyton1':
+		names = Cyton1Model.PARAM_NAMES
+		keys, vary, upper_bounds = gvars.C1_PARAMS.keys(), gvars.C1_VARY_PARAMS.values(), gvars.C1_UPPER_BOUNDS.values()
+	else:
+		names = Cyton15Model.PARAM_NAMES
+		keys, vary, upper_bounds = gvars.C15_PARAMS.keys(), gvars.C15_VARY_PARAMS.values(), gvars.C15_UPPER_BOUNDS.values()
+	lower = np.array([0.0 if key == 'pfrac' else 0.001 for key in keys])
+	upper = np.array(list(upper_bounds), dtype=float)
+	values = np.clip(np.array(original, dtype=float), lower, upper)
+	return list(names), values, np.array(list(vary), dtype=bool), lower, upper
+
+
+def _init_worker(model, model_id, x, dataset, values, vary, lower, upper, fit_settings, abort_event):
+	# unpickled model has no run-time control : attach one sharing the abort token of the parent process
+	model.control = FitControl(abort_event)
+	method, jac_method = MODEL_METHODS[model_id]
+	# padded arrays in the shared memory block of the parent (dataset is kept to hold the block open)
+	_worker.update(
+		func=getattr(model, method), jacobian=getattr(model, jac_method), x=x, dataset=dataset,
+		values=values, vary=vary, lower=lower[vary], upper=upper[vary], fit_settings=fit_settings
+	)
+
+
+def _fit(y, weights=None):
+	"""
+	Least squares fit warm started from the original fit in a worker process, with the same derivatives as the original
+	fit (analytic Jacobian or finite differences, see bootstrap).
+
+	:return: (tuple) fitted values of all parameters (NaN if the fit failed), RSS & number of model evaluations
+	"""
+	func, jacobian, x = _worker['func'], _worker['jacobian'], _worker['x']
+	values, vary = _worker['values'], _worker['vary']
+	max_nfev, ftol, xtol, gtol, jac = _worker['fit_settings']
+	objective = Residual(func, range(len(values)), x, y, weights=weights)
+
+	def full(p):
+		full_values = values.copy()
+		full_values[vary] = p
+		return full_values
+
+	def dfun(p):
+		dres = jacobian(x, *full(p))[:, vary]
+		return dres if weights is None else dres * weights[:, np.newaxis]
+
+	try:
+		sol = least_squares(
+			lambda p: objective.evaluate(full(p)).copy(), values[vary], jac=dfun if jac is None else jac,
+			bounds=(_worker['lower'], _worker['upper']), method='trf',
+			max_nfev=max_nfev, ftol=ftol, xtol=xtol, gtol=gtol
 		)
+	except FitAborted:
+		raise
+	except Exception:
+		return np.full(len(values), np.nan), np.nan, objective.nfev  # failed replicate is left as NaN
+	return full(sol.x), float(np.dot(sol.fun, sol.fun)), objective.nfev
+
+
+def _boots(indices, seeds):
+	"""
+	Fit bootstrap replicates in a worker process.
+
+	:param indices: (ndarray) replicate indices
+	:param seeds: (ndarray) seed of the random stream of every replicate
+	:return: (tuple) indices, seeds, RSS, number of evaluations & fitted values (len(indices) x number of parameters)
+	"""
+	presults = np.full((len(indices), len(_worker['values'])), np.nan)
+	rss, nfev = np.full(len(indices), np.nan), np.zeros(len(indices), dtype=np.int64)
+	for i, seed in enumerate(seeds):
+		dataset = _worker['dataset']
+		y = resample(dataset.cells, dataset.mask, dataset.num_reps, np.random.default_rng(int(seed)))[0]
+		presults[i], rss[i], nfev[i] = _fit(y)
+	return indices, seeds, rss, nfev, presults
+
+
+def _jackknife(ijack, weights):
+	# leave-one-out fit : zero weights on the left out replicate
+	y = _worker['dataset'].cells[_worker['dataset'].mask]
+	params, _, nfev = _fit(y, weights)
+	return ijack, params, nfev
+
+
+def jackknife_weights(mask, num_reps):
+	"""
+	:param mask: (ndarray) padded mask of fitted entries (time points x max. replicates x generations)
+	:param num_reps: (ndarray) number of replicates per time point
+	:return: (ndarray) weights of shape (number of replicates in total, number of fitted entries); every row leaves
+		out one replicate of one time point
+	"""
+	offsets = np.cumsum(np.concatenate([[0], num_reps]))
+	owner = np.broadcast_to((offsets[:-1, np.newaxis] + np.arange(mask.shape[1]))[:, :, np.newaxis], mask.shape)[mask]
+	return (owner[np.newaxis, :] != np.arange(offsets[-1])[:, np.newaxis]).astype(float)
 
-		# append result to local list per iteration
-		j = 0
-		for key, val in result.params.valuesdict().items():
-			presults[j].append(val)
-			j += 1
 
-	sobj[procnum] = presults
+def print_intervals(names, original, samples, jackknife, rgs):
+	alpha = (100 - rgs) / 100
+	low, high = percentile_interval(samples, alpha)
+	bca_low, bca_high = bca_interval(samples, np.asarray(original, dtype=float), jackknife, alpha)
+	print(" > {0:.1f}% bootstrap confidence intervals ({1} replicate fits) : percentile / BCa".format(
+		rgs, int(np.sum(~np.isnan(samples[:, 0])))))
+	for name, fitted, lo, hi, blo, bhi in zip(names, original, low, high, bca_low, bca_high):
+		print(" > > {0:13s} {1:13.5f} [{2:.5f}, {3:.5f}] [{4:.5f}, {5:.5f}]".format(name, fitted, lo, hi, blo, bhi))
+	return bca_low, bca_high
 
 
-# TODO: Extend this method for Cyton 1
-def bootstrap(icnd, original, boot_iter, rgs):
+def bootstrap(model_id, icnd, original, boot_iter, rgs, algo_settings=None, control=None, seed=None, workers=None,
+			  store_path=None, chunk_size=10, report_every=100):
 	"""
 	main bootstrap function - call this function to initiate bootstrap sequence
-	this function does not return anything, instead automatically export results
 
-	:param icnd : (int) index of condition in a dataset
-	:param original : (list) list of fitted parameters from original dataset
-	:param boot_iter : (int) multiples of number of system cores (incl. hyper threads)
-	:param alpha : (float) confidence range (e.g. 95% CI => 0.05)
-	:return: (tuple) low & high values of the confidence interval
+	:param model_id: (str) 'cyton1' or 'cyton1.5'
+	:param icnd: (int) index of condition in a dataset
+	:param original: (list) list of fitted parameters from original dataset
+	:param boot_iter: (int) number of bootstrap replicates (multiples of number of system cores)
+	:param rgs: (float) % confidence range (e.g. 95)
+	:param algo_settings: (list) LM settings from fit dialog ['LM', max_nfev, ftol, xtol, gtol, analytic Jacobian, ...]
+	:param control: (FitControl) run-time control : its abort token stops all workers
+	:param seed: (int) root seed of the random streams (a new run only; a resumed run keeps its seed)
+	:param workers: (int) number of processes (default : number of physical cores)
+	:param store_path: (str) path of the result store (default : next to the data file)
+	:param chunk_size: (int) number of replicates per task (results are stored after every task)
+	:param report_every: (int) print intermediate intervals every this many replicates
+	:return: (tuple) (boot_iter x number of parameters) array of replicate fits, low & high values of the BCa interval
+		(percentile intervals are printed alongside, see print_intervals)
 	"""
+	if control is None:
+		control = FitControl()
+	if workers is None:
+		workers = int(psutil.cpu_count(logical=False) or 1)
+	if algo_settings is None or algo_settings[0] != 'LM':
+		raise NotImplementedError("Bootstrap replicates are fitted with least squares : select LM to compute intervals")
+	# replicates use the derivatives of the original fit : analytic Jacobian (None) or the same finite differences
+	if len(algo_settings) > 5 and algo_settings[5]:
+		jac = None
+	else:
+		jac = C15_JAC if model_id == 'cyton1.5' else '2-point'
+	fit_settings = tuple(algo_settings[1:5]) + (jac,)
+
 	num_reps = [len(l) for l in gvars.CELL_GENS_REPS[icnd]]
-	alpha = (1 - rgs)/100
+	max_div = gvars.MAX_DIV_PER_CONDITIONS[icnd]
+	if model_id == 'cyton1':
+		check = gvars.C1_CHECK[icnd]
+		model = Cyton1Model(gvars.EXP_HT[icnd], gvars.INIT_CELL, gvars.MAX_DIV, gvars.TIME_INC, num_reps, check)
+	else:
+		check = gvars.C15_CHECK[icnd]
+		model = Cyton15Model(gvars.EXP_HT[icnd], gvars.INIT_CELL, gvars.MAX_DIV, gvars.TIME_INC, num_reps, check, False)
 
-	model = Cyton15Model(
-		gvars.EXP_HT[icnd], gvars.INIT_CELL, gvars.MAX_DIV, gvars.TIME_INC, num_reps, gvars.C15_CHECK[icnd], False
-	)
+	if store_path is None:
+		store_path = default_store_path(model_id, gvars.CONDITIONS[icnd])
 
-	gmodel = Model(
-		model.cyton15,
-		independent_vars=['flatten_generation_list'],
-		param_names=[
-			'unstimMu', 'unstimSig',
-			'stimMuDiv', 'stimSigDiv',
-			'stimMuDeath', 'stimSigDeath',
-			'stimMuDD', 'stimSigDD',
-			'b', 'pF'
-		],
-		name='Cyton 1.5 Model (Bootstrap)'
-	)
+	# condition data packed once into shared memory : workers attach to it instead of unpickling nested lists
+	with SharedDataset(gvars.CELL_GENS_REPS[icnd], check, num_reps, max_div, gvars.EXP_HT[icnd]) as dataset:
+		x = generations(dataset.mask)
+		names, values, vary, lower, upper = parameter_settings(model_id, original)
 
-	params = gvars.C15_PARAMS
-	upper_bounds = gvars.C15_UPPER_BOUNDS
-	vary = gvars.C15_VARY_PARAMS
-	gmodel.set_param_hint('unstimMu', value=params['unstimMuDeath'], min=0.001, max=upper_bounds['unstimMuDeathUpperBound'], vary=vary['unstimMuDeathLock'])
-	gmodel.set_param_hint('unstimSig', value=params['unstimSigDeath'], min=0.001, max=upper_bounds['unstimSigDeathUpperBound'], vary=vary['unstimSigDeathLock'])
-	gmodel.set_param_hint('stimMuDiv', value=params['stimMuDiv'], min=0.001, max=upper_bounds['stimMuDivUpperBound'], vary=vary['stimMuDivLock'])
-	gmodel.set_param_hint('stimSigDiv', value=params['stimSigDiv'], min=0.001, max=upper_bounds['stimSigDivUpperBound'], vary=vary['stimSigDivLock'])
-	gmodel.set_param_hint('stimMuDeath', value=params['stimMuDeath'], min=0.001, max=upper_bounds['stimMuDeathUpperBound'], vary=vary['stimMuDeathLock'])
-	gmodel.set_param_hint('stimSigDeath', value=params['stimSigDeath'], min=0.001, max=upper_bounds['stimSigDeathUpperBound'], vary=vary['stimSigDeathLock'])
-	gmodel.set_param_hint('stimMuDD', value=params['stimMuDD'], min=0.001, max=upper_bounds['stimMuDDUpperBound'], vary=vary['stimMuDDLock'])
-	gmodel.set_param_hint('stimSigDD', value=params['stimSigDD'], min=0.001, max=upper_bounds['stimSigDDUpperBound'], vary=vary['stimSigDDLock'])
-
-	gmodel.set_param_hint('b', value=params['SubDivTime'], min=0.001, max=upper_bounds['SubDivTimeUpperBound'], vary=vary['SubDivTimeLock'])
-	gmodel.set_param_hint('pF', value=params['pfrac'], min=0.0, max=upper_bounds['pfracUpperBound'], vary=vary['pfracLock'])
-
-	# create LMFIT Parameters() object
-	pars = gmodel.make_params()
-
-	print("\n[{0}] Initiate bootstrapping...".format(datetime.now().replace(microsecond=0)))
-	start = time.time()
-
-	# create Manager object for retreiving data from individual core via shared object
-	manager = mp.Manager()
-	sobj = manager.dict()
-	procs = []  # store Process objects to synchronise the results
-	nc = int(psutil.cpu_count(logical=False))
-	for c in range(nc):
-		proc = mp.Process(
-			target=_boots,
-			args=(c, sobj, icnd, boot_iter/nc, gmodel, pars, num_reps)
-		)
-		# proc.daemon = True
-		procs.append(proc)
-	# pool = mp.Pool(processes=nc)
-	# iters = []
-	# for i in range(nc):
-	# 	iters.append(boot_iter/nc)
-	# results = [pool.apply_async(_boots, args=(x, sobj, icnd, iters[x], gmodel, pars, num_reps)) for x in range(nc)]
-	print(procs)
-	# start all Processes
-	for p in procs:
-		p.start()
-	#
-	# # wait for all cores to finish the work
-	# for p in procs:
-	# 	p.join()
-	#
-	# print(sobj)
-	# concatenate results from all cores
-	# new = []
-	# a, b, c, d, e, f, g, h, i, j = [], [], [], [], [], [], [], [], [], []
-	# for core in range(nc):
-	# 	a += sobj.values()[core][0]
-	# 	b += sobj.values()[core][1]
-	# 	c += sobj.values()[core][2]
-	# 	d += sobj.values()[core][3]
-	# 	e += sobj.values()[core][4]
-	# 	f += sobj.values()[core][5]
-	# 	g += sobj.values()[core][6]
-	# 	h += sobj.values()[core][7]
-	# 	i += sobj.values()[core][8]
-	# 	j += sobj.values()[core][9]
-	#
-	# new.append(a)
-	# new.append(b)
-	# new.append(c)
-	# new.append(d)
-	# new.append(e)
-	# new.append(f)
-	# new.append(g)
-	# new.append(h)
-	# new.append(i)
-	# new.append(j)
-	#
-	# end = time.time()
-	# elps = print_elapsed_time(start, end)
-	#
-	# # print(new)
-	# print(elps)
-	#
-	# low, high = 0, 0
-	# return low, high
\ No newline at end of file
+		meta = {
+			'model': model_id, 'condition': icnd, 'names': names, 'original': values.tolist(), 'vary': vary.tolist(),
+			'time_inc': gvars.TIME_INC, 'data': fingerprint(dataset.cells, dataset.mask), 'fit': list(fit_settings)
+		}
+		store = BootstrapStore(store_path, meta, np.random.SeedSequence(seed).entropy)
+		seeds = store.seeds(int(boot_iter))
+		todo = np.array(sorted(set(range(int(boot_iter))) - store.completed()), dtype=np.int64)
+		chunks = [todo[i:i+chunk_size] for i in range(0, len(todo), chunk_size)]
+		jackknife = store.load_jackknife()
+		weights = jackknife_weights(dataset.mask, dataset.num_reps) if jackknife is None else []
+
+		print("\n[{0}] Initiate bootstrapping... {1} replicates on {2} processes".format(
+			datetime.now().replace(microsecond=0), int(boot_iter), workers))
+		if store.resumed:
+			print(" > Resuming from {0} : {1} replicates done".format(store.log_path, int(boot_iter) - len(todo)))
+		start = time.time()
+
+		jack = np.full((len(weights), len(names)), np.nan)
+		njack, ndone, next_report = 0, int(boot_iter) - len(todo), report_every
+		try:
+			with ProcessPoolExecutor(
+					max_workers=workers, initializer=_init_worker,
+					initargs=(model, model_id, x, dataset, values, vary, lower, upper, fit_settings, control.abort_event)) as pool:
+				pending = {pool.submit(_jackknife, ijack, w) for ijack, w in enumerate(weights)}
+				pending |= {pool.submit(_boots, chunk, seeds[chunk]) for chunk in chunks}
+				while pending:
+					done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+					if not control.is_running:
+						for future in pending:
+							future.cancel()
+						control.check()
+					for future in done:
+						result = future.result()
+						if len(result) == 3:
+							ijack, jack[ijack], nfev = result
+							njack += 1
+							if njack == len(weights):
+								jackknife = jack
+								store.save_jackknife(jackknife)
+						else:
+							indices, chunk_seeds, rss, nfev, presults = result
+							store.append(indices, chunk_seeds, rss, nfev, presults)
+							nfev = int(np.sum(nfev))
+							ndone += len(indices)
+							print(" > > {0} of {1} replicates done".format(ndone, int(boot_iter)))
+							if ndone >= next_report and ndone < int(boot_iter):
+								next_report += report_every
+								print_intervals(names, values, store.samples(), jackknife, rgs)
+						control.record(n=nfev)
+		except FitAborted:
+			# finished replicates are in the store : a bootstrap of the same fit resumes from them
+			done_so_far = store.samples()
+			print(" > Bootstrap aborted : {0} of {1} replicates kept in {2}".format(
+				len(done_so_far), int(boot_iter), store.log_path))
+			if len(done_so_far):
+				print_intervals(names, values, done_so_far, jackknife, rgs)
+			raise
+
+	samples = store.samples()[:int(boot_iter)]
+	low, high = print_intervals(names, values, samples, jackknife, rgs)
+	print(" > Bootstrap results : {0}".format(store.log_path))
+	print_elapsed_time(start, time.time())
+
+	return samples, low, high
@@ -0,0 +1,49 @@
+"""
+This module separates run-time control of a fit from Cyton model objects.
+
+Models only hold the time grid, data layout & distribution settings, so they can be pickled and sent to worker processes.
+A FitControl carries the abort token ('Abort Fit' button) & progress of one fit. The token is a multiprocessing.Event :
+the same event can be handed to worker processes at start up (e.g. pool initializer) to stop all of them at once.
+"""
+
+import multiprocessing as mp
+
+
+class FitAborted(Exception):
+	pass
+
+
+class FitControl:
+	def __init__(self, abort_event=None):
+		"""
+		:param abort_event: (multiprocessing.Event) shared abort token. A new one is created if not given
+		"""
+		self.abort_event = mp.Event() if abort_event is None else abort_event
+		self.iter = 0  # number of model evaluations
+		self.last_param = []  # parameters of recent evaluations (returned if a fit fails)
+
+	@property
+	def is_running(self):
+		return not self.abort_event.is_set()
+
+	def abort(self):
+		self.abort_event.set()
+
+	def check(self):
+		# stop the fit if user clicked 'Abort Fit' button
+		if self.abort_event.is_set():
+			print(' >>> Abort fitting!')
+			raise FitAborted
+
+	def record(self, params=None, n=1):
+		"""
+		Count model evaluations & keep parameters of the latest ones (list is reset every 50 evaluations).
+
+		:param params: (list) parameters of the evaluation
+		:param n: (int) number of evaluations (e.g. population size of a batch)
+		"""
+		self.iter += n
+		if params is not None:
+			if self.iter % 50 == 0:
+				self.last_param = []
+			self.last_param.append(params)
@@ -1,19 +1,101 @@
 import numpy as np
 cimport numpy as np
 np.get_include()
-from scipy.stats import lognorm, norm, expon
+from scipy.special import ndtr
+from scipy.signal import fftconvolve
+from scipy.fftpack import next_fast_len
 import src.common.settings as config
+from src.workbench.distributions import cdf_grid, log_grid, cdf_derivatives
+from src.workbench.harvest import harvest_indices, gather_plan
+from src.workbench.workspace import Workspace
 
 DTYPE = np.float64
 ctypedef np.float64_t DTYPE_t
 
 cimport cython
+from cython.parallel cimport prange
+
+
+# nogil kernels : loops over independent axis run in parallel with OpenMP (number of threads : OMP_NUM_THREADS)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void first_generation_flux(DTYPE_t n0, DTYPE_t pF0, DTYPE_t md_prop,
+								DTYPE_t[::1] pdfDiv0, DTYPE_t[::1] pdfDeath0, DTYPE_t[::1] pdfMechDeath,
+								DTYPE_t[::1] cumPdfDiv0, DTYPE_t[::1] cumPdfDeath0, DTYPE_t[::1] cumPdfMechDeath,
+								DTYPE_t[::1] div, DTYPE_t[::1] death) nogil:
+	# division & death flux of generation 0 at every time step (values below 1E-15 are set to zero)
+	cdef Py_ssize_t i
+	cdef DTYPE_t checkSmall, checkSmall2
+	for i in prange(div.shape[0], schedule='static'):
+		checkSmall = n0 * pF0 * pdfDiv0[i] * (1.0 - md_prop * cumPdfMechDeath[i+1] - (1.0 - md_prop) * cumPdfDeath0[i+1])
+		div[i] = checkSmall if checkSmall >= 1E-15 else 0.0
+		checkSmall2 = n0 * ((1.0 - md_prop) * pdfDeath0[i] + md_prop * pdfMechDeath[i]) * (1.0 - pF0 * cumPdfDiv0[i])
+		death[i] = checkSmall2 if checkSmall2 >= 1E-15 else 0.0
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline void flux_at(Py_ssize_t j, DTYPE_t[::1] born, Py_ssize_t born_first, DTYPE_t pF,
+						 DTYPE_t[:, ::1] kernels, Py_ssize_t first, DTYPE_t[::1] div, DTYPE_t[::1] death) nogil:
+	# (born * kernel)[j] = sum_s born[j-s] * kernel[s] over non-zero support of both, for all 3 kernels in one pass
+	cdef Py_ssize_t s
+	cdef Py_ssize_t top = j - born_first
+	cdef DTYPE_t b, sumDiv = 0.0, sumDie = 0.0, sumDieNoDiv = 0.0
+	if top > kernels.shape[0] - 1:
+		top = kernels.shape[0] - 1
+	for s in range(first, top + 1):
+		b = born[j-s]
+		sumDiv = sumDiv + b * kernels[s, 0]
+		sumDie = sumDie + b * kernels[s, 1]
+		sumDieNoDiv = sumDieNoDiv + b * kernels[s, 2]
+	div[j] = pF * sumDiv
+	death[j] = (1.0 - pF) * sumDie + pF * sumDieNoDiv
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void next_generation_flux(DTYPE_t[::1] born, DTYPE_t pF, DTYPE_t[:, ::1] kernels, Py_ssize_t first,
+							   DTYPE_t[::1] div, DTYPE_t[::1] death) nogil:
+	# division & death flux of a generation from cells born in the previous one : every time step is independent
+	#  - kernels : (support, 3) array of [division, death, death without division] kernels, zero before 'first'
+	cdef Py_ssize_t n = div.shape[0]
+	cdef Py_ssize_t j
+	cdef Py_ssize_t born_first = 0
+	while born_first < n and born[born_first] == 0.0:
+		born_first = born_first + 1
+	for j in prange(n, schedule='guided'):
+		flux_at(j, born, born_first, pF, kernels, first, div, death)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void live_cell_counts(DTYPE_t n0, DTYPE_t[:, ::1] div, DTYPE_t[:, ::1] death, DTYPE_t[:, ::1] live) nogil:
+	# live[i, j] = live[i, j-1] + 2 div[i-1, j-1] - death[i, j-1] - div[i, j-1] : every generation is independent
+	cdef Py_ssize_t i, j
+	for i in prange(live.shape[0], schedule='static'):
+		live[i, 0] = n0 if i == 0 else 0.0
+		for j in range(1, live.shape[1]):
+			if i == 0:
+				live[0, j] = live[0, j-1] - div[0, j-1] - death[0, j-1]
+			else:
+				live[i, j] = live[i, j-1] + 2.0*div[i-1, j-1] - death[i, j-1] - div[i, j-1]
+
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
 @cython.cdivision(True)
 class Cyton1Model:
-	def __init__(self, ht, n0, max_div, dt, num_reps, check, thread=None):
+	# available kernels for subsequent generation flux computation
+	#  - 'direct' : 1D convolution over truncated support of the kernel, O(n*k), parallel over time (nogil)
+	#  - 'fft' : 1D convolution via FFT, O(n*log(n))
+	#  - 'matrix' : original displaced matrix method, O(n^2) time & memory. Kept for verification
+	KERNELS = ('direct', 'fft', 'matrix')
+
+	# maximum number of (parameter set x generation x time) entries held in memory by 'evaluate_batch'
+	BATCH_SIZE = 2**21
+
+	def __init__(self, ht, n0, max_div, dt, num_reps, check, control=None, kernel='direct'):
 		self.t0 = 0.0
 		self.tf = max(ht)
 		self.dt = dt
@@ -27,16 +109,54 @@ class Cyton1Model:
 		self.mechanicalDeathProportion = <DTYPE_t>0.0
 		self.mechanicalDeathConstant = <DTYPE_t>0.5
 
-		self.thread = thread
-
-		self.iter = 0
-		self.last_param = []
+		self.control = control  # run-time control (abort token & progress) : see control.py
 
 		self.first_div_pdf = config.CYTON1_CONFIG['first_div']
 		self.first_die_pdf = config.CYTON1_CONFIG['first_die']
 		self.subsq_div_pdf = config.CYTON1_CONFIG['subsq_div']
 		self.subsq_die_pdf = config.CYTON1_CONFIG['subsq_die']
 
+		if kernel not in self.KERNELS:
+			raise ValueError("Unknown Cyton 1 kernel '{0}'. Choose one of {1}".format(kernel, self.KERNELS))
+		self.kernel = kernel
+
+		# reusable work arrays of 'cyton1_model'
+		self.workspace = Workspace()
+
+		# pre-compute time grids & generation indices once : reused on every evaluation
+		self.build_grid(self.tf)
+		self.generations = np.arange(self.maxDivisions+1, dtype=DTYPE)
+
+		# harvest gather plan : indices of the data points in 'LiveMatrix' array
+		self.build_harvest_plan()
+
+	def __getstate__(self):
+		# pickled model holds configuration only : no run-time control or work arrays
+		state = self.__dict__.copy()
+		state['control'] = None
+		state['workspace'] = Workspace(self.workspace.enabled)
+		return state
+
+	def build_harvest_plan(self):
+		cdef unsigned int n = self.timesWith0.size
+		self.ht_idx = harvest_indices(self.timesWith0, self.harvestTimes, self.dt) if len(self.num_replicates) else np.zeros(0, dtype=np.intp)
+		self.harvest_idx, self.harvest_mask = gather_plan(self.ht_idx, self.num_replicates, self.check, self.maxDivisions+1, n)
+		self.prediction = np.zeros(self.harvest_idx.size, dtype=DTYPE)
+
+	def build_grid(self, tf):
+		"""
+		Construct discrete time grids up to 'tf'.
+			- times : [dt, 2dt, ..., tf]
+			- timesWith0 : [0, dt, ..., tf]
+
+		:param tf: (float) final time
+		"""
+		self.tf = tf
+		cdef unsigned int n = int(round(self.tf / self.dt, 6))
+		self.times = self.dt * np.arange(1, n+1, dtype=DTYPE)
+		self.timesWith0 = self.dt * np.arange(0, n+1, dtype=DTYPE)
+		self.logTimesWith0 = log_grid(self.timesWith0)
+
 	# TODO: OVERALL BAD PROGRAMMING! FIX IT (if you care)!
 	def cyton1_model(self, flatten_generation_list,
 					 DTYPE_t mu0Div, DTYPE_t sig0Div,
@@ -45,394 +165,453 @@ class Cyton1Model:
 					 DTYPE_t muSubDeath, DTYPE_t sigSubDeath,
 					 DTYPE_t pF0, DTYPE_t pFMu, DTYPE_t pFSig,
 					 DTYPE_t MDProp, DTYPE_t MDDecay):
-		# check if user clicked 'Abort Fit' button
-		if not self.thread.is_running:
-			print(' >>> Abort fitting!')
-			raise Exception
-		self.iter += 1
-
-		cdef list params = [
-			mu0Div, sig0Div,
-			mu0Death, sig0Death,
-			muSubDiv, sigSubDiv,
-			muSubDeath, sigSubDeath,
-			pF0, pFMu, pFSig,
-			MDProp, MDDecay
-		]
-		self.save_last_param(params)
-
-		# create times array
-		cdef unsigned int l = 0
-		cdef DTYPE_t t1
-		cdef np.ndarray[DTYPE_t, ndim=1] times = np.zeros(int(self.tf/self.dt), dtype=DTYPE)
-		t1 = self.t0 + self.dt
-		while t1 <= self.tf:
-			times[l] = t1
-			t1 += self.dt
-			l += 1
-
-		cdef unsigned int n = times.size
-
-		# create times array with 0
-		cdef DTYPE_t t2
-		cdef np.ndarray[DTYPE_t, ndim=1] timesWith0 = np.zeros(n+1, dtype=DTYPE)
-		t2 = self.t0
-		l = 0
-		while t2 <= self.tf:
-			timesWith0[l] = t2
-			t2 += self.dt
-			l += 1
-
-		# first division : PDF parameters
-		cdef DTYPE_t mu0div, sig0div
-		cdef DTYPE_t mudie, sig0die
-		mu0div, sig0div = mu0Div, sig0Div
-		mu0die, sig0die = mu0Death, sig0Death
-
-		# subsequent division : PDF parameters
-		cdef DTYPE_t muSdiv, sigSdiv
-		cdef DTYPE_t muSdie, sigSdie
-		muSdiv, sigSdiv = muSubDiv, sigSubDiv
-		muSdie, sigSdie = muSubDeath, sigSubDeath
+		# check if user clicked 'Abort Fit' button & record progress
+		if self.control is not None:
+			self.control.check()
+			self.control.record([
+				mu0Div, sig0Div,
+				mu0Death, sig0Death,
+				muSubDiv, sigSubDiv,
+				muSubDeath, sigSubDeath,
+				pF0, pFMu, pFSig,
+				MDProp, MDDecay
+			])
+
+		pF, cdfs, pdfs, divMatrix, deathMatrix, LiveMatrix = self.live_cells(
+			mu0Div, sig0Div, mu0Death, sig0Death, muSubDiv, sigSubDiv, muSubDeath, sigSubDeath,
+			pF0, pFMu, pFSig, MDProp, MDDecay
+		)
+
+		# extract number of live cells at harvested time points
+		# NB: 'self.prediction' is overwritten on every call. Copy it if the values need to persist
+		LiveMatrix.take(self.harvest_idx, out=self.prediction)
+		return self.prediction
+
+	def live_cells(self, DTYPE_t mu0Div, DTYPE_t sig0Div, DTYPE_t mu0Death, DTYPE_t sig0Death,
+				   DTYPE_t muSubDiv, DTYPE_t sigSubDiv, DTYPE_t muSubDeath, DTYPE_t sigSubDeath,
+				   DTYPE_t pF0, DTYPE_t pFMu, DTYPE_t pFSig, DTYPE_t MDProp, DTYPE_t MDDecay):
+		"""
+		Forward pass of Cyton 1 model on 'timesWith0'.
+		NB: flux & live cell arrays belong to 'self.workspace' and are overwritten by the next call.
+
+		:return: (tuple) pF, CDFs, PDFs, division flux, death flux & live cells per generation (G x n+1)
+		"""
+		cdef unsigned int n = self.times.size
 
 		# progress fraction calculation as a parameter
-		cdef DTYPE_t pf0, pfMu, pfSig
-		pf0 = pF0
-		pfMu = pFMu
-		pfSig = pFSig
-		cdef np.ndarray[DTYPE_t, ndim=1] pF = np.zeros(self.maxDivisions+1, dtype=DTYPE)
-		pF[0] = pf0
-
-		cdef unsigned int i, j, k
-		cdef DTYPE_t numer
-		cdef DTYPE_t denom
-		for i in range(1, self.maxDivisions+1):
-			numer = <DTYPE_t>1.0 - norm.cdf(i, loc=pfMu, scale=pfSig)
-			denom = <DTYPE_t>1.0 - norm.cdf(<unsigned int>(i-1), loc=pfMu, scale=pfSig)
-			if denom > <DTYPE_t>0.0:
-				pF[i] = numer/denom
-			else:
-				pF[i] = 0.0
-
-		# compute PDFs
-		cdef np.ndarray[DTYPE_t, ndim=1] pdfDiv0 = np.zeros(n, dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=1] pdfDeath0 = np.zeros(n, dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=1] pdfDivSubseq = np.zeros(n, dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=1] pdfDeathSubseq = np.zeros(n, dtype=DTYPE)
-		pdfDiv0 = self.compute_pdf(times, mu0div, sig0div, pdfType=self.first_div_pdf)
-		pdfDeath0 = self.compute_pdf(times, mu0die, sig0die, pdfType=self.first_die_pdf)
-		pdfDivSubseq = self.compute_pdf(times, muSdiv, sigSdiv, pdfType=self.subsq_div_pdf)
-		pdfDeathSubseq = self.compute_pdf(times, muSdie, sigSdie, pdfType=self.subsq_die_pdf)
-
-		cdef np.ndarray[DTYPE_t, ndim=1] cumPdfDiv0 = np.zeros(n, dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=1] cumPdfDeath0 = np.zeros(n, dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=1] cumPdfDivSubseq = np.zeros(n, dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=1] cumPdfDeathSubseq = np.zeros(n, dtype=DTYPE)
-		cumPdfDiv0 = self.compute_cdf(times, mu0div, sig0div, pdfType=self.first_div_pdf)
-		cumPdfDeath0 = self.compute_cdf(times, mu0die, sig0die, pdfType=self.first_die_pdf)
-		cumPdfDivSubseq = self.compute_cdf(times, muSdiv, sigSdiv, pdfType=self.subsq_div_pdf)
-		cumPdfDeathSubseq = self.compute_cdf(times, muSdie, sigSdie, pdfType=self.subsq_die_pdf)
+		cdef np.ndarray[DTYPE_t, ndim=1] pF = self.compute_pf(pF0, pFMu, pFSig)
 
+		# compute PDFs & CDFs of all distributions at once
 		self.mechanicalDeathProportion = MDProp
 		self.mechanicalDeathConstant = MDDecay
-		cdef np.ndarray[DTYPE_t, ndim=1] pdfMechDeath = np.zeros(n, dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=1] cumPdfMechDeath = np.zeros(n, dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=1] mechDeathDecay = np.zeros(n, dtype=DTYPE)
-		pdfMechDeath = self.compute_pdf(times, 0, 0, pdfType='Exponential')
-		cumPdfMechDeath = self.compute_cdf(times, 0, 0, pdfType='Exponential')
-		mechDeathDecay = self.calcMechanicalDeathDecay(timesWith0)
+		cdef np.ndarray[DTYPE_t, ndim=2] cdfs = self.compute_cdfs(mu0Div, sig0Div, mu0Death, sig0Death, muSubDiv, sigSubDiv, muSubDeath, sigSubDeath, MDDecay)
+		cdef np.ndarray[DTYPE_t, ndim=2] pdfs = self.compute_pdfs(cdfs)
+		cdef np.ndarray[DTYPE_t, ndim=1] pdfDiv0 = pdfs[0]
+		cdef np.ndarray[DTYPE_t, ndim=1] pdfDeath0 = pdfs[1]
+		cdef np.ndarray[DTYPE_t, ndim=1] pdfDivSubseq = pdfs[2]
+		cdef np.ndarray[DTYPE_t, ndim=1] pdfDeathSubseq = pdfs[3]
+		cdef np.ndarray[DTYPE_t, ndim=1] pdfMechDeath = pdfs[4]
+		cdef np.ndarray[DTYPE_t, ndim=1] cumPdfDiv0 = cdfs[0]
+		cdef np.ndarray[DTYPE_t, ndim=1] cumPdfDeath0 = cdfs[1]
+		cdef np.ndarray[DTYPE_t, ndim=1] cumPdfDivSubseq = cdfs[2]
+		cdef np.ndarray[DTYPE_t, ndim=1] cumPdfDeathSubseq = cdfs[3]
+		cdef np.ndarray[DTYPE_t, ndim=1] cumPdfMechDeath = cdfs[4]
+
+		cdef unsigned int i, j
 
 		# compute generation-0 live & dead cells
-		cdef np.ndarray[DTYPE_t, ndim=2] divMatrix = np.zeros(shape=(self.maxDivisions+1, n), dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=2] deathMatrix = np.zeros(shape=(self.maxDivisions+1, n), dtype=DTYPE)
-		cdef DTYPE_t checkSmall = <DTYPE_t>0.0
-		cdef DTYPE_t checkSmall2 = <DTYPE_t>0.0
-		for i in range(n):
-			checkSmall = <DTYPE_t>self.initCellNo * pF[0] * pdfDiv0[i] * (<DTYPE_t>1.0 - <DTYPE_t>self.mechanicalDeathProportion * cumPdfMechDeath[<unsigned int>(i+1)] - (<DTYPE_t>1.0 - <DTYPE_t>self.mechanicalDeathProportion) * cumPdfDeath0[<unsigned int>(i+1)])
-			if checkSmall < 1E-15:
-				checkSmall = <DTYPE_t>0.0
-			divMatrix[0, i] = checkSmall
-
-			checkSmall2 = self.initCellNo * ( (<DTYPE_t>1.0 - <DTYPE_t>self.mechanicalDeathProportion) * pdfDeath0[i] + <DTYPE_t>self.mechanicalDeathProportion * pdfMechDeath[i] ) * (<DTYPE_t>1.0 - pF[0] * cumPdfDiv0[i])
-			if checkSmall2 < 1E-15:
-				checkSmall2 = <DTYPE_t>0.0
-			deathMatrix[0, i] = checkSmall2
+		cdef np.ndarray[DTYPE_t, ndim=2] divMatrix = self.workspace.zeros('divMatrix', (self.maxDivisions+1, n))
+		cdef np.ndarray[DTYPE_t, ndim=2] deathMatrix = self.workspace.zeros('deathMatrix', (self.maxDivisions+1, n))
+		first_generation_flux(
+			<DTYPE_t>self.initCellNo, pF[0], <DTYPE_t>self.mechanicalDeathProportion,
+			pdfDiv0, pdfDeath0, pdfMechDeath, cumPdfDiv0, cumPdfDeath0, cumPdfMechDeath,
+			divMatrix[0], deathMatrix[0]
+		)
 
 		# compute subsequent generation live & dead cells
-		cdef np.ndarray[DTYPE_t, ndim=2] wosmatrixDiv = np.zeros(shape=(n, n), dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=2] wosmatrixDeath = np.zeros(shape=(n, n), dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=2] displacedMatrixDiv = np.zeros(shape=(n, n*2), dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=2] displacedMatrixDeath = np.zeros(shape=(n, n*2), dtype=DTYPE)
-		cdef DTYPE_t sumLIVE
-		cdef DTYPE_t sumDEAD
-		cdef np.ndarray[DTYPE_t, ndim=1] sumArryLIVE = np.zeros(shape=(n), dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=1] sumArryDEAD = np.zeros(shape=(n), dtype=DTYPE)
-		for i in range(1, len(divMatrix)):
-
-			# calculate 'wosmatrix'
-			for j in range(len(wosmatrixDiv)):
-				for k in range(len(wosmatrixDiv[0])):
-					checkSmall = <DTYPE_t>2.0 * divMatrix[<unsigned int>(i-1), j] * pF[i] * pdfDivSubseq[k] * (<DTYPE_t>1.0 - cumPdfDeathSubseq[<unsigned int>(k+1)])
-					if checkSmall < 1E-15:
-						checkSmall = <DTYPE_t>0.0
-					wosmatrixDiv[j, k] = checkSmall
-
-					checkSmall2 = <DTYPE_t>2.0 * divMatrix[<unsigned int>(i-1), j] * (<DTYPE_t>1.0 - pF[i]) * pdfDeathSubseq[k] + <DTYPE_t>2.0 * divMatrix[<unsigned int>(i-1), j] * pF[i] * pdfDeathSubseq[k] * (<DTYPE_t>1.0 - cumPdfDivSubseq[k])
-					if checkSmall2 < 1E-15:
-						checkSmall2 = <DTYPE_t>0.0
-					wosmatrixDeath[j, k] = checkSmall2
-
-			# displace 'wosmatrix'
-			for j in range(len(wosmatrixDiv)):
-				for k in range(len(wosmatrixDiv[0])):
-					displacedMatrixDiv[j, <unsigned int>(k+j)] = wosmatrixDiv[j, k]
-					displacedMatrixDeath[j, <unsigned int>(k+j)] = wosmatrixDeath[j, k]
-
-			# sum vertically
-			for j in range(len(wosmatrixDiv[0])):
-				sumLIVE = <DTYPE_t>0.0
-				sumDEAD = <DTYPE_t>0.0
-				for k in range(len(wosmatrixDiv)):
-					sumLIVE += displacedMatrixDiv[k, j]
-					sumDEAD += displacedMatrixDeath[k, j]
-				sumArryLIVE[j] = sumLIVE
-				sumArryDEAD[j] = sumDEAD
-
-			divMatrix[i] = sumArryLIVE
-			deathMatrix[i] = sumArryDEAD
+		self.generation_flux(divMatrix, deathMatrix, pF, pdfDivSubseq, pdfDeathSubseq, cumPdfDivSubseq, cumPdfDeathSubseq, truncate=True)
+
+		cdef np.ndarray[DTYPE_t, ndim=2] LiveMatrix = self.workspace.empty('LiveMatrix', (self.maxDivisions+1, n+1))
+		live_cell_counts(<DTYPE_t>self.initCellNo, divMatrix, deathMatrix, LiveMatrix)
+
+		return pF, cdfs, pdfs, divMatrix, deathMatrix, LiveMatrix
+
+	PARAM_NAMES = (
+		'mu0Div', 'sig0Div',
+		'mu0Death', 'sig0Death',
+		'muSubDiv', 'sigSubDiv',
+		'muSubDeath', 'sigSubDeath',
+		'pF0', 'pFMu', 'pFSig',
+		'MDProp', 'MDDecay'
+	)
+
+	def cyton1_sensitivity(self, flatten_generation_list,
+						   DTYPE_t mu0Div, DTYPE_t sig0Div,
+						   DTYPE_t mu0Death, DTYPE_t sig0Death,
+						   DTYPE_t muSubDiv, DTYPE_t sigSubDiv,
+						   DTYPE_t muSubDeath, DTYPE_t sigSubDeath,
+						   DTYPE_t pF0, DTYPE_t pFMu, DTYPE_t pFSig,
+						   DTYPE_t MDProp, DTYPE_t MDDecay):
+		"""
+		Forward sensitivity of 'cyton1_model' : d(divMatrix)/dθ and d(deathMatrix)/dθ are carried alongside the
+		generation recursion, so the prediction and its Jacobian (columns follow PARAM_NAMES) come out of one pass.
+			- generation 0 : derivatives of the closed form fluxes (CDF derivatives from distributions.py)
+			- generation i : d[pF_i * (born * K)] = dpF_i * (born * K) + pF_i * (d(born) * K + born * dK)
+			- live cells : cumulative sum of the flux derivatives
+		All convolutions of a generation (13 parameters x 3 kernels) are done in one batched real FFT.
+
+		:return: (tuple) prediction (copy) & Jacobian of shape (number of data points, 13)
+		"""
+		if self.control is not None:
+			self.control.check()
+
+		pF, cdfs, pdfs, divMatrix, deathMatrix, LiveMatrix = self.live_cells(
+			mu0Div, sig0Div, mu0Death, sig0Death, muSubDiv, sigSubDiv, muSubDeath, sigSubDeath,
+			pF0, pFMu, pFSig, MDProp, MDDecay
+		)
+		cdef unsigned int n = self.times.size
+		cdef unsigned int G = self.maxDivisions + 1
+		cdef unsigned int P = len(self.PARAM_NAMES)
+		cdef unsigned int i
+		cdef DTYPE_t N = self.initCellNo
+		cdef DTYPE_t m = MDProp
+
+		# CDF derivatives (P, 5, n+1) : row r of 'cdfs' depends on parameters 'owners[r]' (location, scale)
+		dC = np.zeros(shape=(P, 5, n+1), dtype=DTYPE)
+		pdf_types = [self.first_div_pdf, self.first_die_pdf, self.subsq_div_pdf, self.subsq_die_pdf, 'Exponential']
+		locs = [mu0Div, mu0Death, muSubDiv, muSubDeath, MDDecay]
+		scales = [sig0Div, sig0Death, sigSubDiv, sigSubDeath, 0.]
+		owners = [(0, 1), (2, 3), (4, 5), (6, 7), (12, None)]
+		for r in range(5):
+			_, dF_mu, dF_sig = cdf_derivatives(self.timesWith0, pdf_types[r], locs[r], scales[r], log_times=self.logTimesWith0)
+			dC[owners[r][0], r] = dF_mu
+			if owners[r][1] is not None:
+				dC[owners[r][1], r] = dF_sig
+		# truncated CDF entries (including t = 0) are constant zero
+		dC[:, cdfs == 0.] = 0.
+		dP = np.zeros_like(dC)
+		dP[:, :, :-1] = np.diff(dC, axis=2)
+
+		# progressive fraction derivatives (P, G) : pF_i = S_i / S_(i-1) with S = 1 - Phi((i - pFMu) / pFSig)
+		dpF = np.zeros(shape=(P, G), dtype=DTYPE)
+		z = (self.generations - pFMu) / pFSig
+		S = ndtr(-z)
+		phi = np.exp(-0.5 * z * z) / np.sqrt(2. * np.pi)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			dlogS_mu = np.where(S > 0., phi / (pFSig * S), 0.)
+			dlogS_sig = np.where(S > 0., phi * z / (pFSig * S), 0.)
+		dpF[8, 0] = 1.
+		dpF[9, 1:] = pF[1:] * (dlogS_mu[1:] - dlogS_mu[:-1])
+		dpF[10, 1:] = pF[1:] * (dlogS_sig[1:] - dlogS_sig[:-1])
+
+		# generation 0 : div = N pF0 f0(t) A(t+dt), death = N B(t) C(t)
+		F0d, F0x, Fsd, Fsx, Fm = cdfs[0], cdfs[1], cdfs[2], cdfs[3], cdfs[4]
+		p0d, p0x, psd, psx, pm = pdfs[0, :n], pdfs[1, :n], pdfs[2, :n], pdfs[3, :n], pdfs[4, :n]
+		A = 1. - m * Fm[1:] - (1. - m) * F0x[1:]
+		dA = -m * dC[:, 4, 1:] - (1. - m) * dC[:, 1, 1:]
+		dA[11] += F0x[1:] - Fm[1:]
+		dDiv = np.zeros(shape=(P, G, n), dtype=DTYPE)
+		dDiv[:, 0] = N * pF0 * (dP[:, 0, :n] * A + p0d * dA)
+		dDiv[8, 0] += N * p0d * A
+		B = (1. - m) * p0x + m * pm
+		dB = (1. - m) * dP[:, 1, :n] + m * dP[:, 4, :n]
+		dB[11] += pm - p0x
+		C = 1. - pF0 * F0d[:n]
+		dC0 = -pF0 * dC[:, 0, :n]
+		dC0[8] -= F0d[:n]
+		dDeath = np.zeros(shape=(P, G, n), dtype=DTYPE)
+		dDeath[:, 0] = N * (dB * C + B * dC0)
+		# NB: fluxes truncated below 1E-15 are not masked. Their derivatives are negligible, except at pF0 = 1 where
+		# death flux of generation 0 has a kink (clipped for pF0 > 1); the derivative from below is kept
+
+		# subsequent generation kernels [division, death, death without division] & derivatives
+		kernels = np.array([psd * (1. - Fsx[1:]), psx, psx * (1. - Fsd[:n])])
+		dKernels = np.stack([
+			dP[:, 2, :n] * (1. - Fsx[1:]) - psd * dC[:, 3, 1:],
+			dP[:, 3, :n],
+			dP[:, 3, :n] * (1. - Fsd[:n]) - psx * dC[:, 2, :n]
+		], axis=1)
+		nfft = next_fast_len(2 * n)
+		K = np.fft.rfft(kernels, nfft)
+		dK = np.fft.rfft(dKernels, nfft)
+		for i in range(1, G):
+			born = np.fft.rfft(2. * divMatrix[i-1], nfft)
+			dBorn = np.fft.rfft(2. * dDiv[:, i-1], nfft)
+			conv = np.fft.irfft(born * K, nfft)[:, :n]
+			dConv = np.fft.irfft(dBorn[:, None, :] * K[None] + born * dK, nfft)[:, :, :n]
+			dDiv[:, i] = dpF[:, i, None] * conv[0] + pF[i] * dConv[:, 0]
+			dDeath[:, i] = dpF[:, i, None] * (conv[2] - conv[1]) + (1. - pF[i]) * dConv[:, 1] + pF[i] * dConv[:, 2]
+
+		# live cells : L[i, j] = L[i, j-1] + 2 div[i-1, j-1] - death[i, j-1] - div[i, j-1]
+		dFlux = -dDiv - dDeath
+		dFlux[:, 1:] += 2. * dDiv[:, :-1]
+		dLive = np.zeros(shape=(P, G, n+1), dtype=DTYPE)
+		np.cumsum(dFlux, axis=2, out=dLive[:, :, 1:])
+
+		prediction = LiveMatrix.take(self.harvest_idx)
+		jacobian = np.ascontiguousarray(dLive.reshape(P, -1)[:, self.harvest_idx].T)
+		return prediction, jacobian
+
+	def cyton1_jacobian(self, flatten_generation_list, *params):
+		"""
+		Jacobian of 'cyton1_model' (see cyton1_sensitivity), with the same call signature for use as 'jac' in a fit.
+
+		:return: (ndarray) Jacobian of shape (number of data points, 13)
+		"""
+		return self.cyton1_sensitivity(flatten_generation_list, *params)[1]
+
+	def check_jacobian(self, params, DTYPE_t rel_step=1E-6, DTYPE_t tol=1E-7):
+		"""
+		Check the Jacobian of 'cyton1_sensitivity' against central finite differences of 'cyton1_model'. Errors are
+		scaled by parameter values & the largest prediction (about 1E-9 for typical parameters).
+
+		:param params: (list) 13 parameter values in the order of PARAM_NAMES
+		:param rel_step: (float) relative step size for finite differences
+		:param tol: (float) maximum scaled error per parameter
+		:return: (dict) maximum scaled error per parameter
+		:raise AssertionError: if any column exceeds 'tol'
+		"""
+		params = np.asarray(params, dtype=DTYPE)
+		prediction, analytic = self.cyton1_sensitivity(None, *params)
+		scale = np.abs(prediction).max() + 1.
+		errors = {}
+		for i, name in enumerate(self.PARAM_NAMES):
+			h = rel_step * max(abs(params[i]), 1E-3)
+			upper, lower = params.copy(), params.copy()
+			upper[i] += h
+			lower[i] -= h
+			numeric = (np.array(self.cyton1_model(None, *upper)) - np.array(self.cyton1_model(None, *lower))) / (2. * h)
+			errors[name] = np.abs(analytic[:, i] - numeric).max() * abs(params[i]) / scale
+		failed = {name: error for name, error in errors.items() if not error <= tol}
+		assert not failed, "Cyton 1 Jacobian differs from finite differences (tolerance {0}) : {1}".format(tol, failed)
+		return errors
+
+	def evaluate_batch(self, param_matrix):
+		"""
+		Evaluate 'cyton1_model' for many parameter sets at once (e.g. a population of differential evolution).
+		Distributions of all parameter sets are evaluated in one call and the generation recursion convolves all
+		parameter sets together with a batched real FFT (same result as 'direct'/'fft' kernels up to rounding).
+		Parameter sets are processed in chunks of at most BATCH_SIZE array entries.
+
+		:param param_matrix: (ndarray) parameter sets of shape (P, 13); columns follow PARAM_NAMES
+		:return: (ndarray) predictions of shape (P, number of data points)
+		"""
+		param_matrix = np.atleast_2d(np.asarray(param_matrix, dtype=DTYPE))
+		cdef unsigned int P = param_matrix.shape[0]
+		cdef unsigned int chunk = max(1, self.BATCH_SIZE // ((self.maxDivisions+1) * (self.times.size+1)))
+		if self.control is not None:
+			self.control.check()
+			self.control.record(n=P)
+
+		predictions = np.zeros(shape=(P, self.harvest_idx.size), dtype=DTYPE)
+		for start in range(0, P, chunk):
+			predictions[start:start+chunk] = self._batch_live_cells(param_matrix[start:start+chunk])
+		return predictions
+
+	def _batch_live_cells(self, X):
+		cdef unsigned int P = X.shape[0]
+		cdef unsigned int n = self.times.size
+		cdef unsigned int G = self.maxDivisions + 1
+		cdef unsigned int i
+		cdef DTYPE_t N = self.initCellNo
+
+		# progressive fraction per parameter set (see compute_pf)
+		survival = <DTYPE_t>1.0 - ndtr((self.generations[None, :] - X[:, 9, None]) / X[:, 10, None])
+		pF = np.zeros(shape=(P, G), dtype=DTYPE)
+		pF[:, 0] = X[:, 8]
+		np.divide(survival[:, 1:], survival[:, :G-1], out=pF[:, 1:], where=survival[:, :G-1] > <DTYPE_t>0.0)
+
+		# CDFs & PDFs of all parameter sets in one call (see compute_cdfs)
+		pdf_types = [self.first_div_pdf, self.first_die_pdf, self.subsq_div_pdf, self.subsq_die_pdf, 'Exponential'] * P
+		mus = np.column_stack([X[:, 0], X[:, 2], X[:, 4], X[:, 6], X[:, 12]]).ravel()
+		sigs = np.column_stack([X[:, 1], X[:, 3], X[:, 5], X[:, 7], np.zeros(P)]).ravel()
+		cdfs = cdf_grid(self.timesWith0, pdf_types, mus, sigs, log_times=self.logTimesWith0).reshape(P, 5, n+1)
+		cdfs[:, :, 0] = <DTYPE_t>0.0
+		cdfs[cdfs < 1E-15] = <DTYPE_t>0.0
+		pdfs = np.diff(cdfs, axis=2)
+		F0d, F0x, Fsd, Fsx, Fm = cdfs[:, 0], cdfs[:, 1], cdfs[:, 2], cdfs[:, 3], cdfs[:, 4]
+		p0d, p0x, psd, psx, pm = pdfs[:, 0], pdfs[:, 1], pdfs[:, 2], pdfs[:, 3], pdfs[:, 4]
+
+		# generation 0
+		pF0 = X[:, 8, None]
+		m = X[:, 11, None]
+		divMatrix = np.zeros(shape=(P, G, n), dtype=DTYPE)
+		deathMatrix = np.zeros(shape=(P, G, n), dtype=DTYPE)
+		divMatrix[:, 0] = N * pF0 * p0d * (1. - m * Fm[:, 1:] - (1. - m) * F0x[:, 1:])
+		deathMatrix[:, 0] = N * ((1. - m) * p0x + m * pm) * (1. - pF0 * F0d[:, :n])
+		divMatrix[:, 0][divMatrix[:, 0] < 1E-15] = <DTYPE_t>0.0
+		deathMatrix[:, 0][deathMatrix[:, 0] < 1E-15] = <DTYPE_t>0.0
+
+		# subsequent generations : kernels [division, death, death without division] (see _convolution_flux)
+		kernels = np.stack([psd * (1. - Fsx[:, 1:]), psx, psx * (1. - Fsd[:, :n])], axis=1)
+		nfft = next_fast_len(2 * n)
+		K = np.fft.rfft(kernels, nfft)
+		for i in range(1, G):
+			born = np.fft.rfft(2. * divMatrix[:, i-1], nfft)
+			conv = np.fft.irfft(born[:, None, :] * K, nfft)[:, :, :n]
+			divMatrix[:, i] = pF[:, i, None] * conv[:, 0]
+			deathMatrix[:, i] = (1. - pF[:, i, None]) * conv[:, 1] + pF[:, i, None] * conv[:, 2]
+
+		# live cells : L[i, j] = L[i, j-1] + 2 div[i-1, j-1] - death[i, j-1] - div[i, j-1]
+		flux = -divMatrix - deathMatrix
+		flux[:, 1:] += 2. * divMatrix[:, :G-1]
+		LiveMatrix = np.zeros(shape=(P, G, n+1), dtype=DTYPE)
+		np.cumsum(flux, axis=2, out=LiveMatrix[:, :, 1:])
+		LiveMatrix[:, 0] += N
+		return LiveMatrix.reshape(P, -1)[:, self.harvest_idx]
+
+	def compute_pf(self, DTYPE_t pF0, DTYPE_t pFMu, DTYPE_t pFSig):
+		"""
+		Progressive fraction per generation: pF[0] = pF0, pF[i] = (1 - Phi(i)) / (1 - Phi(i-1)) for Phi ~ N(pFMu, pFSig)
+
+		:return: (ndarray) progressive fraction of length maxDivisions+1
+		"""
+		cdef np.ndarray[DTYPE_t, ndim=1] survival = <DTYPE_t>1.0 - ndtr((self.generations - pFMu) / pFSig)
+		cdef np.ndarray[DTYPE_t, ndim=1] pF = np.zeros(self.maxDivisions+1, dtype=DTYPE)
+		cdef np.ndarray[DTYPE_t, ndim=1] denom = survival[:-1]
+		pF[0] = pF0
+		np.divide(survival[1:], denom, out=pF[1:], where=denom > <DTYPE_t>0.0)
+		return pF
+
+	def compute_cdfs(self, DTYPE_t mu0Div, DTYPE_t sig0Div, DTYPE_t mu0Death, DTYPE_t sig0Death,
+					 DTYPE_t muSubDiv, DTYPE_t sigSubDiv, DTYPE_t muSubDeath, DTYPE_t sigSubDeath, DTYPE_t MDDecay):
+		"""
+		Evaluate all CDFs on 'timesWith0' in a single vectorised call.
+		Rows : [first division, first death, subsequent division, subsequent death, mechanical death]
+
+		:return: (ndarray) CDFs of shape (5, n+1), values below 1E-15 are set to zero & cdf[:, 0] = 0
+		"""
+		cdef np.ndarray[DTYPE_t, ndim=2] cdf = cdf_grid(
+			self.timesWith0,
+			[self.first_div_pdf, self.first_die_pdf, self.subsq_div_pdf, self.subsq_die_pdf, 'Exponential'],
+			[mu0Div, mu0Death, muSubDiv, muSubDeath, MDDecay],
+			[sig0Div, sig0Death, sigSubDiv, sigSubDeath, 0.],
+			log_times=self.logTimesWith0
+		)
+		cdf[:, 0] = <DTYPE_t>0.0
+		cdf[cdf < 1E-15] = <DTYPE_t>0.0
+		return cdf
 
-		cdef np.ndarray[DTYPE_t, ndim=2] LiveMatrix = np.zeros(shape=(self.maxDivisions+1, n+1), dtype=DTYPE)
-		LiveMatrix[0, 0] = <DTYPE_t>self.initCellNo
-		for i in range(self.maxDivisions+1):
-			for j in range(1, len(LiveMatrix[0])):
-				if i == 0:
-					LiveMatrix[0, j] = LiveMatrix[0, <unsigned int>(j-1)] - divMatrix[0, <unsigned int>(j-1)] - deathMatrix[0, <unsigned int>(j-1)]
-				else:
-					LiveMatrix[i, j] = LiveMatrix[i, <unsigned int>(j-1)] + <DTYPE_t>2.0*divMatrix[<unsigned int>(i-1), <unsigned int>(j-1)] - deathMatrix[i, <unsigned int>(j-1)] - divMatrix[i, <unsigned int>(j-1)]
-
-		cdef list model = []
-		cdef unsigned int tIDX
-		cdef int igen
-		cdef DTYPE_t real_time
-		cdef DTYPE_t theoretical_time
-		for tIDX, theoretical_time in enumerate(timesWith0):
-			for itpt, real_time in enumerate(self.harvestTimes):
-				if real_time == theoretical_time:
-					for irep in range(self.num_replicates[itpt]):
-						for igen in range(0, self.maxDivisions+1):
-							# check for excluded data
-							if self.check[itpt][irep][igen]:
-								model.append(LiveMatrix[igen, tIDX])
-
-		return np.asfarray(model)
-
-	def save_last_param(self, params):
-		if self.iter % 50 == 0:
-			self.last_param = []
-		self.last_param.append(params)
-		return self.last_param
+	def compute_pdfs(self, np.ndarray[DTYPE_t, ndim=2] cdfs):
+		# discrete PDF : pdf[i] = cdf[i+1] - cdf[i], last entry is zero
+		cdef np.ndarray[DTYPE_t, ndim=2] pdf = np.zeros_like(cdfs)
+		pdf[:, :-1] = np.diff(cdfs, axis=1)
+		return pdf
 
 	def compute_pdf(self, times, DTYPE_t mu, DTYPE_t sig, str pdfType='Lognormal'):
-		cdef unsigned int i
-		cdef DTYPE_t time
-		cdef DTYPE_t val
-		cdef np.ndarray[DTYPE_t, ndim=1] cdf = np.zeros(len(times)+1, dtype=DTYPE)
+		if pdfType == 'Exponential':
+			mu = self.mechanicalDeathConstant
+		cdef np.ndarray[DTYPE_t, ndim=1] cdf = self.compute_cdf(times, mu, sig, pdfType=pdfType)
 		cdef np.ndarray[DTYPE_t, ndim=1] pdf = np.zeros(len(times)+1, dtype=DTYPE)
-		if pdfType == 'Lognormal':
-			log_mu = np.log(mu)
-			for i, time in enumerate(times):
-				val = lognorm.cdf(time, sig, scale=np.exp(log_mu))
-				if val < 1E-15:
-					val = <DTYPE_t>0.0
-				cdf[i+1] = val
-				pdf[i] = cdf[i+1] - cdf[i]
-		elif pdfType == 'Gaussian':
-			for i, time in enumerate(times):
-				val = norm.cdf(time, loc=mu, scale=sig)
-				if val < 1E-15:
-					val = <DTYPE_t>0.0
-				cdf[i+1] = val
-				pdf[i] = cdf[i+1] - cdf[i]
-		elif pdfType == 'Exponential':
-			cdf[0] = expon.cdf(0.0, scale=1.0/self.mechanicalDeathConstant)
-			for i, time in enumerate(times):
-				val = expon.cdf(time, scale=1.0/self.mechanicalDeathConstant)
-				if val < 1E-15:
-					val = <DTYPE_t>0.0
-				cdf[i+1] = val
-				pdf[i] = cdf[i+1] - cdf[i]
+		pdf[:-1] = np.diff(cdf)
 		return pdf
 
 	def compute_cdf(self, times, DTYPE_t mu, DTYPE_t sig, str pdfType='Lognormal'):
-		cdef unsigned int i
-		cdef DTYPE_t t
-		cdef DTYPE_t val
-		cdef list timesBiggerBy1 = []
-		t = self.t0 + self.dt
-		while t <= self.tf + self.dt:
-			timesBiggerBy1.append(t)
-			t += self.dt
-
+		if pdfType == 'Exponential':
+			mu = self.mechanicalDeathConstant
 		cdef np.ndarray[DTYPE_t, ndim=1] cdf = np.zeros(len(times)+1, dtype=DTYPE)
-		if pdfType == 'Lognormal':
-			log_mu = np.log(mu)
-			for i in range(len(timesBiggerBy1)-1):
-				val = lognorm.cdf(timesBiggerBy1[i], sig, scale=np.exp(log_mu))
-				if val < 1E-15:
-					val = <DTYPE_t>0.0
-				cdf[i+1] = val
-		elif pdfType == 'Gaussian':
-			for i in range(len(timesBiggerBy1)-1):
-				val = norm.cdf(timesBiggerBy1[i], loc=mu, scale=sig)
-				if val < 1E-15:
-					val = <DTYPE_t>0.0
-				cdf[i+1] = val
-		elif pdfType == 'Exponential':
-			for i in range(len(timesBiggerBy1)-1):
-				val = expon.cdf(timesBiggerBy1[i], scale=1.0/self.mechanicalDeathConstant)
-				if val < 1E-15:
-					val = <DTYPE_t>0.0
-				cdf[i+1] = val
+		cdf[1:] = cdf_grid(np.asarray(times, dtype=DTYPE), [pdfType], [mu], [sig])[0]
+		cdf[cdf < 1E-15] = <DTYPE_t>0.0
 		return cdf
 
 	def calcMechanicalDeathDecay(self, times):
-		cdef unsigned int i
-		cdef DTYPE_t time
-		cdef DTYPE_t mdk
-		cdef DTYPE_t val
-		cdef np.ndarray[DTYPE_t, ndim=1] mechDeathDecay = np.zeros(len(times), dtype=DTYPE)
-
-		mdk = self.mechanicalDeathConstant
-		for i, time in enumerate(times):
-			val = <DTYPE_t>np.exp(- mdk * time)
-			if val < 1E-15:
-				val = <DTYPE_t>0.0
-			mechDeathDecay[i] = val
+		cdef np.ndarray[DTYPE_t, ndim=1] mechDeathDecay = np.exp(-self.mechanicalDeathConstant * np.asarray(times, dtype=DTYPE))
+		mechDeathDecay[mechDeathDecay < 1E-15] = <DTYPE_t>0.0
 		return mechDeathDecay
 
-	# this is just a duplicate from above but to return different values for plotting
-	def compute_model_results(self, TIMES, PARAMS):
-		self.tf = max(TIMES)
-
-		# create times array
-		cdef unsigned int l = 0
-		cdef DTYPE_t t1
-		cdef np.ndarray[DTYPE_t, ndim=1] times = np.zeros(int(self.tf/self.dt), dtype=DTYPE)
-		t1 = self.t0 + self.dt
-		while t1 <= self.tf:
-			times[l] = t1
-			t1 += self.dt
-			l += 1
-
-		cdef unsigned int n = times.size
-
-		# create times array with 0
-		cdef DTYPE_t t2
-		cdef np.ndarray[DTYPE_t, ndim=1] timesWith0 = np.zeros(n+1, dtype=DTYPE)
-		t2 = self.t0
-		l = 0
-		while t2 <= self.tf:
-			timesWith0[l] = t2
-			t2 += self.dt
-			l += 1
-
-		# first division : PDF parameters
-		cdef DTYPE_t mu0div, sig0div
-		cdef DTYPE_t mudie, sig0die
-		mu0div, sig0div = PARAMS['mu0div'], PARAMS['sig0div']
-		mu0die, sig0die = PARAMS['mu0death'], PARAMS['sig0death']
-
-		# subsequent division : PDF parameters
-		cdef DTYPE_t muSdiv, sigSdiv
-		cdef DTYPE_t muSdie, sigSdie
-		muSdiv, sigSdiv = PARAMS['muSubdiv'], PARAMS['sigSubdiv']
-		muSdie, sigSdie = PARAMS['muSubdeath'], PARAMS['sigSubdeath']
-
-		# progress fraction calculation as a parameter
-		cdef DTYPE_t pf0, pfMu, pfSig
-		pf0 = PARAMS['pf0']
-		pfMu = PARAMS['pfmu']
-		pfSig = PARAMS['pfsig']
-		cdef np.ndarray[DTYPE_t, ndim=1] pF = np.zeros(self.maxDivisions+1, dtype=DTYPE)
-		pF[0] = pf0
+	def generation_flux(self, divMatrix, deathMatrix, pF,
+						pdfDivSubseq, pdfDeathSubseq, cumPdfDivSubseq, cumPdfDeathSubseq, bint truncate=True):
+		"""
+		Fill division & death flux of generation 1 onwards in 'divMatrix' and 'deathMatrix' (in place).
+		Generation i is a convolution of generation (i-1) division flux with the subsequent division/death kernels.
+
+		:param divMatrix: (ndarray) division flux per generation; row 0 must be filled beforehand
+		:param deathMatrix: (ndarray) death flux per generation; row 0 must be filled beforehand
+		:param pF: (ndarray) progressive fraction per generation
+		:param truncate: (bool) set flux terms smaller than 1E-15 to zero (only applies to 'matrix' kernel)
+		"""
+		if self.kernel == 'matrix':
+			self._matrix_flux(divMatrix, deathMatrix, pF, pdfDivSubseq, pdfDeathSubseq, cumPdfDivSubseq, cumPdfDeathSubseq, truncate)
+		else:
+			self._convolution_flux(divMatrix, deathMatrix, pF, pdfDivSubseq, pdfDeathSubseq, cumPdfDivSubseq, cumPdfDeathSubseq)
+
+	def _convolution_flux(self, np.ndarray[DTYPE_t, ndim=2] divMatrix, np.ndarray[DTYPE_t, ndim=2] deathMatrix,
+						  np.ndarray[DTYPE_t, ndim=1] pF,
+						  pdfDivSubseq, pdfDeathSubseq, cumPdfDivSubseq, cumPdfDeathSubseq):
+		cdef unsigned int n = divMatrix.shape[1]
+		cdef unsigned int i
 
+		# generation independent parts of the kernels : a cell divides (or dies) 'k' time steps after its birth
+		cdef np.ndarray[DTYPE_t, ndim=1] divKernel = pdfDivSubseq[:n] * (<DTYPE_t>1.0 - cumPdfDeathSubseq[1:n+1])
+		cdef np.ndarray[DTYPE_t, ndim=1] dieKernel = pdfDeathSubseq[:n]
+		cdef np.ndarray[DTYPE_t, ndim=1] dieNoDivKernel = pdfDeathSubseq[:n] * (<DTYPE_t>1.0 - cumPdfDivSubseq[:n])
+
+		# truncate support of the kernels to the last non-zero entry
+		divKernel = np.trim_zeros(divKernel, 'b')
+		dieKernel = np.trim_zeros(dieKernel, 'b')
+		dieNoDivKernel = np.trim_zeros(dieNoDivKernel, 'b')
+
+		cdef np.ndarray[DTYPE_t, ndim=1] born
+		if self.kernel == 'direct':
+			# kernels interleaved on their common support (time x 3) for the nogil kernel
+			kernels = np.zeros(shape=(max(divKernel.size, dieKernel.size, dieNoDivKernel.size), 3), dtype=DTYPE)
+			kernels[:divKernel.size, 0] = divKernel
+			kernels[:dieKernel.size, 1] = dieKernel
+			kernels[:dieNoDivKernel.size, 2] = dieNoDivKernel
+			support = np.flatnonzero(kernels.any(axis=1))
+			first = support[0] if support.size else kernels.shape[0]
+			for i in range(1, divMatrix.shape[0]):
+				born = <DTYPE_t>2.0 * divMatrix[i-1]
+				next_generation_flux(born, pF[i], kernels, first, divMatrix[i], deathMatrix[i])
+			return
+
+		for i in range(1, divMatrix.shape[0]):
+			born = <DTYPE_t>2.0 * divMatrix[i-1]
+			divMatrix[i] = pF[i] * self._convolve(born, divKernel, n)
+			deathMatrix[i] = (<DTYPE_t>1.0 - pF[i]) * self._convolve(born, dieKernel, n) \
+							 + pF[i] * self._convolve(born, dieNoDivKernel, n)
+
+	def _convolve(self, np.ndarray[DTYPE_t, ndim=1] signal, np.ndarray[DTYPE_t, ndim=1] kernel, unsigned int n):
+		# causal convolution truncated to the time grid
+		cdef np.ndarray[DTYPE_t, ndim=1] out = np.zeros(n, dtype=DTYPE)
+		if kernel.size == 0 or not signal.any():
+			return out
+		if self.kernel == 'fft':
+			out[:] = fftconvolve(signal, kernel)[:n]
+		else:
+			out[:min(n, signal.size+kernel.size-1)] = np.convolve(signal, kernel)[:n]
+		return out
+
+	def _matrix_flux(self, np.ndarray[DTYPE_t, ndim=2] divMatrix, np.ndarray[DTYPE_t, ndim=2] deathMatrix,
+					 np.ndarray[DTYPE_t, ndim=1] pF,
+					 np.ndarray[DTYPE_t, ndim=1] pdfDivSubseq, np.ndarray[DTYPE_t, ndim=1] pdfDeathSubseq,
+					 np.ndarray[DTYPE_t, ndim=1] cumPdfDivSubseq, np.ndarray[DTYPE_t, ndim=1] cumPdfDeathSubseq,
+					 bint truncate):
+		cdef unsigned int n = divMatrix.shape[1]
 		cdef unsigned int i, j, k
-		cdef DTYPE_t numer
-		cdef DTYPE_t denom
-		for i in range(1, self.maxDivisions+1):
-			numer = <DTYPE_t>1.0 - norm.cdf(i, loc=pfMu, scale=pfSig)
-			denom = <DTYPE_t>1.0 - norm.cdf(<unsigned int>(i-1), loc=pfMu, scale=pfSig)
-			if denom > <DTYPE_t>0.0:
-				pF[i] = numer/denom
-			else:
-				pF[i] = 0.0
-
-		# compute PDFs
-		cdef np.ndarray[DTYPE_t, ndim=1] pdfDiv0 = np.zeros(n, dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=1] pdfDeath0 = np.zeros(n, dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=1] pdfDivSubseq = np.zeros(n, dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=1] pdfDeathSubseq = np.zeros(n, dtype=DTYPE)
-		pdfDiv0 = self.compute_pdf(times, mu0div, sig0div, pdfType=self.first_div_pdf)
-		pdfDeath0 = self.compute_pdf(times, mu0die, sig0die, pdfType=self.first_die_pdf)
-		pdfDivSubseq = self.compute_pdf(times, muSdiv, sigSdiv, pdfType=self.subsq_div_pdf)
-		pdfDeathSubseq = self.compute_pdf(times, muSdie, sigSdie, pdfType=self.subsq_die_pdf)
-
-		cdef np.ndarray[DTYPE_t, ndim=1] cumPdfDiv0 = np.zeros(n, dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=1] cumPdfDeath0 = np.zeros(n, dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=1] cumPdfDivSubseq = np.zeros(n, dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=1] cumPdfDeathSubseq = np.zeros(n, dtype=DTYPE)
-		cumPdfDiv0 = self.compute_cdf(times, mu0div, sig0div, pdfType=self.first_div_pdf)
-		cumPdfDeath0 = self.compute_cdf(times, mu0die, sig0die, pdfType=self.first_die_pdf)
-		cumPdfDivSubseq = self.compute_cdf(times, muSdiv, sigSdiv, pdfType=self.subsq_div_pdf)
-		cumPdfDeathSubseq = self.compute_cdf(times, muSdie, sigSdie, pdfType=self.subsq_die_pdf)
-
-		self.mechanicalDeathProportion = PARAMS['MechProp']
-		self.mechanicalDeathConstant = PARAMS['MechDecayConst']
-		cdef np.ndarray[DTYPE_t, ndim=1] pdfMechDeath = np.zeros(n, dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=1] cumPdfMechDeath = np.zeros(n, dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=1] mechDeathDecay = np.zeros(n, dtype=DTYPE)
-		pdfMechDeath = self.compute_pdf(times, 0, 0, pdfType='Exponential')
-		cumPdfMechDeath = self.compute_cdf(times, 0, 0, pdfType='Exponential')
-		mechDeathDecay = self.calcMechanicalDeathDecay(timesWith0)
-
-		# compute generation-0 live & dead cells
-		cdef np.ndarray[DTYPE_t, ndim=2] divMatrix = np.zeros(shape=(self.maxDivisions+1, n), dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=2] deathMatrix = np.zeros(shape=(self.maxDivisions+1, n), dtype=DTYPE)
 		cdef DTYPE_t checkSmall = <DTYPE_t>0.0
 		cdef DTYPE_t checkSmall2 = <DTYPE_t>0.0
-		for i in range(n):
-			checkSmall = <DTYPE_t>self.initCellNo * pF[0] * pdfDiv0[i] * (<DTYPE_t>1.0 - <DTYPE_t>self.mechanicalDeathProportion * cumPdfMechDeath[<unsigned int>(i+1)] - (<DTYPE_t>1.0 - <DTYPE_t>self.mechanicalDeathProportion) * cumPdfDeath0[<unsigned int>(i+1)])
-			if checkSmall < 1E-15:
-				checkSmall = <DTYPE_t>0.0
-			divMatrix[0, i] = checkSmall
-
-			checkSmall2 = <DTYPE_t>self.initCellNo * ( (<DTYPE_t>1.0 - <DTYPE_t>self.mechanicalDeathProportion) * pdfDeath0[i] + <DTYPE_t>self.mechanicalDeathProportion * pdfMechDeath[i] ) * (<DTYPE_t>1.0 - pF[0] * cumPdfDiv0[i])
-			if checkSmall2 < 1E-15:
-				checkSmall2 = <DTYPE_t>0.0
-			deathMatrix[0, i] = checkSmall2
-
-		# compute subsequent generation live & dead cells
-		cdef np.ndarray[DTYPE_t, ndim=2] wosmatrixDiv = np.zeros(shape=(n, n), dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=2] wosmatrixDeath = np.zeros(shape=(n, n), dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=2] displacedMatrixDiv = np.zeros(shape=(n, n*2), dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=2] displacedMatrixDeath = np.zeros(shape=(n, n*2), dtype=DTYPE)
+		cdef np.ndarray[DTYPE_t, ndim=2] wosmatrixDiv = self.workspace.zeros('wosmatrixDiv', (n, n))
+		cdef np.ndarray[DTYPE_t, ndim=2] wosmatrixDeath = self.workspace.zeros('wosmatrixDeath', (n, n))
+		cdef np.ndarray[DTYPE_t, ndim=2] displacedMatrixDiv = self.workspace.zeros('displacedMatrixDiv', (n, n*2))
+		cdef np.ndarray[DTYPE_t, ndim=2] displacedMatrixDeath = self.workspace.zeros('displacedMatrixDeath', (n, n*2))
 		cdef DTYPE_t sumLIVE
 		cdef DTYPE_t sumDEAD
-		cdef np.ndarray[DTYPE_t, ndim=1] sumArryLIVE = np.zeros(shape=n, dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=1] sumArryDEAD = np.zeros(shape=n, dtype=DTYPE)
+		cdef np.ndarray[DTYPE_t, ndim=1] sumArryLIVE = self.workspace.zeros('sumArryLIVE', n)
+		cdef np.ndarray[DTYPE_t, ndim=1] sumArryDEAD = self.workspace.zeros('sumArryDEAD', n)
 		for i in range(1, len(divMatrix)):
 
 			# calculate 'wosmatrix'
 			for j in range(len(wosmatrixDiv)):
 				for k in range(len(wosmatrixDiv[0])):
 					checkSmall = <DTYPE_t>2.0 * divMatrix[<unsigned int>(i-1), j] * pF[i] * pdfDivSubseq[k] * (<DTYPE_t>1.0 - cumPdfDeathSubseq[<unsigned int>(k+1)])
-					# if checkSmall < 1E-15:
-					#     checkSmall = <DTYPE_t>0.0
+					if truncate and checkSmall < 1E-15:
+						checkSmall = <DTYPE_t>0.0
 					wosmatrixDiv[j, k] = checkSmall
 
 					checkSmall2 = <DTYPE_t>2.0 * divMatrix[<unsigned int>(i-1), j] * (<DTYPE_t>1.0 - pF[i]) * pdfDeathSubseq[k] + <DTYPE_t>2.0 * divMatrix[<unsigned int>(i-1), j] * pF[i] * pdfDeathSubseq[k] * (<DTYPE_t>1.0 - cumPdfDivSubseq[k])
-					# if checkSmall2 < 1E-15:
-					#     checkSmall2 = <DTYPE_t>0.0
+					if truncate and checkSmall2 < 1E-15:
+						checkSmall2 = <DTYPE_t>0.0
 					wosmatrixDeath[j, k] = checkSmall2
 
 			# displace 'wosmatrix'
@@ -454,14 +633,51 @@ class Cyton1Model:
 			divMatrix[i] = sumArryLIVE
 			deathMatrix[i] = sumArryDEAD
 
+	# this is just a duplicate from above but to return different values for plotting
+	def compute_model_results(self, TIMES, PARAMS):
+		if max(TIMES) != self.tf:
+			self.build_grid(max(TIMES))
+		cdef unsigned int n = self.times.size
+
+		# progress fraction calculation as a parameter
+		cdef np.ndarray[DTYPE_t, ndim=1] pF = self.compute_pf(PARAMS['pf0'], PARAMS['pfmu'], PARAMS['pfsig'])
+
+		# compute PDFs & CDFs of all distributions at once
+		self.mechanicalDeathProportion = PARAMS['MechProp']
+		self.mechanicalDeathConstant = PARAMS['MechDecayConst']
+		cdef np.ndarray[DTYPE_t, ndim=2] cdfs = self.compute_cdfs(
+			PARAMS['mu0div'], PARAMS['sig0div'], PARAMS['mu0death'], PARAMS['sig0death'],
+			PARAMS['muSubdiv'], PARAMS['sigSubdiv'], PARAMS['muSubdeath'], PARAMS['sigSubdeath'],
+			PARAMS['MechDecayConst']
+		)
+		cdef np.ndarray[DTYPE_t, ndim=2] pdfs = self.compute_pdfs(cdfs)
+		cdef np.ndarray[DTYPE_t, ndim=1] pdfDiv0 = pdfs[0]
+		cdef np.ndarray[DTYPE_t, ndim=1] pdfDeath0 = pdfs[1]
+		cdef np.ndarray[DTYPE_t, ndim=1] pdfDivSubseq = pdfs[2]
+		cdef np.ndarray[DTYPE_t, ndim=1] pdfDeathSubseq = pdfs[3]
+		cdef np.ndarray[DTYPE_t, ndim=1] pdfMechDeath = pdfs[4]
+		cdef np.ndarray[DTYPE_t, ndim=1] cumPdfDiv0 = cdfs[0]
+		cdef np.ndarray[DTYPE_t, ndim=1] cumPdfDeath0 = cdfs[1]
+		cdef np.ndarray[DTYPE_t, ndim=1] cumPdfDivSubseq = cdfs[2]
+		cdef np.ndarray[DTYPE_t, ndim=1] cumPdfDeathSubseq = cdfs[3]
+		cdef np.ndarray[DTYPE_t, ndim=1] cumPdfMechDeath = cdfs[4]
+
+		cdef unsigned int i, j
+
+		# compute generation-0 live & dead cells
+		cdef np.ndarray[DTYPE_t, ndim=2] divMatrix = np.zeros(shape=(self.maxDivisions+1, n), dtype=DTYPE)
+		cdef np.ndarray[DTYPE_t, ndim=2] deathMatrix = np.zeros(shape=(self.maxDivisions+1, n), dtype=DTYPE)
+		first_generation_flux(
+			<DTYPE_t>self.initCellNo, pF[0], <DTYPE_t>self.mechanicalDeathProportion,
+			pdfDiv0, pdfDeath0, pdfMechDeath, cumPdfDiv0, cumPdfDeath0, cumPdfMechDeath,
+			divMatrix[0], deathMatrix[0]
+		)
+
+		# compute subsequent generation live & dead cells
+		self.generation_flux(divMatrix, deathMatrix, pF, pdfDivSubseq, pdfDeathSubseq, cumPdfDivSubseq, cumPdfDeathSubseq, truncate=False)
+
 		cdef np.ndarray[DTYPE_t, ndim=2] LiveMatrix = np.zeros(shape=(self.maxDivisions+1, n+1), dtype=DTYPE)
-		LiveMatrix[0, 0] = <DTYPE_t>self.initCellNo
-		for i in range(0, len(LiveMatrix)):
-			for j in range(1, len(LiveMatrix[0])):
-				if i == 0:
-					LiveMatrix[i, j] = LiveMatrix[i, <unsigned int>(j-1)] - divMatrix[i, <unsigned int>(j-1)] - deathMatrix[i, <unsigned int>(j-1)]
-				else:
-					LiveMatrix[i, j] = LiveMatrix[i, <unsigned int>(j-1)] + <DTYPE_t>2.0*divMatrix[<unsigned int>(i-1), <unsigned int>(j-1)] - deathMatrix[i, <unsigned int>(j-1)] - divMatrix[i, <unsigned int>(j-1)]
+		live_cell_counts(<DTYPE_t>self.initCellNo, divMatrix, deathMatrix, LiveMatrix)
 		# for j in range(1, len(LiveMatrix[0])):
 		# 	LiveMatrix[0, j] = LiveMatrix[0, <unsigned int>(j-1)] - divMatrix[0, <unsigned int>(j-1)] - deathMatrix[0, <unsigned int>(j-1)]
 		# for i in range(1, len(LiveMatrix)):
@@ -3,26 +3,147 @@ cimport numpy as np
 np.get_include()
 from scipy.stats import lognorm, norm, expon
 import src.common.settings as config
+from src.workbench.harvest import harvest_indices, gather_plan
+from src.workbench.workspace import Workspace
+from src.workbench.distributions import log_grid, cdf_grid, pdf_grid, cdf_derivatives, pdf_derivatives, DistributionCache
 
 DTYPE = np.float64
 ctypedef np.float64_t DTYPE_t
 
 cimport cython
+from cython.parallel cimport prange
+
+
+# nogil kernels : loops over independent axis run in parallel with OpenMP (number of threads : OMP_NUM_THREADS)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void generation_row(Py_ssize_t igen, DTYPE_t n0, DTYPE_t pF, DTYPE_t dt,
+						 const DTYPE_t[::1] cdfDiv, const DTYPE_t[::1] cdfDie, const DTYPE_t[::1] cdfDD, const DTYPE_t[::1] pdfDD,
+						 np.int64_t k, np.int64_t l,
+						 DTYPE_t[:, ::1] nDIV, DTYPE_t[:, ::1] nDD, DTYPE_t[:, ::1] DDprop) nogil:
+	# dividing (nDIV) & destiny (nDD) cells of one generation over time : DDprop accumulates along time
+	cdef Py_ssize_t n = cdfDiv.shape[0]
+	cdef Py_ssize_t j
+	cdef DTYPE_t core
+	for j in range(n):
+		core = 2.0**igen * n0 * pF * (1. - cdfDie[j])
+		if igen == 0:
+			nDIV[0, j] = core * (1. - cdfDD[j]) * (1. - cdfDiv[j])
+			if j == 0:
+				DDprop[0, j] = pdfDD[j] * cdfDiv[n-1]
+			else:
+				DDprop[0, j] = pdfDD[j] * (1. - cdfDiv[j]) + DDprop[0, j-1]
+			nDD[0, j] = core * DDprop[0, j] * dt
+		elif j > 0:
+			if k < j <= (k+l):
+				nDIV[igen, j] = core * (1. - cdfDD[j]) * cdfDiv[j-k]
+				DDprop[igen, j] = pdfDD[j] * cdfDiv[j-k] + DDprop[igen, j-1]
+				nDD[igen, j] = core * DDprop[igen, j] * dt
+			elif j > (k+l):
+				nDIV[igen, j] = core * (1. - cdfDD[j]) * (cdfDiv[j-k] - cdfDiv[j-k-l])
+				DDprop[igen, j] = pdfDD[j] * (cdfDiv[j-k] - cdfDiv[j-k-l]) + DDprop[igen, j-1]
+				nDD[igen, j] = core * DDprop[igen, j] * dt
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void generation_rows(DTYPE_t n0, DTYPE_t pF, DTYPE_t dt,
+						  const DTYPE_t[::1] cdfDiv, const DTYPE_t[::1] cdfDie, const DTYPE_t[::1] cdfDD, const DTYPE_t[::1] pdfDD,
+						  np.int64_t[::1] window_k, np.int64_t[::1] window_l,
+						  DTYPE_t[:, ::1] nDIV, DTYPE_t[:, ::1] nDD, DTYPE_t[:, ::1] DDprop) nogil:
+	# every generation is independent
+	cdef Py_ssize_t igen
+	for igen in prange(nDIV.shape[0], schedule='dynamic'):
+		generation_row(igen, n0, pF, dt, cdfDiv, cdfDie, cdfDD, pdfDD, window_k[igen], window_l[igen], nDIV, nDD, DDprop)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void harvest_row(Py_ssize_t igen, DTYPE_t n0, DTYPE_t pF, DTYPE_t dt,
+					  const DTYPE_t[::1] cdfDiv, const DTYPE_t[::1] cdfDie, const DTYPE_t[::1] cdfDD, const DTYPE_t[::1] pdfDD,
+					  np.int64_t k, np.int64_t l, const np.int64_t[::1] cols,
+					  DTYPE_t[:, ::1] nDIV, DTYPE_t[:, ::1] nDD) nogil:
+	# same recurrence as 'generation_row' : DDprop is a running sum up to the last harvest column and only harvest columns
+	# (sorted, unique) of nDIV & nDD are stored. Columns before the window of the generation are left as zeros
+	cdef Py_ssize_t n = cdfDiv.shape[0]
+	cdef Py_ssize_t H = cols.shape[0]
+	cdef Py_ssize_t j, h = 0
+	cdef Py_ssize_t start = 0 if igen == 0 else k + 1
+	cdef DTYPE_t window, core, DDprop = 0.
+	if H == 0:
+		return
+	while h < H and cols[h] < start:
+		h += 1
+	for j in range(start, cols[H-1]+1):
+		if igen == 0:
+			window = 1. - cdfDiv[j]
+			DDprop += pdfDD[j] * (cdfDiv[n-1] if j == 0 else window)
+		else:
+			window = cdfDiv[j-k] if j <= k+l else cdfDiv[j-k] - cdfDiv[j-k-l]
+			DDprop += pdfDD[j] * window
+		if j == cols[h]:
+			core = 2.0**igen * n0 * pF * (1. - cdfDie[j])
+			nDIV[igen, h] = core * (1. - cdfDD[j]) * window
+			nDD[igen, h] = core * DDprop * dt
+			h += 1
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void harvest_rows(DTYPE_t n0, DTYPE_t pF, DTYPE_t dt,
+					   const DTYPE_t[::1] cdfDiv, const DTYPE_t[::1] cdfDie, const DTYPE_t[::1] cdfDD, const DTYPE_t[::1] pdfDD,
+					   np.int64_t[::1] window_k, np.int64_t[::1] window_l, const np.int64_t[::1] cols,
+					   DTYPE_t[:, ::1] nDIV, DTYPE_t[:, ::1] nDD) nogil:
+	cdef Py_ssize_t igen
+	for igen in prange(nDIV.shape[0], schedule='dynamic'):
+		harvest_row(igen, n0, pF, dt, cdfDiv, cdfDie, cdfDD, pdfDD, window_k[igen], window_l[igen], cols, nDIV, nDD)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline void fold_time_point(Py_ssize_t j, Py_ssize_t E, DTYPE_t[::1] nUnstim, DTYPE_t[:, ::1] nDIV, DTYPE_t[:, ::1] nDD,
+								 DTYPE_t[:, ::1] cells_gen, DTYPE_t[::1] total_live_cells) nogil:
+	cdef Py_ssize_t igen
+	cells_gen[0, j] = nUnstim[j] + nDIV[0, j] + nDD[0, j]
+	total_live_cells[j] = cells_gen[0, j]
+	if E > 0:
+		cells_gen[E, j] = 0.
+	for igen in range(1, nDIV.shape[0]):
+		if igen < E:
+			cells_gen[igen, j] = nDIV[igen, j] + nDD[igen, j]
+		else:
+			cells_gen[E, j] += nDIV[igen, j] + nDD[igen, j]
+		total_live_cells[j] += nDIV[igen, j] + nDD[igen, j]
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void fold_generations(DTYPE_t[::1] nUnstim, DTYPE_t[:, ::1] nDIV, DTYPE_t[:, ::1] nDD,
+						   DTYPE_t[:, ::1] cells_gen, DTYPE_t[::1] total_live_cells) nogil:
+	# live cells per observed generation (generations >= last one are pooled) & in total : every time step is independent
+	cdef Py_ssize_t E = cells_gen.shape[0] - 1
+	cdef Py_ssize_t j
+	for j in prange(nUnstim.shape[0], schedule='static'):
+		fold_time_point(j, E, nUnstim, nDIV, nDD, cells_gen, total_live_cells)
+
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
 @cython.cdivision(True)
 class Cyton15Model:
-	def __init__(self, ht, n0, max_div, dt, num_reps, check, fit_to_total_cells, thread=None):
+	# maximum number of (parameter set x generation x time) entries held in memory by 'evaluate_batch'
+	BATCH_SIZE = 2**21
+
+	def __init__(self, ht, n0, max_div, dt, num_reps, check, fit_to_total_cells, control=None, harvest_only=True):
 		self.t0 = <DTYPE_t>0.0
 		self.tf = <DTYPE_t>(max(ht) + dt)
 		self.dt = <DTYPE_t>dt  # time increment : discretisation factor of time
 
 		# declare theoretical time array
 		# cdef np.ndarray[DTYPE_t, ndim=1] times = np.zeros(shape=(int(self.tf/self.dt)+1), dtype=DTYPE)
-		# cdef np.ndarray[DTYPE_t, ndim=1] semi_inf_time = np.zeros(shape=(int(self.tf/self.dt)+1), dtype=DTYPE)
 		self.times = np.arange(self.t0, self.tf, dt, dtype=DTYPE)
-		self.semi_inf_time = np.arange(self.t0, 5000, dt, dtype=DTYPE)
+		self.log_times = log_grid(self.times)
 
 		self.n0 = n0  # experiment initial cell number
 		self.ht = ht  # experiment harvested times
@@ -31,18 +152,72 @@ class Cyton15Model:
 
 		self.exp_max_div = max_div  # experimentally determined maximum division number
 		self.max_div = 25  # theoretical maximum division number
+		self.gen_tol = config.CYTON15_GEN_TOL  # generation truncation tolerance : see active_generations()
+		self.evaluated_gens = self.max_div + 1  # number of generations evaluated by the last 'cyton15' call
+
+		# generation -> (offset, window length) table of subsequent division time 'b' : see window_offsets()
+		self._window_b = None
+		self._window_k = None
+		self._window_l = None
 
-		self.iter = 0
-		self.thread = thread  # required to abort fit
-		self.last_param = []  # an empty list to save parameters at every iteration
+		self.control = control  # run-time control (abort token & progress) : see control.py
 
 		self.fit_to_total_cells = fit_to_total_cells
+		self.harvest_only = harvest_only  # 'cyton15' evaluates harvest time points only (see harvest_rows)
 
 		self.unstim_death_pdf = config.CYTON15_CONFIG['unstim_die']
 		self.stim_div_pdf = config.CYTON15_CONFIG['stim_div']
 		self.stim_die_pdf = config.CYTON15_CONFIG['stim_die']
 		self.stim_dd_pdf = config.CYTON15_CONFIG['stim_dd']
 
+		# reusable work arrays of 'cyton15'
+		self.workspace = Workspace()
+
+		# LRU cache per distribution component : only components whose parameters moved are re-evaluated
+		self.build_dist_cache()
+
+		# harvest gather plan : indices of the data points in 'cells_gen' (or 'total_live_cells') array
+		self.build_harvest_plan()
+
+	def __getstate__(self):
+		# pickled model holds configuration only : no run-time control, work arrays or cached distributions
+		state = self.__dict__.copy()
+		state['control'] = None
+		state['workspace'] = Workspace(self.workspace.enabled)
+		del state['dist_cache']
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.build_dist_cache()
+
+	def build_dist_cache(self):
+		self.dist_cache = {
+			'unstim_die': DistributionCache(self.compute_cdf),
+			'stim_div': DistributionCache(self.compute_cdf),
+			'stim_die': DistributionCache(self.compute_cdf),
+			'stim_dd': DistributionCache(self.compute_cdf),
+			'stim_dd_pdf': DistributionCache(self.compute_pdf)
+		}
+
+	def build_harvest_plan(self):
+		cdef unsigned int n = self.times.size
+		self.ht_idx = harvest_indices(self.times, self.ht, self.dt) if len(self.num_reps) else np.zeros(0, dtype=np.intp)
+		if not self.fit_to_total_cells:
+			self.harvest_idx, self.harvest_mask = gather_plan(self.ht_idx, self.num_reps, self.check, self.exp_max_div+1, n)
+		else:
+			self.harvest_idx = np.repeat(self.ht_idx, self.num_reps).astype(np.intp)
+			self.harvest_mask = np.ones(self.harvest_idx.size, dtype=bool)
+		self.prediction = np.zeros(self.harvest_idx.size, dtype=DTYPE)
+
+		# harvest-only plan : sorted unique harvest columns & gather indices into (generation x harvest column) arrays
+		cols, col_pos = np.unique(self.ht_idx, return_inverse=True)
+		self.harvest_cols = cols.astype(np.int64)
+		if not self.fit_to_total_cells:
+			self.harvest_col_idx = gather_plan(col_pos, self.num_reps, self.check, self.exp_max_div+1, cols.size)[0]
+		else:
+			self.harvest_col_idx = np.repeat(col_pos, self.num_reps).astype(np.intp)
+
 	# this function only takes care of live cell computation for fittings
 	def cyton15(self, flatten_generation_list,
 				DTYPE_t unstimMu, DTYPE_t unstimSig,
@@ -50,134 +225,373 @@ class Cyton15Model:
 				DTYPE_t stimMuDeath, DTYPE_t stimSigDeath,
 				DTYPE_t stimMuDD, DTYPE_t stimSigDD,
 				DTYPE_t b, DTYPE_t pF):
-		# check for abort signal
-		if not self.thread.is_running:
-			print(' >>> Abort fitting!')
-			raise Exception  # raising any exception to stop
-		self.iter += 1
-
-		cdef list params = [
-			unstimMu, unstimSig,
-			stimMuDiv, stimSigDiv,
-			stimMuDeath, stimSigDeath,
-			stimMuDD, stimSigDD,
-			b, pF
-		]
-		self.save_last_param(params)
+		# check for abort signal & record progress
+		if self.control is not None:
+			self.control.check()
+			self.control.record([
+				unstimMu, unstimSig,
+				stimMuDiv, stimSigDiv,
+				stimMuDeath, stimSigDeath,
+				stimMuDD, stimSigDD,
+				b, pF
+			])
 
 		cdef unsigned int n = self.times.size
 
-		# pre-compute probability distributions
-		cdef np.ndarray[DTYPE_t, ndim=1] pdfDiv = np.zeros(shape=n, dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=1] pdfDD = np.zeros(shape=n, dtype=DTYPE)
-		pdfDiv = self.compute_pdf(self.times, stimMuDiv, stimSigDiv, pdf_type=self.stim_div_pdf)
-		pdfDD = self.compute_pdf(self.times, stimMuDD, stimSigDD, pdf_type=self.stim_dd_pdf)
+		# pre-compute probability distributions (read-only arrays shared with 'self.dist_cache')
+		cache, times, tf = self.dist_cache, self.times, self.tf
+		pdfDD = cache['stim_dd_pdf'](times, stimMuDD, stimSigDD, self.stim_dd_pdf, self.dt, tf)
 
 		# pre-compute cumulative distributions
-		cdef np.ndarray[DTYPE_t, ndim=1] cdfUnstim = np.zeros(shape=n, dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=1] cdfDiv = np.zeros(shape=n, dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=1] cdfDie = np.zeros(shape=n, dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=1] cdfDD = np.zeros(shape=n, dtype=DTYPE)
-		cdfUnstim = self.compute_cdf(self.times, unstimMu, unstimSig, pdf_type=self.unstim_death_pdf)
-		cdfDiv = self.compute_cdf(self.times, stimMuDiv, stimSigDiv, pdf_type=self.stim_div_pdf)
-		cdfDie = self.compute_cdf(self.times, stimMuDeath, stimSigDeath, pdf_type=self.stim_die_pdf)
-		cdfDD = self.compute_cdf(self.times, stimMuDD, stimSigDD, pdf_type=self.stim_dd_pdf)
+		cdfUnstim = cache['unstim_die'](times, unstimMu, unstimSig, self.unstim_death_pdf, self.dt, tf)
+		cdfDiv = cache['stim_div'](times, stimMuDiv, stimSigDiv, self.stim_div_pdf, self.dt, tf)
+		cdfDie = cache['stim_die'](times, stimMuDeath, stimSigDeath, self.stim_die_pdf, self.dt, tf)
+		cdfDD = cache['stim_dd'](times, stimMuDD, stimSigDD, self.stim_dd_pdf, self.dt, tf)
+
+		# work arrays are owned by 'self.workspace' : allocated once, zero-filled on every call
+		ws = self.workspace
+
+		# only generations carrying a non-negligible part of the population are evaluated (rows >= G are left out)
+		cdef np.ndarray[np.int64_t, ndim=1] window_k, window_l
+		window_k, window_l = self.window_offsets(b)
+		cdef unsigned int G = self.active_generations(cdfDiv, cdfDD, pdfDD, pF, window_k)
+		self.evaluated_gens = G
+		if self.harvest_only:
+			return self.harvest_prediction(G, pF, cdfUnstim, cdfDiv, cdfDie, cdfDD, pdfDD, window_k, window_l)
 
 		# declare 3 arrays for unstimulated cells, divided cells & destiny cells
-		cdef np.ndarray[DTYPE_t, ndim=1] nUnstim = np.zeros(shape=n, dtype=DTYPE)
-		nUnstim = self.n0 * (1. - pF) * (1. - cdfUnstim)
-		cdef np.ndarray[DTYPE_t, ndim=2] nDIV = np.zeros(shape=(self.max_div+1, n), dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=2] nDD = np.zeros(shape=(self.max_div+1, n), dtype=DTYPE)
+		cdef np.ndarray[DTYPE_t, ndim=1] nUnstim = ws.empty('nUnstim', n)
+		np.multiply(self.n0 * (1. - pF), 1. - cdfUnstim, out=nUnstim)
+		cdef np.ndarray[DTYPE_t, ndim=2] nDIV = ws.empty('nDIV', (self.max_div+1, n))[:G]
+		cdef np.ndarray[DTYPE_t, ndim=2] nDD = ws.empty('nDD', (self.max_div+1, n))[:G]
 
 		# declare array to store proportion of destiny cells
-		cdef np.ndarray[DTYPE_t, ndim=2] DDprop = np.zeros(shape=(self.max_div+1, n), dtype=DTYPE)
+		cdef np.ndarray[DTYPE_t, ndim=2] DDprop = ws.empty('DDprop', (self.max_div+1, n))[:G]
+		nDIV.fill(0.)
+		nDD.fill(0.)
+		DDprop.fill(0.)
 
 		# store number of live cells at all time per generations
-		cdef np.ndarray[DTYPE_t, ndim=2] cells_gen = np.zeros(shape=(self.exp_max_div+1, n), dtype=DTYPE)
+		cdef np.ndarray[DTYPE_t, ndim=2] cells_gen = ws.zeros('cells_gen', (self.exp_max_div+1, n))
 
 		# store total live cells
-		cdef np.ndarray[DTYPE_t, ndim=1] total_live_cells = np.zeros(shape=n, dtype=DTYPE)
-
-		cdef DTYPE_t t, core
-		cdef DTYPE_t top = 0.
-		cdef DTYPE_t bottom = 0.
-		cdef unsigned int igen, j, l
-		for igen in range(self.max_div+1):
-			for j, t in enumerate(self.times):
-				# nUnstim[j] = self.n0 * (1. - pF) * (1. - cdfUnstim[j])
-				core = <DTYPE_t>(2.**igen * self.n0 * pF * (1. - cdfDie[j]))
-				if igen == 0:
-					# nDIV[igen, j] = core * (1. - cdfDD[j]) * np.sum(pdfDiv[j:]) * self.dt
-					nDIV[igen, j] = core * (1. - cdfDD[j]) * (1. - cdfDiv[j])
-
-					if j == 0:
-						# DDprop[igen, j] = pdfDD[j] * np.sum(pdfDiv) * self.dt
-						DDprop[igen, j] = pdfDD[j] * cdfDiv[n-1]
-						nDD[igen, j] = core * DDprop[igen, j] * self.dt
-					else:
-						# DDprop[igen, j] = pdfDD[j] * np.sum(pdfDiv[j:]) * self.dt + DDprop[igen, j-1]
-						DDprop[igen, j] = pdfDD[j] * (1. - cdfDiv[j]) + DDprop[igen, j-1]
-						nDD[igen, j] = core * DDprop[igen, j] * self.dt
-
-					cells_gen[igen, j] = nUnstim[j] + nDIV[igen, j] + nDD[igen, j]
-					total_live_cells[j] += cells_gen[igen, j]
-				else:
-					# bottom = <DTYPE_t>(t + b * (igen - 1))
-					# top = <DTYPE_t>(t + b * igen)
-					# where = np.where((bottom < self.times) & (self.times <= top))
-					# l = where[0].size
-					# k = (igen - 1) * l
-					if j == 0:
-						bottom = <DTYPE_t>(t + b * (igen - 1))
-						top = <DTYPE_t>(t + b * igen)
-						where = np.where((bottom < self.semi_inf_time) & (self.semi_inf_time <= top))
-						l = where[0].size
-						k = (igen - 1) * l
-					else:
-						if k < j <= (k+l):
-							# nDIV[igen, j] = core * (1. - cdfDD[j]) * np.sum(pdfDiv[:j-k]) * self.dt
-							nDIV[igen, j] = core * (1. - cdfDD[j]) * cdfDiv[j-k]
-
-							# DDprop[igen, j] = pdfDD[j] * np.sum(pdfDiv[:j-k]) * self.dt + DDprop[igen, j-1]
-							DDprop[igen, j] = pdfDD[j] * cdfDiv[j-k] + DDprop[igen, j-1]
-							nDD[igen, j] = core * DDprop[igen, j] * self.dt
-						elif j > (k+l):
-							# nDIV[igen, j] = core * (1. - cdfDD[j]) * np.sum(pdfDiv[j-k-l:j-k]) * self.dt
-							nDIV[igen, j] = core * (1. - cdfDD[j]) * (cdfDiv[j-k] - cdfDiv[j-k-l])
-
-							# DDprop[igen, j] = pdfDD[j] * np.sum(pdfDiv[j-k-l:j-k]) * self.dt + DDprop[igen, j-1]
-							DDprop[igen, j] = pdfDD[j] * (cdfDiv[j-k] - cdfDiv[j-k-l]) + DDprop[igen, j-1]
-							nDD[igen, j] = core * DDprop[igen, j] * self.dt
-
-						if igen < self.exp_max_div:
-							cells_gen[igen, j] = nDIV[igen, j] + nDD[igen, j]
-						else:
-							cells_gen[self.exp_max_div, j] += nDIV[igen, j] + nDD[igen, j]
-					total_live_cells[j] += nDIV[igen, j] + nDD[igen, j]
+		cdef np.ndarray[DTYPE_t, ndim=1] total_live_cells = ws.zeros('total_live_cells', n)
+
+		generation_rows(<DTYPE_t>self.n0, pF, self.dt, cdfDiv, cdfDie, cdfDD, pdfDD, window_k, window_l, nDIV, nDD, DDprop)
+		fold_generations(nUnstim, nDIV, nDD, cells_gen, total_live_cells)
 
 		# extract number of live cells at harvested time points from 'cells_gen' array
-		cdef list model = []
+		# NB: 'self.prediction' is overwritten on every call. Copy it if the values need to persist
 		if not self.fit_to_total_cells:
-			for itpt, ht in enumerate(self.ht):
-				t_idx = np.where(self.times == ht)
-				for irep in range(self.num_reps[itpt]):
-					for igen in range(self.exp_max_div+1):
-						# check for excluded data
-						if self.check[itpt][irep][igen]:
-							model.append(cells_gen[igen, t_idx[0][0]])
+			cells_gen.take(self.harvest_idx, out=self.prediction)
 		else:
-			for itpt, ht in enumerate(self.ht):
-				t_idx = np.where(self.times == ht)
-				for irep in range(self.num_reps[itpt]):
-					model.append(total_live_cells[t_idx[0][0]])
-
-		return np.asfarray(model)
+			total_live_cells.take(self.harvest_idx, out=self.prediction)
+		return self.prediction
+
+	def harvest_prediction(self, unsigned int G, DTYPE_t pF, cdfUnstim, cdfDiv, cdfDie, cdfDD, pdfDD, window_k, window_l):
+		"""
+		Harvest-only version of 'cyton15' : live cells are evaluated at harvest columns only, so the cost of a call barely
+		depends on 'dt' beyond the distribution evaluations (the running sum of destiny proportion still spans the grid).
+
+		:param G: (int) number of generations to evaluate (see active_generations)
+		:param pF: (float) fraction of stimulated cells
+		:param cdfUnstim: (ndarray) unstimulated death CDF
+		:param cdfDiv: (ndarray) division CDF
+		:param cdfDie: (ndarray) death CDF
+		:param cdfDD: (ndarray) destiny CDF
+		:param pdfDD: (ndarray) destiny PDF
+		:param window_k: (ndarray) window offsets per generation (see window_offsets)
+		:param window_l: (ndarray) window lengths per generation
+		:return: (ndarray) model prediction (same as 'cyton15')
+		"""
+		ws = self.workspace
+		cols = self.harvest_cols
+		cdef unsigned int H = cols.size
+
+		cdef np.ndarray[DTYPE_t, ndim=1] nUnstim = ws.empty('hUnstim', H)
+		np.multiply(self.n0 * (1. - pF), 1. - cdfUnstim[cols], out=nUnstim)
+		cdef np.ndarray[DTYPE_t, ndim=2] nDIV = ws.zeros('hDIV', (self.max_div+1, H))[:G]
+		cdef np.ndarray[DTYPE_t, ndim=2] nDD = ws.zeros('hDD', (self.max_div+1, H))[:G]
+		cdef np.ndarray[DTYPE_t, ndim=2] cells_gen = ws.zeros('hCells_gen', (self.exp_max_div+1, H))
+		cdef np.ndarray[DTYPE_t, ndim=1] total_live_cells = ws.zeros('hTotal_live_cells', H)
+
+		harvest_rows(<DTYPE_t>self.n0, pF, self.dt, cdfDiv, cdfDie, cdfDD, pdfDD, window_k, window_l, cols, nDIV, nDD)
+		fold_generations(nUnstim, nDIV, nDD, cells_gen, total_live_cells)
+
+		# NB: 'self.prediction' is overwritten on every call. Copy it if the values need to persist
+		if not self.fit_to_total_cells:
+			cells_gen.take(self.harvest_col_idx, out=self.prediction)
+		else:
+			total_live_cells.take(self.harvest_col_idx, out=self.prediction)
+		return self.prediction
+
+	def active_generations(self, cdfDiv, cdfDD, pdfDD, DTYPE_t pF, window_k):
+		"""
+		Number of generations to evaluate. Live cells of generation g >= 1 are bounded by
+		2^g * n0 * pF * F(tf - k_g*dt) * max_t[1 - Q(t) + dt * cumsum(q)(t)], where F is the division CDF, k_g the window
+		offset of the generation and Q (q) the destiny CDF (PDF). Generations are dropped from the top as long as the sum of
+		their bounds stays below 'self.gen_tol' x n0. Generations starting after the last time point are always dropped.
+		Dropped generations are pooled into the last observed generation as zeros.
+
+		:param cdfDiv: (ndarray) division CDF
+		:param cdfDD: (ndarray) destiny CDF
+		:param pdfDD: (ndarray) destiny PDF
+		:param pF: (float) fraction of stimulated cells
+		:param window_k: (ndarray) window offsets per generation (see window_offsets)
+		:return: (int) number of generations to evaluate (including generation 0)
+		"""
+		cdef unsigned int n = self.times.size
+		gens = np.arange(1, self.max_div+1)
+		k = window_k[1:]
+		reached = k < n - 1
+		bound = np.zeros(self.max_div, dtype=DTYPE)
+		factor = np.max(1. - cdfDD + self.dt * np.cumsum(pdfDD))
+		bound[reached] = 2.0**gens[reached] * pF * cdfDiv[n - 1 - k[reached]] * factor
+		tail = np.cumsum(bound[::-1])[::-1]  # bound of generations g, g+1, ..., max_div
+		return 1 + int(np.count_nonzero(tail > self.gen_tol))
+
+	def cache_stats(self):
+		"""
+		:return: (dict) component -> (hits, misses) of distribution caches used by 'cyton15'
+		"""
+		return {name: (cache.hits, cache.misses) for name, cache in self.dist_cache.items()}
+
+	# parameter names in the order of 'cyton15' arguments
+	PARAM_NAMES = (
+		'unstimMu', 'unstimSig',
+		'stimMuDiv', 'stimSigDiv',
+		'stimMuDeath', 'stimSigDeath',
+		'stimMuDD', 'stimSigDD',
+		'b', 'pF'
+	)
+
+	def cyton15_jacobian(self, flatten_generation_list,
+						 DTYPE_t unstimMu, DTYPE_t unstimSig,
+						 DTYPE_t stimMuDiv, DTYPE_t stimSigDiv,
+						 DTYPE_t stimMuDeath, DTYPE_t stimSigDeath,
+						 DTYPE_t stimMuDD, DTYPE_t stimSigDD,
+						 DTYPE_t b, DTYPE_t pF):
+		"""
+		Analytic Jacobian of 'cyton15' output with respect to its 10 parameters (columns follow PARAM_NAMES).
+
+		Live cells of generation g are pF * A_g * [(1 - Q) * W_g + dt * cumsum(q * V_g)], where A_g = 2^g * n0 * (1 - E),
+		E/Q are death/destiny CDFs, q is destiny PDF and W_g (V_g) is the fraction of cells whose division time lies in
+		the window of generation g. Derivatives of CDFs & PDFs are closed form (see distributions.py), so the Jacobian
+		costs about one model evaluation.
+		The model only depends on 'b' through integer window offsets (see window_offsets) : it is piecewise constant in
+		'b' and has no derivative to differentiate analytically (the derivative of the continuous time model differs from
+		the discrete model by up to ~50% at dt = 0.5). The 'b' column is therefore the central secant slope of the discrete
+		model over [b - dt, b + dt] (see b_secant), which costs 2 more model evaluations.
+
+		:return: (ndarray) Jacobian of shape (number of data points, 10)
+		"""
+		cdef unsigned int n = self.times.size
+		cdef unsigned int G = self.max_div + 1
+		cdef unsigned int E = self.exp_max_div
+		times, log_times = self.times, self.log_times
+
+		U, dU_mu, dU_sig = cdf_derivatives(times, self.unstim_death_pdf, unstimMu, unstimSig, log_times=log_times)
+		D, dD_mu, dD_sig = cdf_derivatives(times, self.stim_div_pdf, stimMuDiv, stimSigDiv, log_times=log_times)
+		Die, dDie_mu, dDie_sig = cdf_derivatives(times, self.stim_die_pdf, stimMuDeath, stimSigDeath, log_times=log_times)
+		Q, dQ_mu, dQ_sig = cdf_derivatives(times, self.stim_dd_pdf, stimMuDD, stimSigDD, log_times=log_times)
+		q, dq_mu, dq_sig = pdf_derivatives(times, self.stim_dd_pdf, stimMuDD, stimSigDD, log_times=log_times)
+
+		# index of division time window on the time grid per generation : shift[g, j] = j - k_g
+		window_k, window_l = self.window_offsets(b)
+		gens = np.arange(G)
+		shift = np.arange(n)[None, :] - window_k[:, None]
+		lag = window_l[:, None]
+
+		def shifted(arr, idx):
+			# arr[idx] for idx >= 1, zero otherwise (no cells in the window yet)
+			padded = np.array(arr, dtype=DTYPE)
+			padded[0] = 0.
+			return padded[np.clip(idx, 0, n-1)] * (idx >= 1)
+
+		def window(cdf):
+			W = shifted(cdf, shift) - shifted(cdf, shift - lag)
+			W[0] = -cdf
+			return W
+
+		# division windows (W) & their variant for destiny cells (V) : gen 0 uses 1 - D (and D[n-1] at t0)
+		W = window(D)
+		W[0] += 1.
+		V = W.copy()
+		V[0, 0] = D[n-1]
+		dW = [window(dD_mu), window(dD_sig)]
+		dV = [w.copy() for w in dW]
+		dV[0][0, 0], dV[1][0, 0] = dD_mu[n-1], dD_sig[n-1]
+
+		A = (2. ** gens)[:, None] * self.n0 * (1. - Die)[None, :]
+		C = np.cumsum(q * V, axis=1)
+		inner = (1. - Q) * W + self.dt * C
+
+		dcells = np.zeros(shape=(10, G, n), dtype=DTYPE)
+		dcells[0, 0] = -self.n0 * (1. - pF) * dU_mu
+		dcells[1, 0] = -self.n0 * (1. - pF) * dU_sig
+		for i in range(2):
+			dcells[2+i] = pF * A * ((1. - Q) * dW[i] + self.dt * np.cumsum(q * dV[i], axis=1))
+		for i, dDie in enumerate([dDie_mu, dDie_sig]):
+			dcells[4+i] = pF * (2. ** gens)[:, None] * self.n0 * (-dDie)[None, :] * inner
+		for i, (dQ, dq) in enumerate([(dQ_mu, dq_mu), (dQ_sig, dq_sig)]):
+			dcells[6+i] = pF * A * (-dQ * W + self.dt * np.cumsum(dq * V, axis=1))
+		dcells[9] = A * inner
+		dcells[9, 0] -= self.n0 * (1. - U)
+
+		# map generation derivatives to data points
+		if not self.fit_to_total_cells:
+			dcells_gen = np.concatenate([dcells[:, :E], dcells[:, E:].sum(axis=1, keepdims=True)], axis=1)
+			jac = dcells_gen.reshape(10, -1)[:, self.harvest_idx].T
+		else:
+			jac = dcells.sum(axis=1)[:, self.harvest_idx].T
+		jac[:, 8] = self.b_secant([
+			unstimMu, unstimSig, stimMuDiv, stimSigDiv, stimMuDeath, stimSigDeath, stimMuDD, stimSigDD, b, pF
+		])
+		return jac
+
+	def b_secant(self, params):
+		"""
+		Central secant slope of 'cyton15' output with respect to 'b' over one time step on either side (one sided if
+		b - dt is not positive). Run-time control is not involved : these evaluations are not fit iterations.
+
+		:param params: (list) 10 parameter values in the order of PARAM_NAMES
+		:return: (ndarray) slope per data point
+		"""
+		upper, lower = list(params), list(params)
+		upper[8] = params[8] + self.dt
+		if params[8] - self.dt > 0.:
+			lower[8] = params[8] - self.dt
+		control, self.control = self.control, None
+		try:
+			high = np.array(self.cyton15(None, *upper))
+			low = np.array(self.cyton15(None, *lower))
+		finally:
+			self.control = control
+		return (high - low) / (upper[8] - lower[8])
+
+	def check_jacobian(self, params, DTYPE_t rel_step=1E-6, DTYPE_t tol=1E-7):
+		"""
+		Check 'cyton15_jacobian' against central finite differences of 'cyton15'. Errors are scaled by parameter values &
+		the largest prediction. All columns but 'b' are closed form and agree to about 1E-9. The 'b' column is not
+		checked : the model is piecewise constant in 'b' (division times snap to the time grid), so the column is a
+		secant (see b_secant) and secants over wider steps differ from it by up to ~100% on a coarse grid.
+
+		:param params: (list) 10 parameter values in the order of PARAM_NAMES
+		:param rel_step: (float) relative step size for finite differences
+		:param tol: (float) maximum scaled error per parameter
+		:return: (dict) maximum scaled error per checked parameter (every parameter except 'b')
+		:raise AssertionError: if any checked column exceeds 'tol'
+		"""
+		params = np.asarray(params, dtype=DTYPE)
+		analytic = self.cyton15_jacobian(None, *params)
+		scale = np.abs(self.cyton15(None, *params)).max() + 1.
+		errors = {}
+		for i, name in enumerate(self.PARAM_NAMES):
+			if name == 'b':
+				continue  # secant column (see above)
+			h = rel_step * max(abs(params[i]), 1E-3)
+			upper, lower = params.copy(), params.copy()
+			upper[i] += h
+			lower[i] -= h
+			numeric = (np.array(self.cyton15(None, *upper)) - np.array(self.cyton15(None, *lower))) / (2. * h)
+			errors[name] = np.abs(analytic[:, i] - numeric).max() * abs(params[i]) / scale
+		failed = {name: error for name, error in errors.items() if not error <= tol}
+		assert not failed, "Cyton 1.5 Jacobian differs from finite differences (tolerance {0}) : {1}".format(tol, failed)
+		return errors
+
+	def evaluate_batch(self, param_matrix):
+		"""
+		Evaluate 'cyton15' for many parameter sets at once (e.g. a population of differential evolution).
+		The model is evaluated in its closed form (see cyton15_jacobian), vectorised over parameter sets, generations
+		and time, instead of one Python call per parameter set. Parameter sets are processed in chunks of at most
+		BATCH_SIZE array entries.
+
+		:param param_matrix: (ndarray) parameter sets of shape (P, 10); columns follow PARAM_NAMES
+		:return: (ndarray) predictions of shape (P, number of data points)
+		"""
+		param_matrix = np.atleast_2d(np.asarray(param_matrix, dtype=DTYPE))
+		cdef unsigned int P = param_matrix.shape[0]
+		cdef unsigned int chunk = max(1, self.BATCH_SIZE // ((self.max_div+1) * self.times.size))
+		if self.control is not None:
+			self.control.check()
+			self.control.record(n=P)
+
+		predictions = np.zeros(shape=(P, self.harvest_idx.size), dtype=DTYPE)
+		for start in range(0, P, chunk):
+			predictions[start:start+chunk] = self._batch_live_cells(param_matrix[start:start+chunk])
+		return predictions
+
+	def _batch_live_cells(self, X):
+		cdef unsigned int P = X.shape[0]
+		cdef unsigned int n = self.times.size
+		cdef unsigned int G = self.max_div + 1
+		cdef unsigned int E = self.exp_max_div
+
+		# CDFs of all parameter sets in one call : rows [unstim death, division, death, destiny] per parameter set
+		pdf_types = [self.unstim_death_pdf, self.stim_div_pdf, self.stim_die_pdf, self.stim_dd_pdf] * P
+		cdfs = cdf_grid(self.times, pdf_types, X[:, 0:8:2].ravel(), X[:, 1:8:2].ravel(), log_times=self.log_times).reshape(P, 4, n)
+		U, D, Die, Q = cdfs[:, 0], cdfs[:, 1], cdfs[:, 2], cdfs[:, 3]
+		q = pdf_grid(self.times, [self.stim_dd_pdf] * P, X[:, 6], X[:, 7], log_times=self.log_times)
+		pF = X[:, 9, None, None]
+
+		# division time windows per parameter set & generation (see window_offsets)
+		gens = np.arange(G)
+		b = X[:, 8, None]
+		top = self._count_grid_points((b * gens).ravel()).reshape(P, G)
+		bottom = self._count_grid_points((b * np.maximum(gens - 1, 0)).ravel()).reshape(P, G)
+		window_l = top - bottom
+		window_l[:, 0] = 0
+		window_k = np.maximum(gens - 1, 0) * window_l
+		shift = np.arange(n)[None, None, :] - window_k[:, :, None]
+
+		padded = D.copy()
+		padded[:, 0] = 0.
+		def shifted(idx):
+			# D[idx] for idx >= 1, zero otherwise (no cells in the window yet)
+			return np.take_along_axis(padded[:, None, :], np.clip(idx, 0, n-1), axis=2) * (idx >= 1)
+
+		W = shifted(shift) - shifted(shift - window_l[:, :, None])
+		W[:, 0] = 1. - D
+		V = W.copy()
+		V[:, 0, 0] = D[:, n-1]
+
+		A = (2. ** gens)[None, :, None] * self.n0 * (1. - Die)[:, None, :]
+		cells = pF * A * ((1. - Q)[:, None, :] * W + self.dt * np.cumsum(q[:, None, :] * V, axis=2))
+		cells[:, 0] += self.n0 * (1. - pF[:, 0]) * (1. - U)
 
-	def save_last_param(self, params):
-		if self.iter % 50 == 0:
-			self.last_param = []
-		self.last_param.append(params)
-		return self.last_param
+		if not self.fit_to_total_cells:
+			cells_gen = np.concatenate([cells[:, :E], cells[:, E:].sum(axis=1, keepdims=True)], axis=1)
+			return cells_gen.reshape(P, -1)[:, self.harvest_idx]
+		return cells.sum(axis=1)[:, self.harvest_idx]
+
+	def window_offsets(self, DTYPE_t b):
+		"""
+		Generation 'igen' (>= 1) occupies window (b*(igen-1), b*igen] of the time grid. This function returns number of
+		grid points in that window (l) and its offset (k = (igen-1)*l) for all generations.
+		The table only depends on 'b' & 'dt', so it is computed once per value of 'b' and reused on subsequent calls.
+
+		:param b: (float) subsequent division time
+		:return: (tuple) offsets & window lengths per generation (index 0 is unused)
+		"""
+		if self._window_b != b:
+			gens = np.arange(self.max_div+1, dtype=np.int64)
+			top = self._count_grid_points(b * gens)
+			bottom = self._count_grid_points(b * np.maximum(gens - 1, 0))
+			l = top - bottom
+			l[0] = 0
+			self._window_l = l
+			self._window_k = np.maximum(gens - 1, 0) * l
+			self._window_b = b
+		return self._window_k, self._window_l
+
+	def _count_grid_points(self, edges):
+		# number of grid points i*dt (i >= 0) such that i*dt <= edge
+		# closed form floor(edge/dt) is corrected by one step where floating point rounding disagrees with i*dt <= edge
+		edges = np.asarray(edges, dtype=DTYPE)
+		cdef np.ndarray[np.int64_t, ndim=1] c = np.floor(edges / self.dt).astype(np.int64)
+		c[(c + 1) * self.dt <= edges] += 1
+		c[c * self.dt > edges] -= 1
+		return c + 1
 
 	def compute_pdf(self, times, mu, sig, lamb=1, str pdf_type='Lognormal'):
 		if pdf_type == 'Lognormal':
@@ -197,6 +611,25 @@ class Cyton15Model:
 		elif pdf_type == 'Exponential':
 			return expon.cdf(times, scale=1.0/mu)
 
+	def division_windows(self, cdfDiv, window_k, window_l):
+		"""
+		Fraction of cells of every generation within its division window on the time grid (see window_offsets).
+			- generation 0 : 1 - F(t)
+			- generation igen >= 1 : F(t - k) - F(t - k - l) for t > k (zero otherwise), with F(s) = 0 for s <= 0
+
+		:param cdfDiv: (ndarray) division CDF of length n
+		:param window_k: (ndarray) window offsets per generation
+		:param window_l: (ndarray) window lengths per generation
+		:return: (ndarray) array of shape (max_div+1, n)
+		"""
+		cdef unsigned int n = cdfDiv.size
+		shift = np.arange(n)[None, :] - window_k[:, None]
+		upper = np.where(shift > 0, cdfDiv[np.clip(shift, 0, n-1)], 0.)
+		lower = np.where(shift > window_l[:, None], cdfDiv[np.clip(shift - window_l[:, None], 0, n-1)], 0.)
+		window = upper - lower
+		window[0] = 1. - cdfDiv
+		return window
+
 	# following function is a copy of 'cyton15' but with extra dead cell computation
 	def compute_model_results(self, model_times, params):
 		# unstimulated death parameters
@@ -235,124 +668,50 @@ class Cyton15Model:
 		cdfDie = self.compute_cdf(model_times, muDie, sigDie, pdf_type=self.stim_die_pdf)
 		cdfDD = self.compute_cdf(model_times, muDD, sigDD, pdf_type=self.stim_dd_pdf)
 
-		"""LIVE CELLS"""
-		# declare 3 arrays for unstimulated cells, divided cells & destiny cells
-		cdef np.ndarray[DTYPE_t, ndim=1] nUnstim = np.zeros(shape=n, dtype=DTYPE)
-		nUnstim = self.n0 * (1. - pF) * (1. - cdfUnstim)
-		cdef np.ndarray[DTYPE_t, ndim=2] nDIV = np.zeros(shape=(self.max_div+1, n), dtype=DTYPE)
-		cdef np.ndarray[DTYPE_t, ndim=2] nDD = np.zeros(shape=(self.max_div+1, n), dtype=DTYPE)
-
-		# declare array to store proportion of destiny cells
-		cdef np.ndarray[DTYPE_t, ndim=2] DDprop = np.zeros(shape=(self.max_div+1, n), dtype=DTYPE)
+		# all generations at all time points at once : (G x n) arrays broadcast over generations (rows) & time (columns)
+		cdef unsigned int G = self.max_div + 1
+		cdef unsigned int E = self.exp_max_div
+		cdef np.ndarray[np.int64_t, ndim=1] window_k, window_l
+		window_k, window_l = self.window_offsets(b)
 
-		# store number of cells at all time per generation
-		cdef np.ndarray[DTYPE_t, ndim=2] cells_gen = np.zeros(shape=(self.exp_max_div+1, n), dtype=DTYPE)
+		# fraction of cells of each generation within its division window : generation 0 holds undivided cells,
+		# generation 'igen' holds cells with division time in (t - k - l, t - k] (k, l : window offset & length)
+		cdef np.ndarray[DTYPE_t, ndim=2] window = self.division_windows(cdfDiv, window_k, window_l)
 
-		# store total live cells
-		cdef np.ndarray[DTYPE_t, ndim=1] total_live_cells = np.zeros(shape=n, dtype=DTYPE)
+		"""LIVE CELLS"""
+		nUnstim = self.n0 * (1. - pF) * (1. - cdfUnstim)
+		core = (2.**np.arange(G) * self.n0 * pF)[:, None] * (1. - cdfDie)[None, :]
+		nDIV = core * (1. - cdfDD) * window
+
+		# proportion of destiny cells : running sum of destiny PDF over cells within the division window
+		ddTerm = pdfDD * window
+		ddTerm[0, 0] = pdfDD[0] * cdfDiv[n-1]
+		DDprop = np.cumsum(ddTerm, axis=1)
+		nDD = core * DDprop * self.dt
+
+		# number of cells per generation (generations >= last observed one are pooled) & in total
+		liveGen = nDIV + nDD
+		liveGen[0] = nUnstim + nDIV[0] + nDD[0]
+		cells_gen = np.zeros(shape=(E+1, n), dtype=DTYPE)
+		cells_gen[:E] = liveGen[:E]
+		cells_gen[E] = np.sum(liveGen[E:], axis=0)
+		total_live_cells = np.sum(liveGen, axis=0)
 
 		"""DEAD CELLS"""
-		# store unstimulated dead cells
-		cdef np.ndarray[DTYPE_t, ndim=1] nDeadUnstim = np.zeros(shape=n, dtype=DTYPE)
 		nDeadUnstim = self.n0 * (1. - pF) * cdfUnstim
 
-		# store dead cells from dividing cells
-		cdef np.ndarray[DTYPE_t, ndim=2] nDeadDIV = np.zeros(shape=(self.max_div+1, n), dtype=DTYPE)
-
-		# store dead cells from destiny cells
-		cdef np.ndarray[DTYPE_t, ndim=2] nDeadDD = np.zeros(shape=(self.max_div+1, n), dtype=DTYPE)
-
-		# store dead cells at all time per generation
-		cdef np.ndarray[DTYPE_t, ndim=2] dead_cells_gen = np.zeros(shape=(self.exp_max_div+1, n), dtype=DTYPE)
-
-		# store total dead cells
-		cdef np.ndarray[DTYPE_t, ndim=1] total_dead_cells = np.zeros(shape=n, dtype=DTYPE)
-
-		cdef DTYPE_t t, core, core_dead
-		cdef DTYPE_t top = 0.
-		cdef DTYPE_t bottom = 0.
-		cdef unsigned int igen, j, l
-		for igen in range(self.max_div+1):
-			for j, t in enumerate(model_times):
-				core = <DTYPE_t>(2.**igen * self.n0 * pF * (1. - cdfDie[j]))
-				core_dead = <DTYPE_t>(2.**igen * self.n0 * pF * cdfDie[j])
-				if igen == 0:
-					# compute live & dead dividing cells
-					# nDIV[igen, j] = core * (1. - cdfDD[j]) * np.sum(pdfDiv[j:]) * self.dt
-					nDIV[igen, j] = core * (1. - cdfDD[j]) * (1. - cdfDiv[j])
-					# nDeadDIV[igen, j] = core_dead * (1. - cdfDD[j]) * (1. - cdfDiv[j])  # this method doesn't know if there's any live cells left to die. so perhaps wrong method.
-
-					# compute proportion of destiny cells
-					if j == 0:
-						nDeadDIV[igen, j] = 2. * nDIV[igen, j] * pdfDie[j] * self.dt
-
-						# DDprop[igen, j] = pdfDD[j] * np.sum(pdfDiv) * self.dt
-						DDprop[igen, j] = pdfDD[j] * cdfDiv[n-1]
-						nDD[igen, j] = core * DDprop[igen, j] * self.dt
-						nDeadDD[igen, j] = 2. * nDD[igen, j] * pdfDie[j] * self.dt
-					else:
-						nDeadDIV[igen, j] = 2. * nDIV[igen, j] * pdfDie[j] * self.dt + nDeadDIV[igen, j-1]
-
-						# DDprop[igen, j] = pdfDD[j] * np.sum(pdfDiv[j:]) * self.dt + DDprop[igen, j-1]
-						DDprop[igen, j] = pdfDD[j] * (1. - cdfDiv[j]) + DDprop[igen, j-1]
-						nDD[igen, j] = core * DDprop[igen, j] * self.dt
-						nDeadDD[igen, j] = 2. * nDD[igen, j] * pdfDie[j] * self.dt + nDeadDD[igen, j-1]
-
-					# compute live & dead destiny cells - this method doesn't know if there's any live cells left to die. so perhaps wrong method.
-					# nDD[igen, j] = core * DDprop[igen, j] * self.dt
-					# nDeadDD[igen, j] = core_dead * DDprop[igen, j] * self.dt
-					# nDeadDD[igen, j] = 2. * nDD[igen, j] * pdfDie[j] * self.dt + nDeadDD[igen, j-1]
-
-					# compute total live cells
-					cells_gen[igen, j] = nUnstim[j] + nDIV[igen, j] + nDD[igen, j]
-					total_live_cells[j] += cells_gen[igen, j]
-
-					# compute total dead cells
-					dead_cells_gen[igen, j] = nDeadUnstim[j] + nDeadDIV[igen, j] + nDeadDD[igen, j]
-					total_dead_cells[j] += dead_cells_gen[igen, j]
-				else:
-					# bottom = <DTYPE_t>(t + b * (igen - 1))
-					# top = <DTYPE_t>(t + b * igen)
-					# where = np.where((bottom < times) & (times <= top))
-					# l = where[0].size
-					# k = (igen - 1) * l
-					if j == 0:
-						bottom = <DTYPE_t>(t + b * (igen - 1))
-						top = <DTYPE_t>(t + b * igen)
-						where = np.where((bottom < self.semi_inf_time) & (self.semi_inf_time <= top))
-						l = where[0].size
-						k = (igen - 1) * l
-					else:
-						if k < j <= (k+l):
-							# nDIV[igen, j] = core * (1. - cdfDD[j]) * np.sum(pdfDiv[:j-k]) * self.dt
-							nDIV[igen, j] = core * (1. - cdfDD[j]) * cdfDiv[j-k]
-							# nDeadDIV[igen, j] = core_dead * (1. - cdfDD[j]) * cdfDiv[j-k]  # this method doesn't know if there's any live cells left to die. so perhaps wrong method.
-
-							# DDprop[igen, j] = pdfDD[j] * np.sum(pdfDiv[:j-k]) * self.dt + DDprop[igen, j-1]
-							DDprop[igen, j] = pdfDD[j] * cdfDiv[j-k] + DDprop[igen, j-1]
-							nDD[igen, j] = core * DDprop[igen, j] * self.dt
-							# nDeadDD[igen, j] = core_dead * DDprop[igen, j] * self.dt
-						elif j > (k+l):
-							# nDIV[igen, j] = core * (1. - cdfDD[j]) * np.sum(pdfDiv[j-k-l:j-k]) * self.dt
-							nDIV[igen, j] = core * (1. - cdfDD[j]) * (cdfDiv[j-k] - cdfDiv[j-k-l])
-							# nDeadDIV[igen, j] = core_dead * (1. - cdfDD[j]) * (cdfDiv[j-k] - cdfDiv[j-k-l])  # this method doesn't know if there's any live cells left to die. so perhaps wrong method.
-
-							# DDprop[igen, j] = pdfDD[j] * np.sum(pdfDiv[j-k-l:j-k]) * self.dt + DDprop[igen, j-1]
-							DDprop[igen, j] = pdfDD[j] * (cdfDiv[j-k] - cdfDiv[j-k-l]) + DDprop[igen, j-1]
-							nDD[igen, j] = core * DDprop[igen, j] * self.dt
-							# nDeadDD[igen, j] = core_dead * DDprop[igen, j] * self.dt
-
-						nDeadDIV[igen, j] = 2. * nDIV[igen, j] * pdfDie[j] * self.dt + nDeadDIV[igen, j-1]
-						nDeadDD[igen, j] = 2. * nDD[igen, j] * pdfDie[j] * self.dt + nDeadDD[igen, j-1]
-
-					if igen < self.exp_max_div:
-						cells_gen[igen, j] = nDIV[igen, j] + nDD[igen, j]
-						dead_cells_gen[igen, j] = nDeadDIV[igen, j] + nDeadDD[igen, j]
-					else:
-						cells_gen[self.exp_max_div, j] += nDIV[igen, j] + nDD[igen, j]
-						dead_cells_gen[self.exp_max_div, j] += nDeadDIV[igen, j] + nDeadDD[igen, j]
-					total_live_cells[j] += nDIV[igen, j] + nDD[igen, j]
-					total_dead_cells[j] += nDeadDIV[igen, j] + nDeadDD[igen, j]
+		# dead cells from dividing & destiny cells : running sums of live cells x death PDF
+		nDeadDIV = np.cumsum(2. * nDIV * pdfDie * self.dt, axis=1)
+		nDeadDD = np.cumsum(2. * nDD * pdfDie * self.dt, axis=1)
+		# nDeadDIV[igen, j] = core_dead * (1. - cdfDD[j]) * window[igen, j]  # this method doesn't know if there's any live cells left to die. so perhaps wrong method.
+		# nDeadDD[igen, j] = core_dead * DDprop[igen, j] * self.dt
+
+		deadGen = nDeadDIV + nDeadDD
+		deadGen[0] = nDeadUnstim + nDeadDIV[0] + nDeadDD[0]
+		dead_cells_gen = np.zeros(shape=(E+1, n), dtype=DTYPE)
+		dead_cells_gen[:E] = deadGen[:E]
+		dead_cells_gen[E] = np.sum(deadGen[E:], axis=0)
+		total_dead_cells = np.sum(deadGen, axis=0)
 
 		cdef unsigned int itpt
 		cdef list cells_gen_at_ht = [[] for _ in range(len(self.ht))]
@@ -0,0 +1,73 @@
+"""
+This module lays out the data of one condition as padded NumPy arrays for fitting.
+
+gvars.CELL_GENS_REPS & check matrices are nested lists (condition, time point, replicate, generation) with a different
+number of replicates per time point. A condition is packed once into a (time points x max. replicates x generations)
+array of cell numbers & a boolean mask of fitted entries (check matrix; padded replicates are left out). Fitted data is
+then a single 'cells[mask]' in the same order as the check matrix (time point, replicate, generation) that the Cyton
+models expect, and a bootstrap resample is one vectorised draw on the same arrays.
+"""
+
+import numpy as np
+
+
+def pack_condition(data, check, num_reps, max_div, cells=None, mask=None):
+	"""
+	input data format (3D list) : Ignoring icnd index
+		[ <- itpt
+			[ <- irep
+				[] <- igen
+			]
+		]
+	:param data: (list of lists) cell numbers per time point, replicate & generation
+	:param check: (list of lists) check matrix of the condition (same layout as data)
+	:param num_reps: (list) number of replicates per time point
+	:param max_div: (int) maximum division number of the condition
+	:param cells: (ndarray) optional output array of shape (time points, max. replicates, max_div+1) (e.g. shared memory)
+	:param mask: (ndarray) optional boolean output array of the same shape
+	:return: (tuple) padded cell numbers & mask of fitted entries
+	"""
+	shape = (len(num_reps), max(num_reps), max_div + 1)
+	if cells is None:
+		cells = np.empty(shape, dtype=float)
+	if mask is None:
+		mask = np.empty(shape, dtype=bool)
+	cells[:] = 0.
+	mask[:] = False
+	for itpt in range(shape[0]):
+		for irep in range(num_reps[itpt]):
+			cells[itpt, irep] = data[itpt][irep][:shape[2]]
+			mask[itpt, irep] = check[itpt][irep][:shape[2]]
+	return cells, mask
+
+
+def generations(mask):
+	# generation of every fitted entry
+	return np.broadcast_to(np.arange(mask.shape[2], dtype=float), mask.shape)[mask]
+
+
+def flatten(cells, mask):
+	"""
+	:param cells: (ndarray) padded cell numbers (see pack_condition)
+	:param mask: (ndarray) mask of fitted entries
+	:return: (tuple) x (generations) & y (cell numbers) of fitted entries
+	"""
+	return generations(mask), cells[mask]
+
+
+def resample(cells, mask, num_reps, rng, n=1):
+	"""
+	Resample data with replacement : every (time point, replicate, generation) entry is drawn from the replicates of its
+	time point. Flattened in the same order as the fitted data.
+
+	:param cells: (ndarray) padded cell numbers (see pack_condition)
+	:param mask: (ndarray) mask of fitted entries
+	:param num_reps: (ndarray) number of replicates per time point
+	:param rng: (numpy.random.Generator) random stream
+	:param n: (int) number of resampled data sets
+	:return: (ndarray) resampled data of shape (n, number of fitted entries)
+	"""
+	# replicate to draw from for every entry : uniform on the replicates of its time point (padding is never drawn)
+	ridx = (rng.random((n,) + cells.shape) * np.asarray(num_reps)[:, np.newaxis, np.newaxis]).astype(np.intp)
+	sample = np.take_along_axis(cells[np.newaxis], ridx, axis=2)
+	return sample[:, mask]
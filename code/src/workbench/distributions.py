@@ -0,0 +1,221 @@
+"""
+This module evaluates the probability distributions used by Cyton models on a discrete time grid.
+
+All distributions of a model are standardised onto a single 2D grid (one row per distribution) so that their CDFs are
+computed with one vectorised call of the standard normal CDF (scipy.special.ndtr) instead of looping over time points.
+	- Lognormal   : F(t) = ndtr((log(t) - log(mu)) / sig)
+	- Gaussian    : F(t) = ndtr((t - mu) / sig)
+	- Exponential : F(t) = 1 - exp(-mu * t) (mu is a rate)
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+from scipy.special import ndtr
+
+PDF_TYPES = ('Lognormal', 'Gaussian', 'Exponential')
+
+
+def log_grid(times):
+	"""
+	Log-transform a time grid once, so it can be reused for every Lognormal evaluation.
+
+	:param times: (ndarray) time grid
+	:return: (ndarray) log(times) with -inf at t = 0
+	"""
+	with np.errstate(divide='ignore'):
+		return np.log(times)
+
+
+def standardise(times, log_times, pdf_types, mus, sigs):
+	"""
+	Build standardised grid Z (one row per distribution) such that F_i(t) = ndtr(Z[i]) for Lognormal & Gaussian rows.
+	Exponential rows are left as zeros and must be handled separately.
+
+	:param times: (ndarray) time grid of length n
+	:param log_times: (ndarray) log-transformed time grid (see log_grid)
+	:param pdf_types: (list) distribution family per row
+	:param mus: (list) location parameters per row
+	:param sigs: (list) scale parameters per row
+	:return: (ndarray) standardised grid of shape (k, n)
+	"""
+	pdf_types = list(pdf_types)
+	mus = np.asarray(mus, dtype=float)
+	sigs = np.asarray(sigs, dtype=float)
+	is_log = np.array([pdf_type == 'Lognormal' for pdf_type in pdf_types])
+	is_exp = np.array([pdf_type == 'Exponential' for pdf_type in pdf_types])
+	for pdf_type in pdf_types:
+		if pdf_type not in PDF_TYPES:
+			raise ValueError("Unknown distribution '{0}'".format(pdf_type))
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		loc = np.where(is_log, np.log(mus), mus)
+		scale = np.where(is_exp, 1., sigs)
+		z = (np.where(is_log[:, None], log_times[None, :], times[None, :]) - loc[:, None]) / scale[:, None]
+	z[is_exp] = 0.
+	return z
+
+
+def cdf_grid(times, pdf_types, mus, sigs, log_times=None):
+	"""
+	Evaluate CDFs of multiple distributions on the same time grid in one vectorised call.
+
+	:param times: (ndarray) time grid of length n
+	:param pdf_types: (list) distribution family per row
+	:param mus: (list) location parameters (rate for Exponential) per row
+	:param sigs: (list) scale parameters per row (ignored for Exponential)
+	:param log_times: (ndarray) optional pre-computed log(times)
+	:return: (ndarray) CDF values of shape (k, n)
+	"""
+	times = np.asarray(times, dtype=float)
+	if log_times is None:
+		log_times = log_grid(times)
+	cdf = ndtr(standardise(times, log_times, pdf_types, mus, sigs))
+	for i, pdf_type in enumerate(pdf_types):
+		if pdf_type == 'Exponential':
+			cdf[i] = -np.expm1(-mus[i] * times)
+	return cdf
+
+
+def pdf_grid(times, pdf_types, mus, sigs, log_times=None):
+	"""
+	Evaluate probability densities of multiple distributions on the same time grid in one vectorised call.
+
+	:param times: (ndarray) time grid of length n
+	:param pdf_types: (list) distribution family per row
+	:param mus: (list) location parameters (rate for Exponential) per row
+	:param sigs: (list) scale parameters per row (ignored for Exponential)
+	:param log_times: (ndarray) optional pre-computed log(times)
+	:return: (ndarray) density values of shape (k, n)
+	"""
+	times = np.asarray(times, dtype=float)
+	if log_times is None:
+		log_times = log_grid(times)
+	is_log = np.array([pdf_type == 'Lognormal' for pdf_type in pdf_types])
+	is_exp = np.array([pdf_type == 'Exponential' for pdf_type in pdf_types])
+	pdf = _phi(standardise(times, log_times, pdf_types, mus, sigs)) / np.where(is_exp, 1., sigs)[:, None]
+	# Lognormal density has an extra 1/t factor (zero at t = 0)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		pdf[is_log] = np.where(times > 0., pdf[is_log] / times, 0.)
+	for i, pdf_type in enumerate(pdf_types):
+		if pdf_type == 'Exponential':
+			pdf[i] = mus[i] * np.exp(-mus[i] * times)
+	return pdf
+
+
+def _standardised(times, log_times, pdf_type, mu, sig):
+	# returns z, dz/dmu, dz/dsig & density scale factor (f = phi(z) * factor) of Lognormal/Gaussian distribution
+	if pdf_type == 'Lognormal':
+		z = (log_times - np.log(mu)) / sig
+		dz_dmu = -1. / (mu * sig)
+		with np.errstate(divide='ignore'):
+			factor = np.where(times > 0., 1. / (times * sig), 0.)
+	elif pdf_type == 'Gaussian':
+		z = (times - mu) / sig
+		dz_dmu = -1. / sig
+		factor = np.full_like(times, 1. / sig)
+	else:
+		raise ValueError("Unknown distribution '{0}'".format(pdf_type))
+	dz_dsig = -z / sig
+	return z, dz_dmu, dz_dsig, factor
+
+
+def _phi(z):
+	# standard normal density (zero at z = +/-inf)
+	return np.exp(-0.5 * z * z) / np.sqrt(2. * np.pi)
+
+
+def cdf_derivatives(times, pdf_type, mu, sig, log_times=None):
+	"""
+	Evaluate a CDF and its partial derivatives with respect to the distribution parameters.
+
+	:param times: (ndarray) time grid
+	:param pdf_type: (str) distribution family
+	:param mu: (float) location parameter (rate for Exponential)
+	:param sig: (float) scale parameter (ignored for Exponential)
+	:param log_times: (ndarray) optional pre-computed log(times)
+	:return: (tuple) F, dF/dmu, dF/dsig
+	"""
+	times = np.asarray(times, dtype=float)
+	if pdf_type == 'Exponential':
+		decay = np.exp(-mu * times)
+		return -np.expm1(-mu * times), times * decay, np.zeros_like(times)
+	if log_times is None:
+		log_times = log_grid(times)
+	with np.errstate(invalid='ignore'):
+		z, dz_dmu, dz_dsig, _ = _standardised(times, log_times, pdf_type, mu, sig)
+		phi = _phi(z)
+		dF_dsig = np.where(phi > 0., phi * dz_dsig, 0.)
+	return ndtr(z), phi * dz_dmu, dF_dsig
+
+
+def pdf_derivatives(times, pdf_type, mu, sig, log_times=None):
+	"""
+	Evaluate a probability density and its partial derivatives with respect to the distribution parameters.
+
+	:param times: (ndarray) time grid
+	:param pdf_type: (str) distribution family
+	:param mu: (float) location parameter (rate for Exponential)
+	:param sig: (float) scale parameter (ignored for Exponential)
+	:param log_times: (ndarray) optional pre-computed log(times)
+	:return: (tuple) f, df/dmu, df/dsig
+	"""
+	times = np.asarray(times, dtype=float)
+	if pdf_type == 'Exponential':
+		decay = np.exp(-mu * times)
+		return mu * decay, decay * (1. - mu * times), np.zeros_like(times)
+	if log_times is None:
+		log_times = log_grid(times)
+	with np.errstate(invalid='ignore'):
+		z, dz_dmu, dz_dsig, factor = _standardised(times, log_times, pdf_type, mu, sig)
+		f = _phi(z) * factor
+		df_dmu = np.where(f > 0., -f * z * dz_dmu, 0.)
+		df_dsig = np.where(f > 0., -f * z * dz_dsig - f / sig, 0.)
+	return f, df_dmu, df_dsig
+
+
+class DistributionCache:
+	"""
+	Least recently used cache of one distribution component (e.g. division time CDF) of a model.
+
+	During a fit most parameters are locked or unchanged between two objective calls (LM perturbs one parameter at a
+	time), so a component is only re-evaluated when its own (pdf_type, mu, sigma) or the time grid (dt, tf) changes.
+	"""
+	def __init__(self, func, size=8):
+		"""
+		:param func: (callable) func(times, mu, sig, pdf_type=...) -> ndarray
+		:param size: (int) maximum number of cached arrays
+		"""
+		self.func = func
+		self.size = size
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def __call__(self, times, mu, sig, pdf_type, dt, tf):
+		"""
+		:param times: (ndarray) time grid defined by dt & tf
+		:param mu: (float) location parameter
+		:param sig: (float) scale parameter
+		:param pdf_type: (str) distribution family
+		:param dt: (float) time increment of the grid
+		:param tf: (float) final time of the grid
+		:return: (ndarray) read-only distribution values on 'times'
+		"""
+		key = (pdf_type, float(mu), float(sig), float(dt), float(tf))
+		values = self.entries.get(key)
+		if values is not None:
+			self.hits += 1
+			self.entries.move_to_end(key)
+			return values
+
+		self.misses += 1
+		values = np.asarray(self.func(times, mu, sig, pdf_type=pdf_type), dtype=np.float64)
+		values.flags.writeable = False  # shared by later calls
+		self.entries[key] = values
+		if len(self.entries) > self.size:
+			self.entries.popitem(last=False)
+		return values
+
+	def clear(self):
+		self.entries = OrderedDict()
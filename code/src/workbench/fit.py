@@ -6,12 +6,28 @@ A spawned thread will call one of these functions to initialise the fitting proc
 """
 
 import time
+import inspect
+from copy import deepcopy
 import numpy as np
-from lmfit import Model
+from scipy.optimize import differential_evolution, least_squares
+from lmfit import Model, Minimizer, Parameters, fit_report
+from lmfit.minimizer import MinimizerResult
 
+import src.common.settings as config
 import src.common.global_vars as gvars
 from src.workbench.cyton1 import Cyton1Model
 from src.workbench.cyton15 import Cyton15Model
+from src.workbench.objective import Residual
+from src.workbench.data_layout import pack_condition, flatten
+from src.workbench.multistart import multistart_fit
+from src.workbench.history import FitHistory, model_label, dataset_key, data_features, warm_start
+from src.workbench.fit_cache import FIT_RESULTS, result_key
+
+# Cyton 1.5 fits (single condition, batch & joint) : finite difference scheme (more accurate than '2-point' for a model
+# on a discrete time grid)
+C15_JAC = '3-point'
+# seed of stochastic algorithms (Cyton 1.5 DE, multi-start points) so that repeated fits give the same result
+FIT_SEED = 57893928
 
 
 def print_elapsed_time(start, end):
@@ -22,18 +38,247 @@ def print_elapsed_time(start, end):
 
 def callback_print_function(pars, iter, resid, *args, **kws):
 	# resid : user-defined model - data (lmfit.Model object)
-	total_residual = 0.
-	for res in resid:
-		total_residual += res**2
-
 	if iter % 100 == 0:
 		print(
 			"ITER   " + str(iter) + "   ",
 			['%3.6f' % p.value for p in pars.values()],
-			"%.5e" % total_residual
+			"%.5e" % np.dot(resid, resid)
 		)
 
 
+def fit_least_squares(func, pars, x, y, algo_settings, jacobian=None, jac='2-point'):
+	"""
+	Run least squares (trust region reflective) on the residual objective (see objective.py) via lmfit.Minimizer.
+
+	:param func: (function) model function; func(x, *params) -> predictions
+	:param pars: (lmfit.Parameters) parameters in the order of 'func' arguments
+	:param x: (ndarray) independent variable passed to the model
+	:param y: (ndarray) data
+	:param algo_settings: (list) LM settings from fit dialog ['LM', max_nfev, ftol, xtol, gtol, ...]
+	:param jacobian: (function) optional Jacobian of 'func'; jacobian(x, *params) -> (len(y), len(pars)) array
+	:param jac: (str) finite difference scheme if no Jacobian is given ('2-point' or '3-point')
+	:return: (lmfit.MinimizerResult) fit result
+	"""
+	names = list(pars.keys())
+	objective = Residual(func, names, x, y)
+
+	def dfun(p, **kws):
+		# depending on lmfit version, 'p' is either Parameters or an array of varying parameter values
+		values = np.array([pars[name].value for name in names])
+		vary = np.array([pars[name].vary for name in names])
+		if isinstance(p, Parameters):
+			values = np.array([p[name].value for name in names])
+		else:
+			values[vary] = p
+		return jacobian(x, *values)[:, vary]
+
+	minimizer = Minimizer(objective, pars, iter_cb=callback_print_function)
+	return minimizer.least_squares(
+		max_nfev=algo_settings[1],
+		ftol=algo_settings[2],
+		xtol=algo_settings[3],
+		gtol=algo_settings[4],
+		jac=dfun if jacobian is not None else jac
+	)
+
+
+def fit_de_batch(model, pars, y, algo_settings, seed=None, jacobian=None):
+	"""
+	Run differential evolution with the whole population evaluated in one call of 'model.evaluate_batch'.
+	SciPy (>= 1.9) hands the population to the objective as one array (vectorized=True). Older versions get the same
+	behaviour through a map-like 'workers' callable.
+
+	:param model: (object) Cyton model with 'evaluate_batch' method (parameters in the order of 'pars')
+	:param pars: (lmfit.Parameters) parameters with finite bounds for varying ones
+	:param y: (ndarray) data
+	:param algo_settings: (list) DE settings from fit dialog ['DE', max_generation, popsize, tol, atol]
+	:param seed: (int) random seed for the initial population
+	:param jacobian: (function) optional Jacobian of the model (see fit_least_squares) for covariance at the solution
+	:return: (lmfit.MinimizerResult) fit result
+	"""
+	names = list(pars.keys())
+	vary = np.array([pars[name].vary for name in names])
+	values = np.array([pars[name].value for name in names])
+	bounds = [(pars[name].min, pars[name].max) for name in names if pars[name].vary]
+
+	def param_matrix(x):
+		# x : (number of varying parameters, population size)
+		matrix = np.tile(values, (x.shape[1], 1))
+		matrix[:, vary] = x.T
+		return matrix
+
+	def rss(x):
+		x = np.asarray(x, dtype=float)
+		if x.ndim == 1:  # single solution (e.g. polishing step)
+			return rss(x[:, None])[0]
+		residual = model.evaluate_batch(param_matrix(x)) - y
+		return np.sum(residual**2, axis=1)
+
+	def callback(xk, convergence):
+		callback.generation += 1
+		if callback.generation % 10 == 0:
+			print("GEN    " + str(callback.generation) + "   ", ['%3.6f' % p for p in xk], "%.5e" % rss(xk))
+	callback.generation = 0
+
+	de_kws = dict(
+		maxiter=algo_settings[1],
+		popsize=algo_settings[2],
+		tol=algo_settings[3],
+		atol=algo_settings[4],
+		seed=seed,
+		callback=callback,
+		polish=True,
+		init='latinhypercube',
+		updating='deferred',
+		disp=False
+	)
+	if 'vectorized' in inspect.signature(differential_evolution).parameters:
+		de_kws['vectorized'] = True
+	else:
+		de_kws['workers'] = lambda func, population: rss(np.array(list(population)).T)
+	de = differential_evolution(rss, bounds, **de_kws)
+
+	residual = model.evaluate_batch(param_matrix(de.x[:, None]))[0] - y
+	jac = None
+	if jacobian is not None:
+		jac = jacobian(None, *param_matrix(de.x[:, None])[0])[:, vary]
+	return package_result(
+		'differential_evolution', pars, de.x, residual, de.nfev, de.success, de.message, jac=jac
+	)
+
+
+def package_result(method, pars, solution, residual, nfev, success, message, jac=None):
+	"""
+	Package a SciPy solution as lmfit.MinimizerResult for reporting : fitted values, RSS & covariance.
+	Covariance is inv(J^T J) scaled by reduced chi-square (as lmfit does), so standard errors & correlations are only
+	reported if the Jacobian at the solution is given and J^T J is invertible.
+
+	:param method: (str) name of the method
+	:param pars: (lmfit.Parameters) initial parameters
+	:param solution: (ndarray) fitted values of varying parameters (in the order of 'pars')
+	:param residual: (ndarray) residual at the solution
+	:param nfev: (int) number of function evaluations
+	:param success: (bool) convergence flag
+	:param message: (str) termination message
+	:param jac: (ndarray) optional Jacobian of residual with respect to varying parameters at the solution
+	:return: (lmfit.MinimizerResult) fit result
+	"""
+	var_names = [name for name in pars if pars[name].vary]
+
+	result = MinimizerResult()
+	result.method = method
+	result.params = deepcopy(pars)
+	for name, value in zip(var_names, solution):
+		result.params[name].init_value = pars[name].value
+		result.params[name].value = value
+	result.var_names = var_names
+	result.init_vals = [pars[name].value for name in var_names]
+	result.nfev = nfev
+	result.success = success
+	result.message = message
+	result.errorbars = False
+	result.covar = None
+	result.residual = residual
+	result._calculate_statistics()
+
+	if jac is not None and len(var_names) > 0:
+		try:
+			result.covar = np.linalg.inv(np.dot(jac.T, jac)) * result.redchi
+		except np.linalg.LinAlgError:
+			return result
+		stderr = np.sqrt(np.abs(np.diag(result.covar)))
+		result.errorbars = bool(np.all(np.isfinite(stderr)))
+		for i, name in enumerate(var_names):
+			result.params[name].stderr = stderr[i]
+			result.params[name].correl = {
+				other: result.covar[i, j] / (stderr[i] * stderr[j])
+				for j, other in enumerate(var_names) if j != i and stderr[i] * stderr[j] > 0
+			}
+	return result
+
+
+def fit_direct(model, func, jacobian, pars, x, y, algo_settings, jac='2-point', seed=None):
+	"""
+	Lean fit engine : SciPy optimisers run on ndarray parameter vectors without lmfit wrappers in the objective.
+	Bounds are the (min, max) of 'pars', i.e. 0.001 (0 for pF) & the user defined upper bounds.
+		- LM : scipy.optimize.least_squares (trust region reflective), analytic Jacobian if enabled in fit settings
+		- DE : scipy.optimize.differential_evolution on whole populations (see fit_de_batch)
+
+	:param model: (object) Cyton model with 'evaluate_batch' method
+	:param func: (function) model function; func(x, *params) -> predictions
+	:param jacobian: (function) Jacobian of 'func'; jacobian(x, *params) -> (len(y), len(pars)) array
+	:param pars: (lmfit.Parameters) parameters in the order of 'func' arguments (initial values & bounds)
+	:param x: (ndarray) independent variable passed to the model
+	:param y: (ndarray) data
+	:param algo_settings: (list) settings from fit dialog
+	:param jac: (str) finite difference scheme if the analytic Jacobian is disabled
+	:param seed: (int) random seed of DE
+	:return: (lmfit.MinimizerResult) fit result
+	"""
+	if algo_settings[0] == 'DE':
+		return fit_de_batch(model, pars, y, algo_settings, seed=seed, jacobian=jacobian)
+
+	names = list(pars.keys())
+	vary = np.array([pars[name].vary for name in names])
+	values = np.array([pars[name].value for name in names], dtype=float)
+	lower = np.array([pars[name].min for name in names], dtype=float)[vary]
+	upper = np.array([pars[name].max for name in names], dtype=float)[vary]
+	objective = Residual(func, names, x, y)
+
+	def full(p):
+		full_values = values.copy()
+		full_values[vary] = p
+		return full_values
+
+	def residual(p):
+		res = objective.evaluate(full(p))
+		if objective.nfev % 100 == 0:
+			print("ITER   " + str(objective.nfev) + "   ", ['%3.6f' % v for v in full(p)], "%.5e" % objective.rss)
+		return res.copy()
+
+	def dfun(p):
+		return jacobian(x, *full(p))[:, vary]
+
+	use_jacobian = len(algo_settings) > 5 and algo_settings[5]
+	sol = least_squares(
+		residual, np.clip(values[vary], lower, upper), jac=dfun if use_jacobian else jac, bounds=(lower, upper),
+		method='trf', max_nfev=algo_settings[1], ftol=algo_settings[2], xtol=algo_settings[3], gtol=algo_settings[4]
+	)
+	return package_result('least_squares', pars, sol.x, sol.fun, sol.nfev, sol.success, sol.message, jac=sol.jac)
+
+
+def fit_multistart(model, func, jacobian, pars, x, y, algo_settings, control, jac='2-point', seed=FIT_SEED):
+	"""
+	Multi-start least squares on a process pool (see multistart.py). Number of starting points is algo_settings[6].
+
+	:param model: (object) Cyton model (pickled to worker processes)
+	:param func: (function) model function; func(x, *params) -> predictions
+	:param jacobian: (function) Jacobian of 'func'; jacobian(x, *params) -> (len(y), len(pars)) array
+	:param pars: (lmfit.Parameters) parameters in the order of 'func' arguments (current values & bounds)
+	:param x: (ndarray) independent variable passed to the model
+	:param y: (ndarray) data
+	:param algo_settings: (list) LM settings from fit dialog
+	:param control: (FitControl) run-time control of the fit (abort token shared with workers)
+	:param jac: (str) finite difference scheme if the analytic Jacobian is disabled
+	:param seed: (int) random seed of the Latin hypercube starting points
+	:return: (lmfit.MinimizerResult) best fit
+	"""
+	names = list(pars.keys())
+	vary = np.array([pars[name].vary for name in names])
+	values = np.array([pars[name].value for name in names], dtype=float)
+
+	solution, rss, nfev = multistart_fit(
+		model, func.__name__, jacobian.__name__, pars, x, y, algo_settings, algo_settings[6], jac=jac, control=control,
+		seed=seed
+	)
+	values[vary] = solution
+	residual = func(x, *values) - y
+	return package_result(
+		'least_squares (multi-start)', pars, solution, residual, nfev, True,
+		'Best of {0} runs'.format(algo_settings[6] + 1), jac=jacobian(x, *values)[:, vary]
+	)
+
+
 def fit_to_cyton1(thread, algo_settings):
 	start = time.time()
 
@@ -48,19 +293,13 @@ def fit_to_cyton1(thread, algo_settings):
 
 	# prepare (x, y) data
 	num_reps = [len(l) for l in gvars.CELL_GENS_REPS[icnd]]
-	flatten_gens, flatten_cells = [], []
-	for itpt in range(len(gvars.EXP_HT[icnd])):
-		for irep in range(num_reps[itpt]):
-			for igen in range(gvars.MAX_DIV_PER_CONDITIONS[icnd]+1):
-				if gvars.C1_CHECK[icnd][itpt][irep][igen]:
-					flatten_gens.append(igen)
-					flatten_cells.append(gvars.CELL_GENS_REPS[icnd][itpt][irep][igen])
-
-	x = np.array(flatten_gens, dtype=float)
-	y = np.array(flatten_cells, dtype=float)
+	x, y = flatten(*pack_condition(
+		gvars.CELL_GENS_REPS[icnd], gvars.C1_CHECK[icnd], num_reps, gvars.MAX_DIV_PER_CONDITIONS[icnd]
+	))
 
+	control = thread.control  # abort token & progress
 	model = Cyton1Model(
-		gvars.EXP_HT[icnd], gvars.INIT_CELL, gvars.MAX_DIV, gvars.TIME_INC, num_reps, gvars.C1_CHECK[icnd], thread
+		gvars.EXP_HT[icnd], gvars.INIT_CELL, gvars.MAX_DIV, gvars.TIME_INC, num_reps, gvars.C1_CHECK[icnd], control
 	)
 
 	try:
@@ -78,7 +317,15 @@ def fit_to_cyton1(thread, algo_settings):
 			name='Cyton 1 Model'
 		)
 
-		params = gvars.C1_PARAMS
+		# previous fits of the same (or the most similar) data : see history.py
+		history = FitHistory()
+		label = model_label('cyton1', config.CYTON1_CONFIG)
+		key = dataset_key(
+			label, gvars.EXP_HT[icnd], num_reps, gvars.C1_CHECK[icnd], x, y, gvars.TIME_INC, gvars.INIT_CELL, gvars.MAX_DIV,
+			model.kernel
+		)
+		features = data_features(gvars.EXP_HT[icnd], gvars.CELL_GENS_REPS[icnd])
+		params = warm_start(history, label, key, features, gvars.C1_PARAMS, gvars.C1_VARY_PARAMS, config.WARM_START)
 		upper_bounds = gvars.C1_UPPER_BOUNDS
 		vary = gvars.C1_VARY_PARAMS
 		# 13 parameters to fit :
@@ -103,44 +350,32 @@ def fit_to_cyton1(thread, algo_settings):
 		pars = gmodel.make_params()
 
 		algorithm = algo_settings[0]
-		if algorithm == 'LM':
+		# same data, starting point, locks, bounds & settings as an earlier fit of this session : see fit_cache.py
+		start_key = result_key(key, pars, algo_settings, config.FIT_ENGINE)  # before the fit : engines may update 'pars'
+		cached = None if thread.force_refit else FIT_RESULTS.get(start_key)
+		if cached is not None:
+			print(" > Identical fit in this session : stored result (tick 'Force refit' to run it again)")
+			result = cached
+		elif algorithm == 'LM' and len(algo_settings) > 6 and algo_settings[6] > 0:
+			# concurrent fits from Latin hypercube starting points : keep the best one
+			result = fit_multistart(model, model.cyton1_model, model.cyton1_jacobian, pars, x, y, algo_settings, control)
+		elif config.FIT_ENGINE == 'scipy':
+			# parameter vectors straight into SciPy : no lmfit wrappers per model evaluation
+			result = fit_direct(model, model.cyton1_model, model.cyton1_jacobian, pars, x, y, algo_settings)
+		elif algorithm == 'LM' and len(algo_settings) > 5 and algo_settings[5]:
+			# forward sensitivity : prediction & Jacobian in one pass instead of 14-27 model evaluations
+			result = fit_least_squares(model.cyton1_model, pars, x, y, algo_settings, jacobian=model.cyton1_jacobian)
+		elif algorithm == 'LM':
 			# least_squares : the most stable algorithm, it also contains all the features I need
 			#  -> Run trust region method for bounded parameters : somehow this one doesn't work for CI
 			# result = gmodel.fit(xy, params=params, flatten_generation_list=x,
 			#                     method='least_squares',
 			#                     fit_kws={'max_nfev': algo_settings[1], 'verbose': 1})
-			result = gmodel.fit(
-				y,
-				params=pars,
-				flatten_generation_list=x,
-				iter_cb=callback_print_function,
-				method='least_squares',
-				fit_kws={
-					# 'maxfev': algo_settings[1],
-					'max_nfev': algo_settings[1],
-					'ftol': algo_settings[2],
-					'xtol': algo_settings[3],
-					'gtol': algo_settings[4],
-					# 'jac': '3-point',  # more accurate numerical differentiation scheme
-					# 'loss': 'soft_l1'
-					# 'full_output': True
-				}
-			)
+			#  -> residuals are computed in place by the objective (see objective.py) instead of lmfit.Model
+			result = fit_least_squares(model.cyton1_model, pars, x, y, algo_settings)
 		elif algorithm == 'DE':
-			result = gmodel.fit(
-				y,
-				params=pars,
-				flatten_generation_list=x,
-				iter_cb=callback_print_function,
-				method='differential_evolution',
-				fit_kws={
-					'max_nfev': algo_settings[1],
-					'popsize': algo_settings[2],
-					'tol': algo_settings[3],
-					'atol': algo_settings[4],
-					'disp': False
-				}
-			)
+			# whole population per call : see Cyton1Model.evaluate_batch
+			result = fit_de_batch(model, pars, y, algo_settings)
 
 		# leastsq : LM legacy wrapper
 		# differential_evolution : division by 0 error. cool stochastic GLOBAL minimizer method
@@ -156,10 +391,15 @@ def fit_to_cyton1(thread, algo_settings):
 		# dogleg : needs user-defined Jacobian
 		# slsqp : needs user-defined Jacobian
 
-		print(result.fit_report())
+		print(result.fit_report() if hasattr(result, 'fit_report') else fit_report(result))
+		print(" > Number of model evaluations: {0}".format(control.iter))
 
 		gvars.C1_PREV_SS = gvars.C1_SS
 		gvars.C1_SS = result.chisqr
+		if cached is None:
+			FIT_RESULTS.store(start_key, key, pars, algo_settings, config.FIT_ENGINE, result)
+		if config.WARM_START != 'off' and result.success:
+			history.record(label, key, features, list(result.params.valuesdict().values()), result.chisqr, gvars.CONDITIONS[icnd])
 
 		print(" > Cyton 1 Sum of squares:")
 		print(" > > prev: {0:.5f}".format(gvars.C1_PREV_SS))
@@ -171,7 +411,7 @@ def fit_to_cyton1(thread, algo_settings):
 		print_elapsed_time(start, end)
 
 		fitted = []
-		for key, value in result.best_values.items():
+		for key, value in result.params.valuesdict().items():
 			fitted.append(value)
 
 		print(' > Updating parameters & plots...')
@@ -185,7 +425,7 @@ def fit_to_cyton1(thread, algo_settings):
 		print(' > Updating parameters & plots...')
 
 		# this will return last iteration of failed fit parameters
-		return model.last_param[-1]
+		return control.last_param[-1]
 
 
 def fit_to_cyton15(thread, algo_settings, fit_to_total_cells):
@@ -203,25 +443,18 @@ def fit_to_cyton15(thread, algo_settings, fit_to_total_cells):
 	# x : generations, y : number of cells per generation per time point
 	num_reps = [len(l) for l in gvars.CELL_GENS_REPS[icnd]]
 	if not fit_to_total_cells:
-		flatten_gens, flatten_cells = [], []
-		for itpt in range(len(gvars.EXP_HT[icnd])):
-			for irep in range(num_reps[itpt]):
-				for igen in range(gvars.MAX_DIV_PER_CONDITIONS[icnd]+1):
-					# check for any excluded data
-					if gvars.C15_CHECK[icnd][itpt][irep][igen]:
-						flatten_gens.append(igen)
-						flatten_cells.append(gvars.CELL_GENS_REPS[icnd][itpt][irep][igen])
-
-		# convert flatten_gens(x) & flatten_cells(y) to numpy array
-		x = np.array(flatten_gens, dtype=float)
-		y = np.array(flatten_cells, dtype=float)
+		# padded (time point, replicate, generation) arrays : excluded data is masked out (see data_layout.py)
+		x, y = flatten(*pack_condition(
+			gvars.CELL_GENS_REPS[icnd], gvars.C15_CHECK[icnd], num_reps, gvars.MAX_DIV_PER_CONDITIONS[icnd]
+		))
 	else:
 		x = np.array(gvars.EXP_HT_REPS[icnd])
 		y = np.array(gvars.TOTAL_CELLS_REPS[icnd])
 
 	# create Cyton model object -> preparing condition specific variables for fittings
+	control = thread.control  # abort token & progress
 	model = Cyton15Model(
-		gvars.EXP_HT[icnd], gvars.INIT_CELL, gvars.MAX_DIV, gvars.TIME_INC, num_reps, gvars.C15_CHECK[icnd], fit_to_total_cells, thread
+		gvars.EXP_HT[icnd], gvars.INIT_CELL, gvars.MAX_DIV, gvars.TIME_INC, num_reps, gvars.C15_CHECK[icnd], fit_to_total_cells, control
 	)
 
 	# try/except blcok for catching any errors & abort fit
@@ -247,7 +480,15 @@ def fit_to_cyton15(thread, algo_settings, fit_to_total_cells):
 		#     - muDiv, sigDiv, muDeath, sigDeath, muDD, sigDD
 		#  - Misc:
 		#     - SubDivTime(b), pFrac
-		params = gvars.C15_PARAMS
+		# previous fits of the same (or the most similar) data : see history.py
+		history = FitHistory()
+		label = model_label('cyton1.5', config.CYTON15_CONFIG, 'total cells' if fit_to_total_cells else '')
+		key = dataset_key(
+			label, gvars.EXP_HT[icnd], num_reps, gvars.C15_CHECK[icnd], x, y, gvars.TIME_INC, gvars.INIT_CELL, gvars.MAX_DIV,
+			'harvest_only={0} gen_tol={1!r}'.format(model.harvest_only, model.gen_tol)
+		)
+		features = data_features(gvars.EXP_HT[icnd], gvars.CELL_GENS_REPS[icnd])
+		params = warm_start(history, label, key, features, gvars.C15_PARAMS, gvars.C15_VARY_PARAMS, config.WARM_START)
 		upper_bounds = gvars.C15_UPPER_BOUNDS
 		vary = gvars.C15_VARY_PARAMS
 		gmodel.set_param_hint('unstimMu', value=params['unstimMuDeath'], min=0.001, max=upper_bounds['unstimMuDeathUpperBound'], vary=vary['unstimMuDeathLock'])
@@ -266,7 +507,22 @@ def fit_to_cyton15(thread, algo_settings, fit_to_total_cells):
 		pars = gmodel.make_params()
 
 		algorithm = algo_settings[0]
-		if algorithm == 'LM':
+		# same data, starting point, locks, bounds & settings as an earlier fit of this session : see fit_cache.py
+		start_key = result_key(key, pars, algo_settings, config.FIT_ENGINE)  # before the fit : engines may update 'pars'
+		cached = None if thread.force_refit else FIT_RESULTS.get(start_key)
+		if cached is not None:
+			print(" > Identical fit in this session : stored result (tick 'Force refit' to run it again)")
+			result = cached
+		elif algorithm == 'LM' and len(algo_settings) > 6 and algo_settings[6] > 0:
+			# concurrent fits from Latin hypercube starting points : keep the best one
+			result = fit_multistart(model, model.cyton15, model.cyton15_jacobian, pars, x, y, algo_settings, control, jac=C15_JAC)
+		elif config.FIT_ENGINE == 'scipy':
+			# parameter vectors straight into SciPy : no lmfit wrappers per model evaluation
+			result = fit_direct(model, model.cyton15, model.cyton15_jacobian, pars, x, y, algo_settings, jac=C15_JAC, seed=FIT_SEED)
+		elif algorithm == 'LM' and len(algo_settings) > 5 and algo_settings[5]:
+			# closed form Jacobian : one model evaluation per iteration instead of 2*(number of parameters)+1
+			result = fit_least_squares(model.cyton15, pars, x, y, algo_settings, jacobian=model.cyton15_jacobian)
+		elif algorithm == 'LM':
 			# least_squares : the most stable algorithm, it also contains all the features I need
 			#  -> Run trust region method for bounded parameters : somehow this one doesn't work for CI
 
@@ -283,45 +539,25 @@ def fit_to_cyton15(thread, algo_settings, fit_to_total_cells):
 			# Specifically mentioned that it uses Levenberg-Marquardt algorithm in LMFIT doc.
 			# it's an old wrapper (for backward compatibility) for scipy LM algorithm 'leastsq'
 			# This supposedly unable to handle bounds itself, but LMFIT upgrade it with their own method to deal with bounds
-			result = gmodel.fit(
-				y,
-				params=pars,
-				flatten_generation_list=x,
-				iter_cb=callback_print_function,
-				method='least_squares',
-				max_nfev=algo_settings[1],
-				fit_kws={
-					# 'maxfev': algo_settings[1],
-					'ftol': algo_settings[2],
-					'xtol': algo_settings[3],
-					'gtol': algo_settings[4],
-					'jac': '3-point',  # more accurate numerical differentiation scheme
-					# 'loss': 'soft_l1'
-					# 'full_output': True
-				}
-			)
+			#  -> residuals are computed in place by the objective (see objective.py) instead of lmfit.Model
+			result = fit_least_squares(model.cyton15, pars, x, y, algo_settings, jac=C15_JAC)  # more accurate numerical differentiation scheme
 		elif algorithm == 'DE':
 			# More robust methods for exploration but it has high computational cost
-			result = gmodel.fit(
-				y,
-				params=pars,
-				flatten_generation_list=x,
-				method='differential_evolution',
-				iter_cb=callback_print_function,
-				max_nfev=algo_settings[1],
-				fit_kws={
-					'popsize': algo_settings[2],
-					'tol': algo_settings[3],
-					'atol': algo_settings[4],
-					'seed': 57893928,
-					'disp': False
-				}
-			)
-
-		print(result.fit_report())
+			#  -> whole population per call : see Cyton15Model.evaluate_batch
+			result = fit_de_batch(model, pars, y, algo_settings, seed=FIT_SEED)
+
+		print(result.fit_report() if hasattr(result, 'fit_report') else fit_report(result))
+		print(" > Number of model evaluations: {0}".format(control.iter))
+		print(" > Distribution cache (hits/misses): {0}".format(
+			', '.join('{0} {1}/{2}'.format(name, *stats) for name, stats in model.cache_stats().items())))
+		print(" > Generations evaluated (last call): {0} of {1}".format(model.evaluated_gens, model.max_div+1))
 
 		gvars.C15_PREV_SS = gvars.C15_SS
 		gvars.C15_SS = result.chisqr
+		if cached is None:
+			FIT_RESULTS.store(start_key, key, pars, algo_settings, config.FIT_ENGINE, result)
+		if config.WARM_START != 'off' and result.success:
+			history.record(label, key, features, list(result.params.valuesdict().values()), result.chisqr, gvars.CONDITIONS[icnd])
 
 		print(" > Cyton 1.5 Sum of squares:")
 		print(" > > prev: {0:.5f}".format(gvars.C15_PREV_SS))
@@ -332,7 +568,7 @@ def fit_to_cyton15(thread, algo_settings, fit_to_total_cells):
 		print_elapsed_time(start, end)
 
 		fitted = []
-		for key, value in result.best_values.items():
+		for key, value in result.params.valuesdict().items():
 			fitted.append(value)
 
 		print(' > Updating parameters & plots...')
@@ -345,8 +581,8 @@ def fit_to_cyton15(thread, algo_settings, fit_to_total_cells):
 		print(' > Updating parameters & plots...')
 
 		# this will return last iteration of failed fit parameters
-		if len(model.last_param) > 0:
-			return model.last_param[-1]
+		if len(control.last_param) > 0:
+			return control.last_param[-1]
 		else:
 			return '--unknown--'
 
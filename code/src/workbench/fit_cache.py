@@ -0,0 +1,79 @@
+"""
+This module keeps the results of finished fits for the session, so that clicking Fit again with nothing changed returns
+straight away instead of repeating a full LM or DE run.
+
+A result is stored under a key : the dataset key (data, check matrix, harvest times, model, pdf settings, time step,
+initial cell number, maximum division number & evaluation mode of the model; see history.dataset_key) & the fit set up
+(starting values, vary flags & bounds of every parameter, algorithm settings & fit engine). The GUI replaces the
+parameters with the fitted values after a fit, so a converged result is also stored as the result of a fit that starts
+from its own solution : that fit would stop where it starts. "Force refit" in the fit dialog bypasses the cache.
+"""
+
+from collections import OrderedDict
+import numpy as np
+
+from src.workbench.boot_store import fingerprint
+
+
+def result_key(data_key, pars, algo_settings, engine):
+	"""
+	:param data_key: (str) dataset key (see history.dataset_key)
+	:param pars: (lmfit.Parameters) starting values, vary flags & bounds
+	:param algo_settings: (list) settings from fit dialog
+	:param engine: (str) fit engine (config.FIT_ENGINE)
+	:return: (str) key of the fit
+	"""
+	return key_from_values(data_key, pars, [par.value for par in pars.values()], algo_settings, engine)
+
+
+def key_from_values(data_key, pars, values, algo_settings, engine):
+	# same as result_key with other starting values (e.g. fitted values)
+	setup = np.array([
+		[value, par.vary, par.min, par.max] for par, value in zip(pars.values(), values)
+	], dtype=float)
+	text = '|'.join([data_key, engine, repr(list(algo_settings)), ','.join(pars.keys())])
+	return fingerprint(setup, np.frombuffer(text.encode(), dtype=np.uint8))
+
+
+class FitCache:
+	def __init__(self, maxsize=32):
+		"""
+		:param maxsize: (int) number of results kept (least recently used are dropped first)
+		"""
+		self.maxsize = maxsize
+		self.results = OrderedDict()
+
+	def get(self, key):
+		result = self.results.get(key)
+		if result is not None:
+			self.results.move_to_end(key)
+		return result
+
+	def put(self, key, result):
+		self.results[key] = result
+		self.results.move_to_end(key)
+		while len(self.results) > self.maxsize:
+			self.results.popitem(last=False)
+
+	def store(self, start_key, data_key, pars, algo_settings, engine, result):
+		"""
+		Keep a finished fit under its starting point &, if converged, under its solution.
+
+		:param start_key: (str) key of the fit computed before it ran (see result_key)
+		:param data_key: (str) dataset key
+		:param pars: (lmfit.Parameters) parameters of the fit (vary flags & bounds)
+		:param algo_settings: (list) settings from fit dialog
+		:param engine: (str) fit engine
+		:param result: (lmfit.minimizer.MinimizerResult or lmfit.model.ModelResult) result of the fit
+		"""
+		self.put(start_key, result)
+		if result.success:
+			fitted = list(result.params.valuesdict().values())
+			self.put(key_from_values(data_key, pars, fitted, algo_settings, engine), result)
+
+	def clear(self):
+		self.results.clear()
+
+
+# results of this session
+FIT_RESULTS = FitCache()
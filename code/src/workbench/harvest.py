@@ -0,0 +1,57 @@
+"""
+This module maps experimental harvest times onto the discrete time grid of a Cyton model.
+
+The mapping is built once at model construction, so every objective evaluation extracts its prediction vector with a
+single fancy-index gather instead of searching the time grid (and the check matrix) on every call.
+"""
+
+import numpy as np
+
+
+def harvest_indices(times, ht, dt):
+	"""
+	Find the index of each harvest time on the model time grid.
+
+	:param times: (ndarray) model time grid (uniformly spaced by 'dt', starting at t0)
+	:param ht: (list) harvested time points
+	:param dt: (float) time increment of the grid
+	:return: (ndarray) integer index per harvest time
+	"""
+	times = np.asarray(times, dtype=float)
+	if len(ht) == 0:
+		return np.zeros(0, dtype=np.intp)
+	idx = np.rint((np.asarray(ht, dtype=float) - times[0]) / dt).astype(np.intp)
+	if np.any(idx < 0) or np.any(idx >= times.size) or not np.allclose(times[idx], ht, rtol=0., atol=1E-6 * dt):
+		raise ValueError("Harvest times {0} are not on the model time grid (dt={1})".format(ht, dt))
+	return idx
+
+
+def gather_plan(ht_idx, num_reps, check, num_gens, num_times):
+	"""
+	Build flattened gather indices for a (generation x time) array of model predictions.
+	Entry order follows the data layout used for fitting : [itpt][irep][igen], skipping excluded data.
+
+	:param ht_idx: (ndarray) index of each harvest time on the model time grid
+	:param num_reps: (list) number of replicates per harvest time
+	:param check: (nested list) check matrix [itpt][irep][igen] for data inclusion/exclusion
+	:param num_gens: (int) number of generations (rows) in the prediction array
+	:param num_times: (int) number of time points (columns) in the prediction array
+	:return: (tuple) flattened indices of included data & boolean inclusion mask over all (itpt, irep, igen)
+	"""
+	rows, cols = [], []
+	for itpt in range(len(num_reps)):
+		for irep in range(num_reps[itpt]):
+			rows.append(np.arange(num_gens))
+			cols.append(np.full(num_gens, ht_idx[itpt]))
+	if len(rows) == 0:
+		return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=bool)
+	rows = np.concatenate(rows)
+	cols = np.concatenate(cols)
+
+	mask = np.array([
+		bool(check[itpt][irep][igen])
+		for itpt in range(len(num_reps)) for irep in range(num_reps[itpt]) for igen in range(num_gens)
+	], dtype=bool)
+
+	flat_idx = (rows * num_times + cols)[mask].astype(np.intp)
+	return flat_idx, mask
@@ -0,0 +1,180 @@
+"""
+This module keeps a local library of previous fits to warm start new ones.
+
+Every finished fit is recorded under a key : a hash of the fitted data (cell numbers, check matrix & harvest times),
+pdf settings, time step, initial cell number, maximum division number & evaluation mode of the model. Only the best fit (lowest RSS) per key is kept. Refitting the same condition,
+e.g. after re-importing a file, can start from that solution. A condition without a previous fit can start from the
+fit of the most similar condition on record : conditions are compared by total cell numbers & mean division numbers
+interpolated onto a common time grid (nearest neighbour in that feature space).
+"""
+
+import os
+import json
+from datetime import datetime
+import numpy as np
+
+from src.workbench.boot_store import fingerprint
+
+# harvest times (hours) on which conditions are compared
+FEATURE_TIMES = np.linspace(0., 200., 21)
+
+
+def model_label(model_id, pdf_config, mode=''):
+	# fits are only comparable for the same model, pdf settings & fit mode
+	return ' '.join([model_id] + list(pdf_config.values()) + ([mode] if mode else []))
+
+
+def dataset_key(label, ht, num_reps, check, x, y, dt, n0, max_div, mode=''):
+	"""
+	:param label: (str) model, pdf settings & fit mode (see model_label)
+	:param ht: (list) harvest times
+	:param num_reps: (list) number of replicates per time point
+	:param check: (list) check matrix of the condition
+	:param x: (ndarray) independent variable of the fit
+	:param y: (ndarray) fitted data
+	:param dt: (float) time step of the model
+	:param n0: (float) initial cell number
+	:param max_div: (int) maximum division number of the model
+	:param mode: (str) evaluation mode of the model (e.g. Cyton 1 kernel)
+	:return: (str) hash of the fitted data & model settings
+	"""
+	flat_check = np.array([flag for tpt in check for rep in tpt for flag in rep], dtype=np.int8)
+	return fingerprint(
+		np.array(ht, dtype=float), np.array(num_reps, dtype=np.int64), flat_check,
+		np.asarray(x, dtype=float), np.asarray(y, dtype=float), np.array([dt, n0, max_div], dtype=float),
+		np.frombuffer('|'.join([label, mode]).encode(), dtype=np.uint8)
+	)
+
+
+def data_features(ht, data):
+	"""
+	:param ht: (list) harvest times
+	:param data: (list) cell numbers per time point, replicate & generation
+	:return: (ndarray) log10 total cells & mean division number (means over replicates) on FEATURE_TIMES
+	"""
+	log_total, mean_div = [], []
+	for tpt in data:
+		cells = np.array([np.asarray(rep, dtype=float) for rep in tpt], dtype=float)
+		total = cells.sum(axis=1)
+		log_total.append(np.mean(np.log10(np.maximum(total, 1.))))
+		mean_div.append(np.mean(cells.dot(np.arange(cells.shape[1])) / np.maximum(total, 1.)))
+	order = np.argsort(ht)
+	times = np.asarray(ht, dtype=float)[order]
+	return np.concatenate([
+		np.interp(FEATURE_TIMES, times, np.asarray(log_total)[order]),
+		np.interp(FEATURE_TIMES, times, np.asarray(mean_div)[order])
+	])
+
+
+class FitHistory:
+	def __init__(self, path=None):
+		"""
+		:param path: (str) JSON file of the library (default : ~/.cyton_solver/fit_history.json)
+		"""
+		if path is None:
+			path = os.path.join(os.path.expanduser('~'), '.cyton_solver', 'fit_history.json')
+		self.path = path
+		self.entries = {}
+		if os.path.isfile(path):
+			try:
+				with open(path, 'r') as f:
+					self.entries = json.load(f)
+			except (OSError, ValueError):
+				self.entries = {}  # unreadable library : start a new one
+
+	def save(self):
+		os.makedirs(os.path.dirname(self.path), exist_ok=True)
+		tmp_path = self.path + '.tmp'
+		with open(tmp_path, 'w') as f:
+			json.dump(self.entries, f)
+		os.replace(tmp_path, self.path)
+
+	def record(self, label, key, features, params, rss, condition=''):
+		"""
+		Keep a fit if it is the first or the best for its key.
+
+		:param label: (str) model, pdf settings & fit mode (see model_label)
+		:param key: (str) dataset key (see dataset_key)
+		:param features: (ndarray) data features (see data_features)
+		:param params: (list) fitted parameters
+		:param rss: (float) residual sum of squares
+		:param condition: (str) name of the condition (for messages)
+		:return: (bool) True if the library was updated
+		"""
+		if not np.isfinite(rss) or not np.all(np.isfinite(params)):
+			return False
+		previous = self.entries.get(key)
+		if previous is not None and previous['rss'] <= rss:
+			return False
+		self.entries[key] = {
+			'model': label, 'features': [float(v) for v in features], 'params': [float(v) for v in params],
+			'rss': float(rss), 'condition': condition, 'time': str(datetime.now().replace(microsecond=0))
+		}
+		try:
+			self.save()
+		except OSError as ex:
+			print(" > Fit history not saved : {0}".format(ex))
+			return False
+		return True
+
+	def best(self, key):
+		return self.entries.get(key)
+
+	def nearest(self, label, features):
+		"""
+		:param label: (str) model, pdf settings & fit mode (see model_label)
+		:param features: (ndarray) data features of the new condition
+		:return: (tuple) most similar entry with the same label (None if none) & its distance
+		"""
+		best, distance = None, np.inf
+		for entry in self.entries.values():
+			if entry['model'] != label:
+				continue
+			d = float(np.linalg.norm(np.asarray(entry['features']) - features))
+			if d < distance:
+				best, distance = entry, d
+		return best, distance
+
+	def suggest(self, label, key, features):
+		"""
+		:return: (tuple) suggested initial parameters (None if the library has no fit with this label) & its source
+		"""
+		entry = self.best(key)
+		if entry is not None:
+			return entry['params'], "previous fit of the same data ({0}, RSS {1:.5e}, {2})".format(
+				entry['condition'], entry['rss'], entry['time'])
+		entry, distance = self.nearest(label, features)
+		if entry is not None:
+			return entry['params'], "fit of the most similar condition ({0}, distance {1:.3f}, {2})".format(
+				entry['condition'], distance, entry['time'])
+		return None, ''
+
+
+def warm_start(history, label, key, features, params, vary, mode):
+	"""
+	Initial parameters of a fit from the library.
+
+	:param history: (FitHistory) fit library
+	:param label: (str) model, pdf settings & fit mode (see model_label)
+	:param key: (str) dataset key
+	:param features: (ndarray) data features
+	:param params: (dict) current parameters (gvars.C1_PARAMS or gvars.C15_PARAMS)
+	:param vary: (dict) vary flags in the same order (locked parameters keep their current values)
+	:param mode: (str) 'off', 'suggest' (print only) or 'auto' (use the suggestion)
+	:return: (dict) initial parameters
+	"""
+	if mode == 'off':
+		return params
+	suggestion, source = history.suggest(label, key, features)
+	if suggestion is None:
+		return params
+	if mode != 'auto':
+		print(" > Warm start available from {0} : {1}".format(
+			source, ', '.join('{0:.4f}'.format(v) for v in suggestion)))
+		return params
+	print(" > Warm start from {0}".format(source))
+	initial = dict(params)
+	for key, var, value in zip(params.keys(), vary.values(), suggestion):
+		if var:
+			initial[key] = value
+	return initial
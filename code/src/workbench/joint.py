@@ -0,0 +1,142 @@
+"""
+This module fits Cyton 1.5 to many conditions at once while a chosen subset of parameters is shared by all conditions.
+
+The parameter vector is [shared parameters, local parameters of condition 1, ..., local parameters of condition C] and
+the residual vector is the concatenation of the residuals of every condition. Residuals of a condition only depend on
+the shared & its own local parameters, so the Jacobian is block sparse :
+
+	      shared   cnd 1   cnd 2   ...
+	cnd 1 [  X       X       0         ]
+	cnd 2 [  X       0       X         ]
+	...
+
+least_squares gets this structure as 'jac_sparsity' : finite differences (same scheme as a single Cyton 1.5 fit) perturb
+columns of different conditions together (perturbations per iteration scale with shared + local parameters of ONE
+condition) and the trust region subproblem is solved with sparse LSMR. With the analytic Jacobian, the blocks are
+assembled into a sparse matrix. Either way cost per iteration grows linearly with the number of conditions.
+"""
+
+import numpy as np
+from scipy import sparse
+from scipy.optimize import least_squares
+
+import src.common.global_vars as gvars
+from src.workbench.batch import condition_data
+from src.workbench.bootstrap import parameter_settings
+from src.workbench.fit import C15_JAC
+
+
+def joint_sparsity(sizes, n_shared, n_local):
+	"""
+	:param sizes: (list) number of residuals per condition
+	:param n_shared: (int) number of varying shared parameters
+	:param n_local: (int) number of varying local parameters per condition
+	:return: (scipy.sparse.csr_matrix) non-zero structure of the joint Jacobian
+	"""
+	blocks = [np.ones((size, n_local)) for size in sizes]
+	local = sparse.block_diag(blocks, format='csr') if n_local > 0 else sparse.csr_matrix((sum(sizes), 0))
+	return sparse.hstack([sparse.csr_matrix(np.ones((sum(sizes), n_shared))), local], format='csr')
+
+
+def joint_fit(models, xs, ys, names, values, vary, lower, upper, shared, algo_settings):
+	"""
+	Joint least squares fit of Cyton 1.5 models (one per condition) with shared parameters.
+
+	:param models: (list) Cyton15Model per condition
+	:param xs: (list) independent variable per condition
+	:param ys: (list) data per condition
+	:param names: (list) parameter names (Cyton15Model.PARAM_NAMES)
+	:param values: (ndarray) starting values (same for all conditions)
+	:param vary: (ndarray) vary flags
+	:param lower: (ndarray) lower bounds
+	:param upper: (ndarray) upper bounds
+	:param shared: (list) names of parameters shared by all conditions
+	:param algo_settings: (list) LM settings from fit dialog ['LM', max_nfev, ftol, xtol, gtol, analytic Jacobian, ...]
+	:return: (dict) fitted values per condition (C x number of parameters), RSS per condition, nfev, success & message
+	"""
+	n_cnd = len(models)
+	is_shared = np.array([name in shared for name in names]) & vary
+	shared_idx = np.flatnonzero(is_shared)
+	local_idx = np.flatnonzero(vary & ~is_shared)
+	n_shared, n_local = len(shared_idx), len(local_idx)
+
+	sizes = [len(y) for y in ys]
+	offsets = np.concatenate([[0], np.cumsum(sizes)])
+	y_all = np.concatenate(ys)
+	buffer = np.empty_like(y_all)
+
+	def unpack(p):
+		# joint parameter vector -> parameters per condition
+		matrix = np.tile(values, (n_cnd, 1))
+		matrix[:, shared_idx] = p[:n_shared]
+		matrix[:, local_idx] = p[n_shared:].reshape(n_cnd, n_local)
+		return matrix
+
+	def residual(p):
+		matrix = unpack(p)
+		for icnd in range(n_cnd):
+			buffer[offsets[icnd]:offsets[icnd+1]] = models[icnd].cyton15(xs[icnd], *matrix[icnd])
+		res = np.subtract(buffer, y_all, out=buffer)
+		residual.nfev += 1
+		if residual.nfev % 100 == 0:
+			print("ITER   " + str(residual.nfev) + "   ", ['%3.6f' % v for v in p[:n_shared]], "%.5e" % np.dot(res, res))
+		return res.copy()
+	residual.nfev = 0
+
+	def dfun(p):
+		matrix = unpack(p)
+		jacs = [models[icnd].cyton15_jacobian(xs[icnd], *matrix[icnd]) for icnd in range(n_cnd)]
+		local = sparse.block_diag([jac[:, local_idx] for jac in jacs], format='csr') if n_local > 0 \
+			else sparse.csr_matrix((len(y_all), 0))
+		return sparse.hstack([sparse.csr_matrix(np.vstack([jac[:, shared_idx] for jac in jacs])), local], format='csr')
+
+	p0 = np.concatenate([values[shared_idx], np.tile(values[local_idx], n_cnd)])
+	bounds = (
+		np.concatenate([lower[shared_idx], np.tile(lower[local_idx], n_cnd)]),
+		np.concatenate([upper[shared_idx], np.tile(upper[local_idx], n_cnd)])
+	)
+	p0 = np.clip(p0, *bounds)
+
+	use_jacobian = len(algo_settings) > 5 and algo_settings[5]
+	kws = dict(jac=dfun) if use_jacobian else dict(jac=C15_JAC, jac_sparsity=joint_sparsity(sizes, n_shared, n_local))
+	sol = least_squares(
+		residual, p0, bounds=bounds, method='trf', tr_solver='lsmr',
+		max_nfev=algo_settings[1], ftol=algo_settings[2], xtol=algo_settings[3], gtol=algo_settings[4], **kws
+	)
+
+	res = sol.fun
+	rss = np.array([np.dot(res[offsets[i]:offsets[i+1]], res[offsets[i]:offsets[i+1]]) for i in range(n_cnd)])
+	return {
+		'fitted': unpack(sol.x), 'rss': rss, 'nfev': residual.nfev, 'success': sol.success, 'message': sol.message
+	}
+
+
+def joint_batch_fit(conditions, shared, algo_settings, control=None):
+	"""
+	Joint Cyton 1.5 fit of selected conditions (cell-generation profiles) from the current parameters (gvars) & bounds.
+
+	:param conditions: (list) indices of conditions to fit
+	:param shared: (list) keys of gvars.C15_PARAMS shared by all conditions (e.g. 'unstimMuDeath', 'SubDivTime')
+	:param algo_settings: (list) LM settings from fit dialog (max_nfev, tolerances & analytic Jacobian flag are used)
+	:param control: (FitControl) run-time control of the fit
+	:return: (dict) condition index -> (fitted values, RSS)
+	"""
+	if algo_settings[0] != 'LM':
+		raise NotImplementedError("Joint fit runs least squares only : select LM to share parameters")
+	models, xs, ys = [], [], []
+	for icnd in conditions:
+		model, x, y = condition_data('cyton1.5', icnd)
+		model.control = control
+		models.append(model)
+		xs.append(x)
+		ys.append(y)
+	names, values, vary, lower, upper = parameter_settings('cyton1.5', list(gvars.C15_PARAMS.values()))
+	keys = list(gvars.C15_PARAMS.keys())
+	shared_names = [names[keys.index(key)] for key in shared]
+
+	print(" > Joint fit : {0} conditions, shared parameters {1}".format(len(conditions), shared_names))
+	result = joint_fit(models, xs, ys, names, values, vary, lower, upper, shared_names, algo_settings)
+	print(" > > {0} ({1} evaluations)".format(result['message'], result['nfev']))
+	for icnd, rss in zip(conditions, result['rss']):
+		print(" > > {0} : RSS {1:.5e}".format(gvars.CONDITIONS[icnd], rss))
+	return {icnd: (list(result['fitted'][i]), result['rss'][i]) for i, icnd in enumerate(conditions)}
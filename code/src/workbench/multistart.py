@@ -0,0 +1,152 @@
+"""
+This module runs multi-start least squares fits of Cyton models on a process pool.
+
+Starting points are Latin hypercube samples inside the parameter bounds (plus the current parameter values). Every start
+is an independent trust region fit in a worker process; results stream back as they finish and the best fit is kept.
+Workers share the best residual sum of squares found so far by any run (finished or still in flight), so a run that still
+trails it by a large factor after a number of evaluations gives up early.
+"""
+
+import numpy as np
+import psutil
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from scipy.optimize import least_squares
+from scipy.stats import qmc
+
+from src.workbench.control import FitControl, FitAborted
+from src.workbench.objective import Residual
+
+# per process state of a worker : model & data are sent once at pool start up, not with every start
+_worker = {}
+
+
+class CancelledRun(Exception):
+	pass
+
+
+def latin_hypercube(lower, upper, n, seed=None):
+	"""
+	:param lower: (ndarray) lower bounds
+	:param upper: (ndarray) upper bounds
+	:param n: (int) number of points
+	:param seed: (int) random seed
+	:return: (ndarray) points of shape (n, len(lower)) with one point per stratum along each axis
+	"""
+	sampler = qmc.LatinHypercube(d=len(lower), seed=seed)
+	return qmc.scale(sampler.random(n), lower, upper)
+
+
+def _init_worker(model, method, jac_method, x, y, abort_event, best_rss):
+	# unpickled model has no run-time control : attach one sharing the abort token of the parent process
+	model.control = FitControl(abort_event)
+	_worker.update(
+		func=getattr(model, method), jacobian=getattr(model, jac_method), x=x, y=y, best_rss=best_rss
+	)
+
+
+def _fit_from(irun, start, values, vary, lower, upper, algo_settings, jac, margin, min_nfev):
+	"""
+	Least squares fit from one starting point in a worker process.
+
+	:return: (tuple) run index, fitted values of varying parameters (None if cancelled), RSS, number of evaluations
+	"""
+	func, jacobian, x = _worker['func'], _worker['jacobian'], _worker['x']
+	best_rss = _worker['best_rss']
+	objective = Residual(func, range(len(values)), x, _worker['y'])
+
+	def full(p):
+		full_values = values.copy()
+		full_values[vary] = p
+		return full_values
+
+	def residual(p):
+		res = objective.evaluate(full(p))
+		if objective.best_rss < best_rss.value:
+			# publish the best RSS of this run while it is in flight : other runs are compared against it
+			with best_rss.get_lock():
+				best_rss.value = min(best_rss.value, objective.best_rss)
+		if objective.nfev >= min_nfev and objective.best_rss > margin * best_rss.value:
+			raise CancelledRun
+		return res.copy()
+
+	def dfun(p):
+		return jacobian(x, *full(p))[:, vary]
+
+	try:
+		sol = least_squares(
+			residual, start, jac=dfun if jac is None else jac, bounds=(lower, upper), method='trf',
+			max_nfev=algo_settings[1], ftol=algo_settings[2], xtol=algo_settings[3], gtol=algo_settings[4]
+		)
+	except (CancelledRun, FitAborted):
+		return irun, None, objective.best_rss, objective.nfev
+	return irun, sol.x, float(np.dot(sol.fun, sol.fun)), objective.nfev
+
+
+def multistart_fit(model, method, jac_method, pars, x, y, algo_settings, n_starts, jac='2-point', control=None,
+				   margin=10., min_nfev=100, seed=None, workers=None):
+	"""
+	Run least squares fits from 'n_starts' Latin hypercube points (and the current parameter values) concurrently.
+
+	:param model: (object) Cyton model, pickled once to every worker process
+	:param method: (str) name of the model function; func(x, *params) -> predictions
+	:param jac_method: (str) name of the Jacobian of the model function
+	:param pars: (lmfit.Parameters) parameters in the order of model arguments (current values & bounds)
+	:param x: (ndarray) independent variable passed to the model
+	:param y: (ndarray) data
+	:param algo_settings: (list) LM settings from fit dialog ['LM', max_nfev, ftol, xtol, gtol, analytic Jacobian, ...]
+	:param n_starts: (int) number of Latin hypercube starting points
+	:param jac: (str) finite difference scheme if the analytic Jacobian is disabled
+	:param control: (FitControl) run-time control of the fit : its abort token stops all workers
+	:param margin: (float) a run is cancelled once its best RSS exceeds margin x best RSS of all runs...
+	:param min_nfev: (int) ... after at least this many model evaluations
+	:param seed: (int) random seed of the Latin hypercube
+	:param workers: (int) number of processes (default : number of physical cores)
+	:return: (tuple) best fitted values of varying parameters, its RSS & total number of model evaluations
+	"""
+	names = list(pars.keys())
+	vary = np.array([pars[name].vary for name in names])
+	values = np.array([pars[name].value for name in names], dtype=float)
+	lower = np.array([pars[name].min for name in names], dtype=float)[vary]
+	upper = np.array([pars[name].max for name in names], dtype=float)[vary]
+	starts = np.vstack([np.clip(values[vary], lower, upper), latin_hypercube(lower, upper, n_starts, seed=seed)])
+	use_jacobian = len(algo_settings) > 5 and algo_settings[5]
+
+	if workers is None:
+		workers = int(psutil.cpu_count(logical=False) or 1)
+	if control is None:
+		control = FitControl()
+	best_rss = mp.Value('d', np.inf)
+	best, nfev = (None, np.inf), 0
+
+	print(" > Multi-start : {0} runs on {1} processes".format(len(starts), workers))
+	with ProcessPoolExecutor(
+			max_workers=workers, initializer=_init_worker,
+			initargs=(model, method, jac_method, x, y, control.abort_event, best_rss)) as pool:
+		pending = {
+			pool.submit(_fit_from, irun, start, values, vary, lower, upper, algo_settings,
+						None if use_jacobian else jac, margin, min_nfev)
+			for irun, start in enumerate(starts)
+		}
+		while pending:
+			done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+			if not control.is_running:
+				# running fits stop at their next evaluation (shared abort token)
+				for future in pending:
+					future.cancel()
+				control.check()
+			for future in done:
+				irun, solution, rss, run_nfev = future.result()
+				nfev += run_nfev
+				control.record(n=run_nfev)
+				if solution is None:
+					print(" > > run {0}: cancelled after {1} evaluations (RSS {2:.5e})".format(irun, run_nfev, rss))
+					continue
+				print(" > > run {0}: RSS {1:.5e} ({2} evaluations)".format(irun, rss, run_nfev))
+				if rss < best[1]:
+					best = (solution, rss)
+	# runs of the last batch may all have stopped on the abort token
+	control.check()
+	if best[0] is None:
+		raise RuntimeError("Multi-start : no run finished")
+	return best[0], best[1], nfev
@@ -0,0 +1,53 @@
+"""
+This module provides the residual objective used by least squares fits of Cyton models.
+
+Instead of wrapping a model in lmfit.Model (which evaluates the model, subtracts the data and squares the result in
+separate steps, then re-sums the squares in the iteration callback), the objective writes (prediction - y) * weight into
+a preallocated buffer and keeps the residual sum of squares of each call.
+"""
+
+import numpy as np
+
+
+class Residual:
+	def __init__(self, func, names, x, y, weights=None):
+		"""
+		:param func: (function) model function; func(x, *params) -> predictions
+		:param names: (list) parameter names in the order of 'func' arguments
+		:param x: (ndarray) independent variable passed to the model
+		:param y: (ndarray) data
+		:param weights: (ndarray) optional weight per data point
+		"""
+		self.func = func
+		self.names = list(names)
+		self.x = x
+		self.y = np.asarray(y, dtype=np.float64)
+		self.weights = None if weights is None else np.asarray(weights, dtype=np.float64)
+		self.buffer = np.empty_like(self.y)
+
+		self.nfev = 0  # number of objective calls
+		self.rss = np.inf  # residual sum of squares of the last call
+		self.best_rss = np.inf  # lowest residual sum of squares so far
+
+	def values(self, params):
+		# parameter values in the order of 'func' arguments from lmfit.Parameters
+		return [params[name].value for name in self.names]
+
+	def evaluate(self, values):
+		"""
+		Evaluate residuals in place. NB: the returned buffer is overwritten on the next call.
+
+		:param values: (list) parameter values in the order of 'func' arguments
+		:return: (ndarray) (prediction - y) * weight
+		"""
+		residual = np.subtract(self.func(self.x, *values), self.y, out=self.buffer)
+		if self.weights is not None:
+			np.multiply(residual, self.weights, out=residual)
+		self.rss = float(np.dot(residual, residual))
+		self.best_rss = min(self.best_rss, self.rss)
+		self.nfev += 1
+		return residual
+
+	def __call__(self, params, *args, **kws):
+		# lmfit objective : optimisers keep previous residual vectors (e.g. finite difference Jacobian), so hand them a copy
+		return self.evaluate(self.values(params)).copy()
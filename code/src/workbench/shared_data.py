@@ -0,0 +1,84 @@
+"""
+This module packs the data of one condition into a block of shared memory for worker processes.
+
+gvars.CELL_GENS_REPS & check matrices are nested lists (condition, time point, replicate, generation); pickling them for
+every worker or task costs time proportional to the number of replicates. Here the selected condition is packed once
+into contiguous arrays (time points x max. replicates x generations; missing replicates are padded & masked out, see
+data_layout.py) in multiprocessing.shared_memory. A SharedDataset pickles to the name & shape of the block only, and
+unpickling it in a worker attaches to the same memory without copying.
+"""
+
+import numpy as np
+from multiprocessing import shared_memory
+
+from src.workbench.data_layout import pack_condition
+
+
+class SharedDataset:
+	def __init__(self, data, check, num_reps, max_div, ht):
+		"""
+		Pack a condition into a new shared memory block (this object owns it : close() & unlink() when done).
+		input data format (3D list) : Ignoring icnd index
+			[ <- itpt
+				[ <- irep
+					[] <- igen
+				]
+			]
+		:param data: (list of lists) cell numbers per time point, replicate & generation
+		:param check: (list of lists) check matrix of the condition (same layout as data)
+		:param num_reps: (list) number of replicates per time point
+		:param max_div: (int) maximum division number of the condition
+		:param ht: (list) harvest times
+		"""
+		shape = (len(num_reps), max(num_reps), max_div + 1)
+		self.shm = shared_memory.SharedMemory(create=True, size=self._size(shape))
+		self.owner = True
+		self._map(shape)
+
+		pack_condition(data, check, num_reps, max_div, cells=self.cells, mask=self.mask)
+		self.num_reps[:] = num_reps
+		self.ht[:] = ht
+
+	@staticmethod
+	def _size(shape):
+		ntpt, nrep, ngen = shape
+		# float64 cells & harvest times, int64 number of replicates, then bool mask
+		return 8 * (ntpt * nrep * ngen + 2 * ntpt) + ntpt * nrep * ngen
+
+	def _map(self, shape):
+		ntpt, nrep, ngen = shape
+		self.shape = shape
+		n, buf = ntpt * nrep * ngen, self.shm.buf
+		self.cells = np.ndarray(shape, dtype=np.float64, buffer=buf, offset=0)
+		self.ht = np.ndarray(ntpt, dtype=np.float64, buffer=buf, offset=8 * n)
+		self.num_reps = np.ndarray(ntpt, dtype=np.int64, buffer=buf, offset=8 * (n + ntpt))
+		self.mask = np.ndarray(shape, dtype=np.bool_, buffer=buf, offset=8 * (n + 2 * ntpt))
+
+	def __getstate__(self):
+		# only the name & shape of the block are sent to other processes
+		return {'name': self.shm.name, 'shape': self.shape}
+
+	def __setstate__(self, state):
+		# NB: worker processes share the resource tracker of the parent, which unlinks the block at the latest on exit
+		self.shm = shared_memory.SharedMemory(name=state['name'])
+		self.owner = False
+		self._map(state['shape'])
+
+	def close(self):
+		# drop array views before releasing the buffer
+		self.cells = self.ht = self.num_reps = self.mask = None
+		self.shm.close()
+
+	def unlink(self):
+		if self.owner:
+			self.shm.unlink()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		try:
+			self.close()
+		except BufferError:
+			pass  # views still alive (e.g. leaving on an exception) : memory is released with them
+		self.unlink()
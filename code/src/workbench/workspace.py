@@ -0,0 +1,54 @@
+"""
+This module provides reusable work arrays for Cyton models.
+
+During a fit the objective function is evaluated tens of thousands of times with arrays of identical shapes. A Workspace
+keeps one array per name and hands it back zero-filled on every request, instead of allocating a new one per call.
+"""
+
+import numpy as np
+
+
+class Workspace:
+	def __init__(self, enabled=True):
+		"""
+		:param enabled: (bool) reuse buffers. If False, every request allocates a new array (used for benchmarking)
+		"""
+		self.enabled = enabled
+		self.buffers = {}
+		self.allocations = 0  # number of arrays allocated so far
+
+	def zeros(self, name, shape, dtype=np.float64):
+		"""
+		Get zero-filled work array. Allocated on first request (or when shape/dtype changes) and reused afterwards.
+		NB: the same memory is returned to the next request of 'name'. Copy the array if its values need to persist.
+
+		:param name: (str) buffer name
+		:param shape: (int or tuple) shape of the array
+		:param dtype: (numpy.dtype) data type of the array
+		:return: (ndarray) zero-filled array
+		"""
+		buffer = self.empty(name, shape, dtype)
+		buffer.fill(0)
+		return buffer
+
+	def empty(self, name, shape, dtype=np.float64):
+		"""
+		Same as 'zeros' but the content of the array is left as is (use when every entry is overwritten).
+
+		:param name: (str) buffer name
+		:param shape: (int or tuple) shape of the array
+		:param dtype: (numpy.dtype) data type of the array
+		:return: (ndarray) uninitialised array
+		"""
+		shape = (shape,) if np.isscalar(shape) else tuple(shape)
+		buffer = self.buffers.get(name)
+		if not self.enabled or buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+			buffer = np.empty(shape, dtype=dtype)
+			self.allocations += 1
+			if self.enabled:
+				self.buffers[name] = buffer
+		return buffer
+
+	def clear(self):
+		# release all buffers (e.g. after changing time grid)
+		self.buffers = {}